@@ -1,24 +1,193 @@
 # agents/drone_agent.py
 
+import json
 import random
 
+import numpy as np
+
+from agents.metrics import timed
+from agents.signal_timing import DIRECTIONS
+from config import DRONE_SCAN_MAX_AGE_SECONDS
+
+EMERGENCY_PROBABILITY = 1 / 3
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+
+class DroneScan:
+    """
+    One scan of many intersections: congestion, emergency and approach
+    (index into DIRECTIONS) arrays aligned with `intersections`.
+    """
+
+    __slots__ = ("intersections", "congestion", "emergency", "approach", "index")
+
+    def __init__(self, intersections, congestion, emergency, approach):
+        self.intersections = list(intersections)
+        self.congestion = np.asarray(congestion, dtype=float)
+        self.emergency = np.asarray(emergency, dtype=bool)
+        self.approach = np.asarray(approach, dtype=np.int8)
+        self.index = {name: row for row, name in enumerate(self.intersections)}
+
+    def __len__(self):
+        return len(self.intersections)
+
+    def __contains__(self, intersection):
+        return intersection in self.index
+
+    def get(self, intersection):
+        """
+        scan_traffic-style dict for one intersection, or None if it was not
+        scanned.
+        """
+        row = self.index.get(intersection)
+        if row is None:
+            return None
+        return {
+            "congestion_metric": float(self.congestion[row]),
+            "emergency_detected": bool(self.emergency[row]),
+            "approach_direction": DIRECTIONS[self.approach[row]],
+        }
+
+    def to_dict(self):
+        return {name: self.get(name) for name in self.intersections}
+
+
+class RandomDroneBackend:
+    def __init__(self, seed=None):
+        """
+        Simulated detections: uniform congestion, an emergency one scan in
+        three and a uniform approach direction, drawn for all intersections
+        at once from a NumPy generator.
+        """
+        self.np_rng = np.random.default_rng(seed)
+
+    def scan(self, intersections):
+        n = len(intersections)
+        return DroneScan(
+            intersections,
+            self.np_rng.random(n),
+            self.np_rng.random(n) < EMERGENCY_PROBABILITY,
+            self.np_rng.integers(0, len(DIRECTIONS), n),
+        )
+
+
+class RecordedDroneBackend:
+    def __init__(self, scans, loop=True):
+        """
+        Replays recorded detections, one recorded scan per scan() call.
+
+        Parameters:
+            scans (str or list): JSONL file written by write_scan_log, or a
+                list of {intersection: scan dict} mappings.
+            loop (bool): Start over after the last recorded scan; otherwise
+                keep returning the last one.
+        """
+        if isinstance(scans, str):
+            with open(scans) as f:
+                scans = [json.loads(line) for line in f if line.strip()]
+        if not scans:
+            raise ValueError("No recorded drone scans.")
+        self.scans = scans
+        self.loop = loop
+        self.position = 0
+        self.last = None  # index of the scan last returned by scan()
+
+    def scan(self, intersections):
+        self.last = self.position
+        self.position += 1
+        if self.position == len(self.scans):
+            self.position = 0 if self.loop else self.position - 1
+        return self._scan(self.scans[self.last], intersections)
+
+    def peek(self, intersections):
+        """
+        The last recorded scan returned by scan() (the first before any),
+        without advancing the recording.
+        """
+        index = self.position if self.last is None else self.last
+        return self._scan(self.scans[index], intersections)
+
+    def _scan(self, recorded, intersections):
+        missing = {"congestion_metric": 0.0, "emergency_detected": False}
+        scans = [recorded.get(name, missing) for name in intersections]
+        return DroneScan(
+            intersections,
+            [scan["congestion_metric"] for scan in scans],
+            [scan["emergency_detected"] for scan in scans],
+            [DIRECTION_CODES[scan.get("approach_direction", "N")] for scan in scans],
+        )
+
+
+def write_scan_log(path, scans):
+    """
+    Write DroneScans as JSONL for RecordedDroneBackend.
+    """
+    with open(path, "w") as f:
+        for scan in scans:
+            f.write(json.dumps(scan.to_dict()) + "\n")
+
 
 class DroneAgent:
-    def __init__(self):
-        pass
+    def __init__(self, rng=None, backend=None, max_scan_age=DRONE_SCAN_MAX_AGE_SECONDS):
+        """
+        Parameters:
+            rng (random.Random): Seeds the default random backend (default:
+                the module-level generator); pass a seeded one for
+                reproducible runs.
+            backend: Detection source with a scan(intersections) method
+                returning a DroneScan, e.g. RecordedDroneBackend or an
+                external detection feed. Defaults to RandomDroneBackend.
+            max_scan_age (float): How long (in the units of scan_all's
+                `step`, simulated seconds in the simulation) a batched scan
+                answers scan_traffic().
+        """
+        self.rng = rng or random
+        self.backend = backend or RandomDroneBackend(self.rng.getrandbits(64))
+        self.max_scan_age = max_scan_age
+        self.current_scan = None
+        self._scan_key = None
+
+    @timed("drone.scan_all")
+    def scan_all(self, intersections, step=None):
+        """
+        Scan every intersection in one batch. The result is cached for
+        `step` (a step number or scan time): repeated calls with the same
+        step return it, and scan_traffic() answers from it in O(1).
+        """
+        if step is not None and step == self._scan_key and self.current_scan:
+            return self.current_scan
+        self.current_scan = self.backend.scan(list(intersections))
+        self._scan_key = step
+        return self.current_scan
 
-    def scan_traffic(self, intersection):
+    def fresh_scan(self, now=None):
         """
-        Simulate an aerial scan:
+        The last scan_all() result, or None once it is `max_scan_age` or
+        more older than `now`. Without `now` the last scan is returned.
+        """
+        scan = self.current_scan
+        if scan is None or now is None or self._scan_key is None:
+            return scan
+        if not 0 <= now - self._scan_key < self.max_scan_age:
+            return None
+        return scan
+
+    @timed("drone.scan_traffic")
+    def scan_traffic(self, intersection, now=None):
+        """
+        Aerial scan of one intersection:
           - Returns a congestion metric.
-          - Randomly indicates if an emergency is detected.
+          - Indicates if an emergency is detected.
           - Also provides the detected approach direction (one of "N", "S", "E", "W").
+        Answered from the scan_all() still fresh at `now` when it covered the
+        intersection, so every lookup in a step agrees. Otherwise the backend
+        is asked for this intersection alone; recorded backends are peeked
+        so the lookup does not use up a recorded scan.
         """
-        congestion_metric = random.uniform(0, 1)
-        emergency_detected = random.choice([True, False, False])
-        approach_direction = random.choice(["N", "S", "E", "W"])
-        return {
-            "congestion_metric": congestion_metric,
-            "emergency_detected": emergency_detected,
-            "approach_direction": approach_direction,
-        }
+        current = self.fresh_scan(now)
+        if current is not None:
+            scan = current.get(intersection)
+            if scan is not None:
+                return scan
+        scan = getattr(self.backend, "peek", self.backend.scan)
+        return scan([intersection]).get(intersection)
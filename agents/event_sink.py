@@ -0,0 +1,433 @@
+# agents/event_sink.py
+
+import atexit
+import json
+import sys
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+
+from config import EVENT_FLUSH_EVENTS, EVENT_LOG_FILE, EVENT_SINK
+
+# ANSI escape sequences for colored terminal output
+ANSI_RESET = "\033[0m"
+ANSI_GREEN = "\033[92m"
+ANSI_YELLOW = "\033[93m"
+ANSI_RED = "\033[91m"
+ANSI_BLUE = "\033[94m"
+ANSI_CYAN = "\033[96m"
+ANSI_MAGENTA = "\033[95m"
+
+
+def color_text(text, color):
+    return f"{color}{text}{ANSI_RESET}"
+
+
+class SimEvent:
+    """
+    Base class for structured simulation output. Subclasses list their
+    fields in __slots__; `time` is the simulated time in seconds when known.
+    """
+
+    __slots__ = ("time",)
+    kind = None
+
+    def to_dict(self):
+        record = {"kind": self.kind}
+        for cls in reversed(type(self).__mro__):
+            for name in cls.__dict__.get("__slots__", ()):
+                record[name] = getattr(self, name)
+        return record
+
+
+class SimulationStarted(SimEvent):
+    __slots__ = ("scenario", "duration")
+    kind = "simulation_started"
+
+    def __init__(self, scenario, duration=None, time=None):
+        self.scenario = scenario
+        self.duration = duration
+        self.time = time
+
+
+class StepStarted(SimEvent):
+    __slots__ = ("step",)
+    kind = "step_started"
+
+    def __init__(self, step=None, time=None):
+        self.step = step
+        self.time = time
+
+
+class SignalStateEvent(SimEvent):
+    __slots__ = ("intersection", "state")
+    kind = "signal_state"
+
+    def __init__(self, intersection, state, time=None):
+        self.intersection = intersection
+        self.state = state  # SignalState or {direction: {...}} dict
+        self.time = time
+
+
+class DroneEmergency(SimEvent):
+    __slots__ = ("intersection",)
+    kind = "drone_emergency"
+
+    def __init__(self, intersection, time=None):
+        self.intersection = intersection
+        self.time = time
+
+
+class VehicleStatus(SimEvent):
+    __slots__ = ("vehicle_id", "message", "intersection", "wait_time")
+    kind = "vehicle_status"
+
+    def __init__(self, vehicle_id, message, intersection, wait_time, time=None):
+        self.vehicle_id = vehicle_id
+        self.message = message
+        self.intersection = intersection
+        self.wait_time = wait_time
+        self.time = time
+
+
+class VehicleUpdate(SimEvent):
+    __slots__ = ("vehicle_id", "message")
+    kind = "vehicle_update"
+
+    def __init__(self, vehicle_id, message, time=None):
+        self.vehicle_id = vehicle_id
+        self.message = message
+        self.time = time
+
+
+class ModeChange(SimEvent):
+    __slots__ = ("vehicle_id", "mode", "smart_vehicle")
+    kind = "mode_change"
+
+    def __init__(self, vehicle_id, mode, smart_vehicle, time=None):
+        self.vehicle_id = vehicle_id
+        self.mode = mode
+        self.smart_vehicle = smart_vehicle
+        self.time = time
+
+
+class SignalOverride(SimEvent):
+    __slots__ = ("intersection", "approach_direction", "state")
+    kind = "signal_override"
+
+    def __init__(self, intersection, approach_direction, state=None, time=None):
+        self.intersection = intersection
+        self.approach_direction = approach_direction
+        self.state = state
+        self.time = time
+
+
+class RouteDecision(SimEvent):
+    __slots__ = ("vehicle_id", "message")
+    kind = "route_decision"
+
+    def __init__(self, vehicle_id, message, time=None):
+        self.vehicle_id = vehicle_id
+        self.message = message
+        self.time = time
+
+
+class IncidentEvent(SimEvent):
+    __slots__ = ("vehicle_id", "intersection")
+    kind = "incident"
+
+    def __init__(self, vehicle_id, intersection, time=None):
+        self.vehicle_id = vehicle_id
+        self.intersection = intersection
+        self.time = time
+
+
+class FairnessRanking(SimEvent):
+    __slots__ = ("ranking",)
+    kind = "fairness_ranking"
+
+    def __init__(self, ranking, time=None):
+        self.ranking = ranking  # [(intersection, wait_time), ...] highest first
+        self.time = time
+
+
+class FlowCacheStats(SimEvent):
+    __slots__ = ("hits", "misses")
+    kind = "flow_cache_stats"
+
+    def __init__(self, hits, misses, time=None):
+        self.hits = hits
+        self.misses = misses
+        self.time = time
+
+
+class EventSink:
+    """
+    Destination for SimEvents. Emitters check `enabled` before building an
+    event, so a disabled sink costs one attribute read per call site.
+    """
+
+    enabled = True
+
+    def emit(self, event):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class NullSink(EventSink):
+    """
+    Discards everything; use for headless and benchmark runs.
+    """
+
+    enabled = False
+
+    def emit(self, event):
+        pass
+
+
+class ConsoleSink(EventSink):
+    def __init__(self, stream=None, flush_lines=1):
+        """
+        Coloured terminal renderer producing the simulation's classic output.
+
+        Rendered lines are buffered and written in one call once
+        `flush_lines` have accumulated (1 writes every event immediately),
+        and on flush().
+        """
+        self.stream = stream
+        self.flush_lines = flush_lines
+        self._lines = []
+        self._render = {
+            SimulationStarted.kind: self._simulation_started,
+            StepStarted.kind: self._step_started,
+            SignalStateEvent.kind: self._signal_state,
+            DroneEmergency.kind: self._drone_emergency,
+            VehicleStatus.kind: self._vehicle_status,
+            VehicleUpdate.kind: self._vehicle_update,
+            ModeChange.kind: self._mode_change,
+            SignalOverride.kind: self._signal_override,
+            RouteDecision.kind: self._route_decision,
+            IncidentEvent.kind: self._incident,
+            FairnessRanking.kind: self._fairness_ranking,
+            FlowCacheStats.kind: self._flow_cache_stats,
+        }
+
+    def emit(self, event):
+        self._render[event.kind](event, self._lines)
+        if len(self._lines) >= self.flush_lines:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            stream = self.stream or sys.stdout
+            stream.write("\n".join(self._lines) + "\n")
+            self._lines = []
+
+    def _simulation_started(self, event, out):
+        if event.duration is None:
+            header = f"--- Starting Simulation: {event.scenario.upper()} ---"
+        else:
+            header = f"--- Starting Event Simulation: {event.scenario.upper()} ({event.duration}s) ---"
+        out.append(color_text(header, ANSI_CYAN))
+
+    def _step_started(self, event, out):
+        if event.step is not None:
+            out.append(
+                color_text(f"\n=== Simulation Step {event.step} ===", ANSI_MAGENTA)
+            )
+        else:
+            out.append(color_text(f"\n=== t={event.time:.0f}s ===", ANSI_MAGENTA))
+
+    def _signal_state(self, event, out):
+        out.append(color_text(f"\nIntersection: {event.intersection}", ANSI_BLUE))
+        # Display signal state for each direction with color-coded lights and emojis.
+        for direction, state in event.state.items():
+            current = state["current_color"].upper()
+            if current == "GREEN":
+                color = ANSI_GREEN
+                circle = "🟢"
+            elif current == "YELLOW":
+                color = ANSI_YELLOW
+                circle = "🟡"
+            elif current == "RED":
+                color = ANSI_RED
+                circle = "🔴"
+            else:
+                color = ANSI_RESET
+                circle = ""
+            out.append(
+                f"  {direction}: {color_text(current + ' ' + circle, color)}  (Time Remaining: {state['time_remaining']}s, Next: {state['next_color']})"
+            )
+
+    def _drone_emergency(self, event, out):
+        out.append(
+            color_text(
+                f"  [DroneAgent] Emergency detected at {event.intersection}! Prioritizing emergency response.",
+                ANSI_RED,
+            )
+        )
+
+    def _vehicle_status(self, event, out):
+        out.append(color_text(f"\n[SmartVehicleAgent] {event.message}", ANSI_CYAN))
+        out.append(
+            f"  Vehicle {event.vehicle_id} at intersection {event.intersection} current wait time: {event.wait_time}s"
+        )
+
+    def _vehicle_update(self, event, out):
+        out.append(
+            f"[SmartVehicleAgent] Sending update to {event.vehicle_id}: {event.message}"
+        )
+
+    def _mode_change(self, event, out):
+        if event.smart_vehicle:
+            out.append(f"[Vehicle] {event.vehicle_id} updated mode to {event.mode}.")
+        else:
+            out.append(
+                f"[Vehicle] {event.vehicle_id} is not smart, remains in normal mode."
+            )
+
+    def _signal_override(self, event, out):
+        out.append(
+            color_text(
+                f"  [EMERGENCY OVERRIDE] Intersection {event.intersection} signals overridden: GREEN for {event.approach_direction}; RED for others.",
+                ANSI_RED,
+            )
+        )
+
+    def _route_decision(self, event, out):
+        out.append(f"  [RoutingAgent] {event.message}")
+
+    def _incident(self, event, out):
+        out.append(
+            color_text(
+                f"  [IncidentAgent] Incident detected near vehicle {event.vehicle_id}!",
+                ANSI_RED,
+            )
+        )
+
+    def _fairness_ranking(self, event, out):
+        out.append(
+            color_text(
+                "\n[FairnessAgent] Fairness-based priority (highest wait times):",
+                ANSI_YELLOW,
+            )
+        )
+        for intersection, wait_time in event.ranking:
+            out.append(f"  {intersection}: Wait Time {wait_time}")
+
+    def _flow_cache_stats(self, event, out):
+        out.append(
+            color_text(
+                f"\n[FlowDataProvider] cache hits: {event.hits}, misses: {event.misses}",
+                ANSI_CYAN,
+            )
+        )
+
+
+def _json_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonlSink(EventSink):
+    def __init__(self, path=EVENT_LOG_FILE, flush_events=EVENT_FLUSH_EVENTS):
+        """
+        Appends one JSON object per event to `path`. Events are kept as
+        objects until `flush_events` have accumulated (or flush()/close() is
+        called), so serialization happens in batches off the per-event path.
+        """
+        self.path = path
+        self.flush_events = flush_events
+        self._events = []
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def emit(self, event):
+        with self._lock:
+            self._events.append(event)
+            if len(self._events) < self.flush_events:
+                return
+            events, self._events = self._events, []
+        self._write(events)
+
+    def _write(self, events):
+        lines = [
+            json.dumps(event.to_dict(), default=_json_default) + "\n"
+            for event in events
+        ]
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+        if events:
+            self._write(events)
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.close)
+
+
+class MultiSink(EventSink):
+    """
+    Fans events out to several sinks, e.g. the console and a JSONL log.
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = [sink for sink in sinks if sink.enabled]
+        self.enabled = bool(self.sinks)
+
+    def emit(self, event):
+        for sink in self.sinks:
+            sink.emit(event)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def make_sink(kind=EVENT_SINK, path=EVENT_LOG_FILE, flush_lines=1):
+    """
+    Build a sink by name: "console", "jsonl", "both" or "quiet".
+    """
+    if kind == "console":
+        return ConsoleSink(flush_lines=flush_lines)
+    if kind == "jsonl":
+        return JsonlSink(path)
+    if kind == "both":
+        return MultiSink(ConsoleSink(flush_lines=flush_lines), JsonlSink(path))
+    if kind == "quiet":
+        return NullSink()
+    raise ValueError(f"Unknown event sink: {kind}")
+
+
+_default_sink = None
+
+
+def get_default_sink():
+    """
+    Process-wide sink used by agents and vehicles that are not given one.
+    """
+    global _default_sink
+    if _default_sink is None:
+        _default_sink = ConsoleSink()
+    return _default_sink
+
+
+def set_default_sink(sink):
+    global _default_sink
+    _default_sink = sink
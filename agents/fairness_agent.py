@@ -1,14 +1,290 @@
 # agents/fairness_agent.py
 
-from collections import defaultdict
+import heapq
+from collections.abc import Mapping
+
+import numpy as np
+
+from agents.metrics import timed
+from config import FAIRNESS_DECAY, FAIRNESS_RESET_ON_GREEN
+
+# Stored waits are divided by a shared scale factor so decay is O(1); they
+# are renormalized before the factor underflows.
+MIN_SCALE = 1e-150
+
+
+class WaitTimes(Mapping):
+    """
+    Read-only {intersection: wait time} view of a FairnessAgent, in
+    insertion order. Unknown intersections read as 0.
+    """
+
+    __slots__ = ("_agent",)
+
+    def __init__(self, agent):
+        self._agent = agent
+
+    def __getitem__(self, intersection):
+        row = self._agent.index.get(intersection)
+        if row is None:
+            return 0
+        return float(self._agent._values[row] * self._agent._scale)
+
+    def get(self, intersection, default=None):
+        row = self._agent.index.get(intersection)
+        if row is None:
+            return default
+        return float(self._agent._values[row] * self._agent._scale)
+
+    def __contains__(self, intersection):
+        return intersection in self._agent.index
+
+    def __iter__(self):
+        return iter(self._agent.names)
+
+    def __len__(self):
+        return len(self._agent.names)
+
+    def __repr__(self):
+        return f"WaitTimes({dict(self)!r})"
 
 
 class FairnessAgent:
-    def __init__(self):
-        self.wait_times = defaultdict(int)
+    def __init__(
+        self, decay=FAIRNESS_DECAY, reset_on_green=FAIRNESS_RESET_ON_GREEN, capacity=64
+    ):
+        """
+        Tracks accumulated wait per intersection and ranks the most starved.
+
+        Waits live in an array with an indexed max-heap over it, so single
+        updates cost O(log n) and top_k(k) is answered in O(k log k). A
+        batched update is one vectorized add that marks the heap stale;
+        top_k() then answers with an argpartition over the array, and the
+        heap is rebuilt in NumPy only when a single update needs it.
+        `wait_times` is a read-only mapping view for existing callers.
+
+        Parameters:
+            decay (float): Factor applied to every wait on each decay() call
+                (1.0 keeps waits growing without bound).
+            reset_on_green (bool): on_green() zeroes the intersection's wait.
+            capacity (int): Initial number of intersection slots.
+        """
+        self.decay_factor = decay
+        self.reset_on_green = reset_on_green
+        self.names = []
+        self.index = {}  # intersection -> row
+        self._values = np.zeros(capacity)
+        self._scale = 1.0
+        self._heap = []  # rows, max-heap ordered by (wait desc, row asc)
+        self._pos = []  # row -> position in _heap
+        self._stale = False  # _values changed in batch since the heap was built
+        self.wait_times = WaitTimes(self)
+
+    def _row(self, intersection):
+        row = self.index.get(intersection)
+        if row is None:
+            row = len(self.names)
+            if row >= len(self._values):
+                grown = np.zeros(2 * len(self._values))
+                grown[:row] = self._values[:row]
+                self._values = grown
+            self.names.append(intersection)
+            self.index[intersection] = row
+            self._heap.append(row)
+            self._pos.append(row)
+            if not self._stale:
+                self._sift_up(row)
+        return row
 
+    def rows(self, intersections):
+        """
+        Rows for a list of intersections, registering new ones.
+        """
+        return np.fromiter(
+            (self._row(name) for name in intersections),
+            dtype=np.intp,
+            count=len(intersections),
+        )
+
+    def _before(self, a, b):
+        values = self._values
+        return values[a] > values[b] or (values[a] == values[b] and a < b)
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._pos[heap[i]] = i
+        self._pos[heap[j]] = j
+
+    def _sift_up(self, row):
+        i = self._pos[row]
+        while i > 0:
+            parent = (i - 1) // 2
+            if not self._before(self._heap[i], self._heap[parent]):
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, row):
+        heap = self._heap
+        n = len(heap)
+        i = self._pos[row]
+        while True:
+            best = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self._before(heap[child], heap[best]):
+                    best = child
+            if best == i:
+                break
+            self._swap(i, best)
+            i = best
+
+    def _ranked(self, rows=None):
+        """
+        `rows` (default: all) ordered by (wait desc, row asc).
+        """
+        if rows is None:
+            rows = np.arange(len(self.names))
+        return rows[np.lexsort((rows, -self._values[rows]))]
+
+    def _ensure_heap(self):
+        if not self._stale:
+            return
+        # A list sorted by (wait desc, row asc) is a valid heap.
+        order = self._ranked()
+        self._heap = order.tolist()
+        pos = np.empty(len(order), dtype=np.intp)
+        pos[order] = np.arange(len(order))
+        self._pos = pos.tolist()
+        self._stale = False
+
+    @timed("fairness.update_fairness")
     def update_fairness(self, intersection, added_time):
-        self.wait_times[intersection] += added_time
+        row = self._row(intersection)
+        self._ensure_heap()
+        self._values[row] += added_time / self._scale
+        if added_time >= 0:
+            self._sift_up(row)
+        else:
+            self._sift_down(row)
+
+    @timed("fairness.update_many")
+    def update_many(self, intersections, added_times):
+        """
+        Batched update_fairness: add added_times[i] to intersections[i].
+        `intersections` may be names or rows from rows().
+        """
+        if isinstance(intersections, np.ndarray) and intersections.dtype.kind in "iu":
+            rows = intersections
+        else:
+            rows = self.rows(list(intersections))
+        added = np.asarray(added_times, dtype=float) / self._scale
+        np.add.at(self._values, rows, added)
+        self._stale = True
+
+    def decay(self, steps=1):
+        """
+        Multiply every wait by decay_factor ** steps. O(1): ranking order is
+        unchanged, so the heap stays valid.
+        """
+        if self.decay_factor == 1.0:
+            return
+        self._scale *= self.decay_factor**steps
+        if self._scale < MIN_SCALE:
+            n = len(self.names)
+            self._values[:n] *= self._scale
+            self._scale = 1.0
+
+    def reset(self, intersection):
+        row = self.index.get(intersection)
+        if row is not None and self._values[row] != 0:
+            self._ensure_heap()
+            self._values[row] = 0.0
+            self._sift_down(row)
+
+    def reset_many(self, intersections):
+        """
+        Batched reset; `intersections` may be names or rows from rows().
+        """
+        if isinstance(intersections, np.ndarray) and intersections.dtype.kind in "iu":
+            rows = intersections
+        else:
+            rows = self.rows(list(intersections))
+        if len(rows):
+            self._values[rows] = 0.0
+            self._stale = True
+
+    def waits(self):
+        """
+        Wait per intersection as an array aligned with `names`.
+        """
+        return self._values[: len(self.names)] * self._scale
+
+    def load_waits(self, intersections, waits):
+        """
+        Replace all state with `waits` aligned to `intersections`. The
+        array is adopted without copying (e.g. a memory-mapped snapshot
+        section) until new intersections make it grow.
+        """
+        self.names = list(intersections)
+        self.index = {name: row for row, name in enumerate(self.names)}
+        self._values = waits if len(waits) else np.zeros(64)
+        self._scale = 1.0
+        self._heap = list(range(len(self.names)))
+        self._pos = list(range(len(self.names)))
+        self._stale = True
+
+    def on_green(self, intersection):
+        """
+        Called when an intersection's prioritized approach turns green.
+        """
+        if self.reset_on_green:
+            self.reset(intersection)
+
+    def top_k(self, k):
+        """
+        The k most starved intersections as (intersection, wait) pairs,
+        highest wait first.
+        """
+        heap = self._heap
+        if not heap or k <= 0:
+            return []
+        values = self._values
+        scale = self._scale
+        if self._stale:
+            n = len(self.names)
+            if k < n:
+                # Everything tied with the k-th largest wait, so ties keep
+                # insertion order.
+                kth = np.partition(values[:n], n - k)[n - k]
+                rows = self._ranked(np.flatnonzero(values[:n] >= kth))[:k]
+            else:
+                rows = self._ranked()
+            return [
+                (self.names[row], wait)
+                for row, wait in zip(rows.tolist(), (values[rows] * scale).tolist())
+            ]
+        result = []
+        # Frontier of heap positions keyed like the heap: (-wait, row, position).
+        frontier = [(-values[heap[0]], heap[0], 0)]
+        while frontier and len(result) < k:
+            _, row, i = heapq.heappop(frontier)
+            result.append((self.names[row], float(values[row] * scale)))
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    child_row = heap[child]
+                    heapq.heappush(frontier, (-values[child_row], child_row, child))
+        return result
 
-    def get_fair_signal_plan(self):
-        return sorted(self.wait_times.items(), key=lambda x: -x[1])
+    @timed("fairness.get_fair_signal_plan")
+    def get_fair_signal_plan(self, k=None):
+        """
+        Intersections ranked by wait, highest first; only the top k when
+        `k` is given.
+        """
+        if k is not None:
+            return self.top_k(k)
+        order = self._ranked()
+        waits = (self._values[order] * self._scale).tolist()
+        names = self.names
+        return [(names[row], wait) for row, wait in zip(order.tolist(), waits)]
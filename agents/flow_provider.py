@@ -0,0 +1,253 @@
+# agents/flow_provider.py
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from agents.metrics import get_metrics
+from config import (
+    API_KEY,
+    FLOW_API_URL,
+    FLOW_CACHE_MAX_ENTRIES,
+    FLOW_CACHE_TTL_SECONDS,
+    FLOW_FETCH_WORKERS,
+    FLOW_REQUEST_TIMEOUT_SECONDS,
+    FLOW_STEP_DEADLINE_SECONDS,
+)
+
+
+class _PendingFetch:
+    """
+    A lookup that is currently in flight. Callers asking for the same point
+    wait on it instead of issuing their own request.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class FlowDataProvider:
+    def __init__(
+        self,
+        ttl_seconds=FLOW_CACHE_TTL_SECONDS,
+        max_entries=FLOW_CACHE_MAX_ENTRIES,
+        url=FLOW_API_URL,
+        api_key=API_KEY,
+        request_timeout=FLOW_REQUEST_TIMEOUT_SECONDS,
+        max_workers=FLOW_FETCH_WORKERS,
+        rng=None,
+        recorder=None,
+    ):
+        """
+        Shared source of TomTom flowSegmentData for all agents.
+
+        Parameters:
+            ttl_seconds (float): How long a fetched point stays fresh.
+            max_entries (int): Cache size; least recently used points are evicted first.
+            url (str): flowSegmentData endpoint.
+            api_key (str): TomTom API key.
+            request_timeout (float): Per-request connect/read timeout in seconds.
+            max_workers (int): Threads (and pooled keep-alive connections) used by fetch_many.
+            rng (random.Random): Source for synthetic fallback data; seed it for reproducible runs.
+            recorder (FlowTraceWriter): Receives every successful API response.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.url = url
+        self.api_key = api_key
+        self.request_timeout = request_timeout
+        self.max_workers = max_workers
+        self.rng = rng or random
+        self.recorder = recorder
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # point -> (expires_at, flow_data)
+        self._pending = {}  # point -> _PendingFetch
+        self._lock = threading.Lock()
+        self._session = None
+        self._executor = None
+
+    def get_flow_data(self, lat, lon):
+        """
+        Return the flowSegmentData dict for a point, from the cache when fresh.
+        Concurrent requests for the same point share a single API call.
+        """
+        flow_data = self._fetch(lat, lon)
+        if flow_data is None:
+            flow_data = synthetic_flow_data(self.rng)
+        return flow_data
+
+    def _fetch(self, lat, lon):
+        """
+        get_flow_data() without the synthetic fallback: None when the API
+        call failed. Safe to run on worker threads since it never draws from
+        `rng`.
+        """
+        point = (lat, lon)
+        with self._lock:
+            entry = self._cache.get(point)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(point)
+                self.hits += 1
+                return entry[1]
+            pending = self._pending.get(point)
+            if pending is None:
+                self.misses += 1
+                pending = self._pending[point] = _PendingFetch()
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+        if not owner:
+            pending.done.wait()
+            return pending.result
+
+        flow_data, ok = self._request(lat, lon)
+        if ok and self.recorder is not None:
+            self.recorder.record(lat, lon, flow_data)
+        with self._lock:
+            if ok:
+                self._store(point, flow_data)
+            del self._pending[point]
+        pending.result = flow_data if ok else None
+        pending.done.set()
+        return pending.result
+
+    def fetch_many(self, points, deadline=FLOW_STEP_DEADLINE_SECONDS, fallback=True):
+        """
+        Fetch flow data for every point needed in a step concurrently.
+
+        Returns a dict mapping each (lat, lon) to its flowSegmentData. Points
+        that are not answered within `deadline` seconds get synthetic data;
+        their requests keep running and fill the cache for later steps.
+        Synthetic data is drawn here, in point order, so a seeded `rng`
+        gives the same values whichever requests finish first. Without
+        `fallback`, failed and late points map to None instead.
+        """
+        results = {}
+        futures = {}
+        now = time.monotonic()
+        with self._lock:
+            for point in points:
+                if point in results or point in futures:
+                    continue
+                entry = self._cache.get(point)
+                if entry is not None and entry[0] > now:
+                    self._cache.move_to_end(point)
+                    self.hits += 1
+                    results[point] = entry[1]
+                else:
+                    futures[point] = None
+        if not futures:
+            return results
+
+        executor = self._get_executor()
+        for point in futures:
+            futures[point] = executor.submit(self._fetch, *point)
+        wait(futures.values(), timeout=deadline)
+        for point, future in futures.items():
+            flow_data = future.result() if future.done() else None
+            if flow_data is None:
+                if not future.done():
+                    get_metrics().count("flow_provider.deadline_misses")
+                if fallback:
+                    flow_data = synthetic_flow_data(self.rng)
+            results[point] = flow_data
+        return results
+
+    def _store(self, point, flow_data):
+        self._cache[point] = (time.monotonic() + self.ttl_seconds, flow_data)
+        self._cache.move_to_end(point)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _request(self, lat, lon):
+        """
+        Call the flowSegmentData endpoint. Returns (flow_data, ok); flow_data
+        is None when the call failed.
+        """
+        params = {"point": f"{lat},{lon}", "unit": "KMPH", "key": self.api_key}
+        metrics = get_metrics()
+        metrics.count("flow_provider.requests")
+        try:
+            with metrics.timer("flow_provider.request"):
+                response = self._get_session().get(
+                    self.url, params=params, timeout=self.request_timeout
+                )
+            if response.status_code == 200:
+                return response.json().get("flowSegmentData", {}), True
+            print("Error fetching traffic data:", response.status_code, response.text)
+        except Exception as e:
+            print("Exception during API call:", e)
+        metrics.count("flow_provider.errors")
+        return None, False
+
+    def _get_session(self):
+        if self._session is None:
+            # Deferred so replayed and stubbed runs never import requests.
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=1, pool_maxsize=self.max_workers
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="flow-fetch",
+                    )
+        return self._executor
+
+    def close(self):
+        """
+        Release the worker threads and pooled connections.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._cache),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def synthetic_flow_data(rng=random):
+    return {"currentSpeed": rng.randint(10, 60), "freeFlowSpeed": 60}
+
+
+_default_provider = None
+
+
+def get_default_provider():
+    """
+    Process-wide provider used by agents that are not given one explicitly.
+    """
+    global _default_provider
+    if _default_provider is None:
+        _default_provider = FlowDataProvider()
+    return _default_provider
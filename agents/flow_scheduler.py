@@ -0,0 +1,404 @@
+# agents/flow_scheduler.py
+
+import math
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from agents.flow_provider import synthetic_flow_data
+from agents.metrics import get_metrics, timed
+from config import (
+    FLOW_MAX_STALENESS_SECONDS,
+    FLOW_PRIORITY_BASE,
+    FLOW_PRIORITY_CHANGE,
+    FLOW_PRIORITY_EMERGENCY,
+    FLOW_PRIORITY_ERROR,
+    FLOW_PRIORITY_WAIT,
+    FLOW_QUOTA_BURST_SECONDS,
+    FLOW_QUOTA_PER_DAY,
+    FLOW_QUOTA_PER_SECOND,
+    FLOW_QUOTA_USAGE_FILE,
+)
+
+SECONDS_PER_DAY = 86400
+CHANGE_SMOOTHING = 0.5  # weight of the newest sample in the change-rate average
+
+
+class RequestBudget:
+    def __init__(
+        self,
+        per_second=FLOW_QUOTA_PER_SECOND,
+        per_day=FLOW_QUOTA_PER_DAY,
+        burst_seconds=FLOW_QUOTA_BURST_SECONDS,
+        clock=time.monotonic,
+        wall_clock=time.time,
+        usage_file=None,
+    ):
+        """
+        Global API request budget: a token bucket refilled at `per_second`
+        (holding at most `burst_seconds` worth of tokens) and a cap of
+        `per_day` requests per UTC calendar day, which is how the API counts
+        its quota. None disables either limit.
+
+        Parameters:
+            clock (callable): Monotonic seconds for the token bucket.
+            wall_clock (callable): Epoch seconds; decides the UTC day.
+            usage_file (str): Requests spent today are kept here, so a
+                restart does not reset the daily count. None keeps them in
+                memory only.
+        """
+        self.per_second = per_second
+        self.per_day = per_day
+        self.burst_seconds = burst_seconds
+        self.capacity = (
+            None if per_second is None else max(per_second * burst_seconds, 1)
+        )
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.usage_file = usage_file
+        self.tokens = self.capacity
+        self._last = clock()
+        self._day = int(wall_clock() // SECONDS_PER_DAY)
+        self.used_today = self._read_usage()
+        self._lock = threading.Lock()
+
+    def split(self, parts, usage_file=None):
+        """
+        A budget with 1 / `parts` of this one's limits, for one of `parts`
+        processes that cannot share it.
+        """
+        return RequestBudget(
+            None if self.per_second is None else self.per_second / parts,
+            None if self.per_day is None else self.per_day // parts,
+            burst_seconds=self.burst_seconds,
+            clock=self.clock,
+            wall_clock=self.wall_clock,
+            usage_file=usage_file,
+        )
+
+    def _read_usage(self):
+        if self.usage_file and os.path.exists(self.usage_file):
+            with open(self.usage_file, "r") as f:
+                try:
+                    day, used = (int(value) for value in f.read().split())
+                except ValueError:
+                    return 0
+            if day == self._day:
+                return used
+        return 0
+
+    def _write_usage(self):
+        if self.usage_file:
+            with open(self.usage_file, "w") as f:
+                f.write(f"{self._day} {self.used_today}")
+
+    def _refill(self):
+        now = self.clock()
+        day = int(self.wall_clock() // SECONDS_PER_DAY)
+        if day != self._day:
+            self._day = day
+            self.used_today = 0
+        if self.capacity is not None:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self._last) * self.per_second
+            )
+        self._last = now
+
+    def available(self):
+        """
+        Requests that may be made right now.
+        """
+        with self._lock:
+            self._refill()
+            limits = []
+            if self.capacity is not None:
+                limits.append(int(self.tokens))
+            if self.per_day is not None:
+                limits.append(self.per_day - self.used_today)
+            return max(min(limits), 0) if limits else math.inf
+
+    def spend(self, requests):
+        with self._lock:
+            self._refill()
+            if self.capacity is not None:
+                self.tokens -= requests
+            self.used_today += requests
+            if requests:
+                self._write_usage()
+
+
+_default_budget = None
+
+
+def get_default_budget():
+    """
+    Process-wide budget (FLOW_QUOTA_* from config, usage kept in
+    FLOW_QUOTA_USAGE_FILE) shared by every AdaptiveFlowProvider that is not
+    given one, so contexts in one process draw on a single quota.
+    """
+    global _default_budget
+    if _default_budget is None:
+        _default_budget = RequestBudget(usage_file=FLOW_QUOTA_USAGE_FILE)
+    return _default_budget
+
+
+class AdaptiveFlowProvider:
+    def __init__(
+        self,
+        provider,
+        budget=None,
+        max_staleness=FLOW_MAX_STALENESS_SECONDS,
+        min_interval=None,
+        clock=time.monotonic,
+    ):
+        """
+        Wraps a flow-data provider and spends a global request budget on the
+        points where fresh data matters most; every other point is served
+        its last fetched value.
+
+        Each fetch_many() ranks the requested points by
+            (FLOW_PRIORITY_BASE + change rate + prediction error
+             + fairness wait + active emergency) * seconds since last fetch,
+        each term scaled by its FLOW_PRIORITY_* weight, and refreshes the
+        highest-ranked ones the budget allows. Points never fetched, or
+        older than `max_staleness`, come first. Change rates are measured
+        from successive fetches; prediction errors, waits and emergencies
+        are reported by the caller through report_errors(), set_waits() and
+        set_emergencies().
+
+        Parameters:
+            provider: Inner provider (FlowDataProvider, FlowReplayProvider, ...).
+            budget (RequestBudget): Default: the process-wide budget (see
+                get_default_budget), or a private one when `clock` is not
+                the monotonic clock.
+            max_staleness (float): Seconds after which a point is refreshed
+                ahead of everything else.
+            min_interval (float): Points fetched more recently are not polled
+                again (default: the inner provider's cache TTL, since its
+                cache would answer them without a request anyway).
+            clock (callable): Seconds; shared with a private budget.
+        """
+        self.provider = provider
+        if budget is None:
+            budget = (
+                get_default_budget()
+                if clock is time.monotonic
+                else RequestBudget(clock=clock)
+            )
+        self.budget = budget
+        self.max_staleness = max_staleness
+        self.min_interval = (
+            getattr(provider, "ttl_seconds", 0)
+            if min_interval is None
+            else min_interval
+        )
+        self.clock = clock
+        self.rng = getattr(provider, "rng", None) or random
+        self.points = []
+        self.index = {}  # (lat, lon) -> row
+        self._data = []  # row -> last flowSegmentData
+        self._fetched_at = np.empty(0)  # -inf until first fetched
+        self._congestion = np.empty(0)
+        self._change = np.empty(0)  # congestion change per minute, smoothed
+        self._error = np.empty(0)
+        self._wait = np.empty(0)
+        self._emergency = np.empty(0, dtype=bool)
+        self.polled = 0
+        self.failed = 0  # polls that returned no data
+        self.served_stale = 0
+        self.unserved = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # segment_points(), duration, ... of the wrapped provider.
+        if name == "provider":
+            raise AttributeError(name)
+        return getattr(self.provider, name)
+
+    def _grow(self, size):
+        capacity = max(2 * len(self._fetched_at), size, 64)
+        for name, fill in (
+            ("_fetched_at", -np.inf),
+            ("_congestion", 0.0),
+            ("_change", 0.0),
+            ("_error", 0.0),
+            ("_wait", 0.0),
+            ("_emergency", False),
+        ):
+            old = getattr(self, name)
+            grown = np.full(capacity, fill, dtype=old.dtype)
+            grown[: len(old)] = old
+            setattr(self, name, grown)
+
+    def rows(self, points):
+        """
+        Rows for a list of (lat, lon) points, registering new ones.
+        """
+        index = self.index
+        rows = np.empty(len(points), dtype=np.intp)
+        for i, point in enumerate(points):
+            row = index.get(point)
+            if row is None:
+                row = index[point] = len(self.points)
+                self.points.append(point)
+                self._data.append(None)
+            rows[i] = row
+        if len(self.points) > len(self._fetched_at):
+            self._grow(len(self.points))
+        return rows
+
+    def report_errors(self, points, errors):
+        """
+        Latest |predicted - observed| congestion for each point.
+        """
+        with self._lock:
+            rows = self.rows(list(points))
+            self._error[rows] = errors
+
+    def set_waits(self, points, waits):
+        """
+        Fairness wait at each point; ranked relative to the largest wait.
+        """
+        with self._lock:
+            rows = self.rows(list(points))
+            self._wait[rows] = waits
+
+    def set_emergencies(self, points, active):
+        """
+        Whether an emergency is active at each point.
+        """
+        with self._lock:
+            rows = self.rows(list(points))
+            self._emergency[rows] = active
+
+    def priorities(self, rows, now):
+        """
+        Refresh priority of `rows` at time `now` (inf for never-fetched
+        and overdue points, -inf for points fetched within min_interval).
+        """
+        age = now - self._fetched_at[rows]
+        largest_wait = self._wait[: len(self.points)].max(initial=0.0)
+        urgency = (
+            FLOW_PRIORITY_BASE
+            + FLOW_PRIORITY_CHANGE * self._change[rows]
+            + FLOW_PRIORITY_ERROR * self._error[rows]
+            + FLOW_PRIORITY_WAIT * self._wait[rows] / max(largest_wait, 1e-9)
+            + FLOW_PRIORITY_EMERGENCY * self._emergency[rows]
+        )
+        with np.errstate(invalid="ignore"):
+            priority = urgency * age
+        priority[age >= self.max_staleness] = np.inf
+        priority[age < self.min_interval] = -np.inf
+        return priority
+
+    def _record(self, rows, flows, now):
+        """
+        Store fetched values and update the change rates of refetched points.
+        """
+        current = np.array([flow.get("currentSpeed", 0) for flow in flows], float)
+        free = np.array([flow.get("freeFlowSpeed", 0) for flow in flows], float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            congestion = np.where(free > 0, np.clip((free - current) / free, 0, 1), 1.0)
+        previous = self._fetched_at[rows]
+        seen = np.isfinite(previous) & (now > previous)
+        elapsed = np.where(seen, now - previous, 1.0)
+        rate = np.abs(congestion - self._congestion[rows]) * 60 / elapsed
+        self._change[rows] = np.where(
+            seen,
+            CHANGE_SMOOTHING * rate + (1 - CHANGE_SMOOTHING) * self._change[rows],
+            self._change[rows],
+        )
+        self._congestion[rows] = congestion
+        self._fetched_at[rows] = now
+        for row, flow in zip(rows.tolist(), flows):
+            self._data[row] = flow
+
+    @timed("flow_scheduler.fetch_many")
+    def fetch_many(self, points, deadline=None, fallback=True):
+        """
+        flowSegmentData for every point: the highest-priority points the
+        budget allows are fetched through the inner provider, the rest are
+        served their last value (synthetic data if never fetched, or None
+        without `fallback`). Points whose fetch fails or misses the deadline
+        are served the same way and keep their last fetch time, so they stay
+        due for a refresh.
+        """
+        with self._lock:
+            unique = list(dict.fromkeys(points))
+            rows = self.rows(unique)
+            now = self.clock()
+            priority = self.priorities(rows, now)
+            eligible = np.flatnonzero(priority > -np.inf)
+            allowed = self.budget.available()
+            if allowed <= 0:
+                eligible = eligible[:0]
+            elif len(eligible) > allowed:
+                top = np.argpartition(-priority[eligible], allowed - 1)[:allowed]
+                eligible = eligible[top]
+            self.budget.spend(len(eligible))
+        selected = [unique[i] for i in eligible.tolist()]
+        fetched = (
+            self.provider.fetch_many(selected, deadline, fallback=False)
+            if deadline is not None
+            else self.provider.fetch_many(selected, fallback=False)
+        )
+        flows = [fetched[point] for point in selected]
+        ok = np.array([flow is not None for flow in flows], dtype=bool)
+        failed = len(selected) - int(ok.sum())
+
+        with self._lock:
+            if ok.any():
+                self._record(
+                    rows[eligible[ok]],
+                    [flow for flow in flows if flow is not None],
+                    now,
+                )
+            results = {}
+            unserved = 0
+            for point, row in zip(unique, rows.tolist()):
+                flow = self._data[row]
+                if flow is None:
+                    if fallback:
+                        flow = synthetic_flow_data(self.rng)
+                    unserved += 1
+                results[point] = flow
+            stale = len(unique) - (len(selected) - failed) - unserved
+            self.polled += len(selected)
+            self.failed += failed
+            self.served_stale += stale
+            self.unserved += unserved
+        metrics = get_metrics()
+        metrics.count("flow_scheduler.polled", len(selected))
+        metrics.count("flow_scheduler.served_stale", stale)
+        if failed:
+            metrics.count("flow_scheduler.failed", failed)
+        if unserved:
+            metrics.count("flow_scheduler.unserved", unserved)
+        return results
+
+    def get_flow_data(self, lat, lon):
+        point = (lat, lon)
+        return self.fetch_many([point])[point]
+
+    def close(self):
+        self.provider.close()
+
+    def stats(self):
+        stats = dict(self.provider.stats())
+        stats.update(
+            polled=self.polled,
+            failed=self.failed,
+            served_stale=self.served_stale,
+            unserved=self.unserved,
+            used_today=self.budget.used_today,
+        )
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._data = [None] * len(self.points)
+            self._fetched_at[:] = -np.inf
+        self.provider.clear()
@@ -0,0 +1,402 @@
+# agents/flow_trace.py
+
+import atexit
+import math
+import os
+import random
+import struct
+import threading
+import time
+
+import numpy as np
+
+from agents.flow_provider import synthetic_flow_data
+from agents.spatial_index import SpatialIndex
+from config import (
+    FLOW_TRACE_FILE,
+    FLOW_TRACE_FLUSH_INTERVAL_SECONDS,
+    FLOW_TRACE_FLUSH_ROWS,
+    FLOW_TRACE_MAX_DISTANCE_METERS,
+)
+
+# Trace file layout (little-endian):
+#   header   TRACE_HEADER padded to HEADER_SIZE bytes
+#   points   n_points POINT_DTYPE rows sorted by (lat, lon); each row points
+#            at a contiguous run of records
+#   records  n_records RECORD_DTYPE rows sorted by (point, timestamp)
+TRACE_MAGIC = b"FLOWTRC1"
+TRACE_HEADER = struct.Struct("<8sQQdd")  # magic, n_points, n_records, start, end
+HEADER_SIZE = 64
+
+POINT_DTYPE = np.dtype(
+    [("lat", "<f8"), ("lon", "<f8"), ("start", "<u8"), ("count", "<u8")]
+)
+RECORD_DTYPE = np.dtype(
+    [
+        ("timestamp", "<f8"),
+        ("current_speed", "<f4"),
+        ("free_flow_speed", "<f4"),
+        ("current_travel_time", "<f4"),
+        ("free_flow_travel_time", "<f4"),
+        ("confidence", "<f4"),
+        ("road_closure", "u1"),
+    ]
+)
+
+# flowSegmentData key -> (record field, conversion applied when replaying)
+FLOW_FIELDS = (
+    ("currentSpeed", "current_speed", int),
+    ("freeFlowSpeed", "free_flow_speed", int),
+    ("currentTravelTime", "current_travel_time", int),
+    ("freeFlowTravelTime", "free_flow_travel_time", int),
+    ("confidence", "confidence", lambda value: round(value, 6)),
+)
+NO_CLOSURE_FLAG = 2  # road_closure value when the response had no roadClosure key
+TRACE_COLUMNS = 3 + len(FLOW_FIELDS) + 1  # timestamp, lat, lon, fields, closure
+
+
+def log_path(path):
+    """
+    Append-only raw log that FlowTraceWriter flushes to before `path` is
+    indexed.
+    """
+    return path + ".log"
+
+
+class FlowTraceWriter:
+    def __init__(
+        self,
+        path=FLOW_TRACE_FILE,
+        flush_rows=FLOW_TRACE_FLUSH_ROWS,
+        flush_interval=FLOW_TRACE_FLUSH_INTERVAL_SECONDS,
+    ):
+        """
+        Records flowSegmentData responses with their time and point, and
+        writes them as an indexed trace file on close().
+
+        Pass it as FlowDataProvider(recorder=...) to capture every
+        successful API response.
+
+        Rows are flushed to an append-only raw log next to `path` and only
+        indexed on close(), so a crashed run keeps everything flushed so far;
+        the next writer for the same path picks the log up, and
+        recover_trace() indexes it without recording.
+
+        Parameters:
+            path (str): Trace file to write.
+            flush_rows (int): Flush once this many rows are buffered.
+            flush_interval (float): Flush when this many seconds passed since the last flush.
+        """
+        self.path = path
+        self.log_path = log_path(path)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._logged = _logged_rows(self.log_path)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._closed = False
+        atexit.register(self.close)
+
+    def __len__(self):
+        return self._logged + len(self._buffer)
+
+    def record(self, lat, lon, flow_data, timestamp=None):
+        row = [time.time() if timestamp is None else timestamp, lat, lon]
+        for key, _, _ in FLOW_FIELDS:
+            value = flow_data.get(key)
+            row.append(math.nan if value is None else value)
+        closure = flow_data.get("roadClosure")
+        row.append(NO_CLOSURE_FLAG if closure is None else int(bool(closure)))
+        with self._lock:
+            self._buffer.append(tuple(row))
+            due = self._flush_due()
+        if due:
+            self.flush()
+
+    def _flush_due(self):
+        return (
+            len(self._buffer) >= self.flush_rows
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if not rows:
+                return
+            with open(self.log_path, "ab") as f:
+                f.write(np.array(rows, dtype="<f8").tobytes())
+            self._logged += len(rows)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._closed:
+                return self.path
+            self._closed = True
+        atexit.unregister(self.close)
+        recover_trace(self.path)
+        return self.path
+
+
+def _logged_rows(path):
+    """
+    Whole rows in the raw log at `path`; a partial row left by a write cut
+    short is truncated so new rows stay aligned.
+    """
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    row_bytes = TRACE_COLUMNS * 8
+    if size % row_bytes:
+        os.truncate(path, size - size % row_bytes)
+    return size // row_bytes
+
+
+def recover_trace(path=FLOW_TRACE_FILE):
+    """
+    Index the raw log of `path` (e.g. one left by a crashed run) into the
+    trace file and remove the log. Returns the number of records written.
+    """
+    raw = log_path(path)
+    rows = np.zeros((0, TRACE_COLUMNS))
+    if os.path.exists(raw):
+        _logged_rows(raw)
+        rows = np.fromfile(raw, dtype="<f8")
+    count = write_trace(path, rows)
+    if os.path.exists(raw):
+        os.remove(raw)
+    return count
+
+
+def write_trace(path, rows):
+    """
+    Write (timestamp, lat, lon, current_speed, free_flow_speed,
+    current_travel_time, free_flow_travel_time, confidence, road_closure)
+    rows as a trace file. Returns the number of records written.
+    """
+    table = np.array(rows, dtype=float).reshape(-1, TRACE_COLUMNS)
+    timestamps, lats, lons = table[:, 0], table[:, 1], table[:, 2]
+    order = np.lexsort((timestamps, lons, lats))
+    table = table[order]
+    timestamps, lats, lons = table[:, 0], table[:, 1], table[:, 2]
+
+    records = np.zeros(len(table), dtype=RECORD_DTYPE)
+    records["timestamp"] = timestamps
+    for column, (_, field, _) in enumerate(FLOW_FIELDS, start=3):
+        records[field] = table[:, column]
+    records["road_closure"] = table[:, -1]
+
+    new_point = np.ones(len(table), dtype=bool)
+    new_point[1:] = (lats[1:] != lats[:-1]) | (lons[1:] != lons[:-1])
+    starts = np.flatnonzero(new_point)
+    points = np.zeros(len(starts), dtype=POINT_DTYPE)
+    points["lat"] = lats[starts]
+    points["lon"] = lons[starts]
+    points["start"] = starts
+    points["count"] = np.diff(np.append(starts, len(table)))
+
+    start = float(timestamps.min()) if len(table) else 0.0
+    end = float(timestamps.max()) if len(table) else 0.0
+    header = TRACE_HEADER.pack(TRACE_MAGIC, len(points), len(records), start, end)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(points.tobytes())
+        f.write(records.tobytes())
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def read_trace_header(path):
+    with open(path, "rb") as f:
+        header = f.read(TRACE_HEADER.size)
+    magic, n_points, n_records, start, end = TRACE_HEADER.unpack(header)
+    if magic != TRACE_MAGIC:
+        raise ValueError(f"{path} is not a flow trace file.")
+    return n_points, n_records, start, end
+
+
+def _map(path, dtype, offset, count):
+    if count == 0:
+        # np.memmap cannot map an empty region.
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+class FlowReplayProvider:
+    def __init__(
+        self,
+        path=FLOW_TRACE_FILE,
+        clock=None,
+        loop=True,
+        max_distance=FLOW_TRACE_MAX_DISTANCE_METERS,
+        rng=None,
+    ):
+        """
+        Serves recorded flowSegmentData from a trace file instead of the API.
+        Drop-in replacement for FlowDataProvider.
+
+        The points table and records are memory-mapped. A lookup answers
+        with the latest record at or before the replay time for the
+        recorded point nearest to (lat, lon); points further than
+        `max_distance` metres from any recorded point, or first recorded
+        after the replay time, get synthetic data.
+
+        Parameters:
+            path (str): Trace file written by FlowTraceWriter.
+            clock (callable): Returns the replay time in seconds since the
+                start of the trace, e.g. simulated time; defaults to 0.
+            loop (bool): Wrap around when the clock runs past the trace end.
+            max_distance (float): Nearest-point search radius in metres.
+            rng (random.Random): Source for synthetic fallback data.
+        """
+        self.path = path
+        self.clock = clock or (lambda: 0.0)
+        self.loop = loop
+        self.max_distance = max_distance
+        self.rng = rng or random
+        n_points, n_records, self.start_ts, self.end_ts = read_trace_header(path)
+        self.points = _map(path, POINT_DTYPE, HEADER_SIZE, n_points)
+        self.records = _map(
+            path, RECORD_DTYPE, HEADER_SIZE + n_points * POINT_DTYPE.itemsize, n_records
+        )
+        self._timestamps = np.asarray(self.records["timestamp"])
+        self._starts = self.points["start"].tolist()
+        self._stops = (self.points["start"] + self.points["count"]).tolist()
+        self._lats = np.asarray(self.points["lat"])
+        self._lons = np.asarray(self.points["lon"])
+        self.index = SpatialIndex(
+            range(n_points),
+            np.column_stack((self._lats, self._lons)),
+            cell_meters=max(max_distance, 1),
+        )
+        self._resolved = {}  # (lat, lon) -> points row or -1
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self):
+        return self.end_ts - self.start_ts
+
+    def segment_points(self):
+        """
+        (lat, lon) of every recorded point, for snapping query points.
+        """
+        return list(zip(self._lats.tolist(), self._lons.tolist()))
+
+    def _resolve(self, points):
+        """
+        Nearest recorded point row (or -1) for each new point, in one bulk
+        spatial-index query.
+        """
+        points = [point for point in points if point not in self._resolved]
+        if points:
+            lats, lons = zip(*points)
+            rows, _ = self.index.nearest_many(lats, lons, self.max_distance)
+            self._resolved.update(zip(points, rows.tolist()))
+
+    def _point_row(self, lat, lon):
+        point = (lat, lon)
+        row = self._resolved.get(point)
+        if row is None:
+            self._resolve([point])
+            row = self._resolved[point]
+        return row
+
+    def _trace_time(self):
+        offset = self.clock()
+        if self.loop and self.duration > 0:
+            offset %= self.duration
+        return self.start_ts + offset
+
+    def _record_index(self, row, ts):
+        """
+        Index of the latest record at or before `ts` for points-table `row`,
+        or -1 when the point is unknown or has no record yet.
+        """
+        if row < 0:
+            return -1
+        start = self._starts[row]
+        stop = self._stops[row]
+        i = int(np.searchsorted(self._timestamps[start:stop], ts, side="right")) - 1
+        return start + i if i >= 0 else -1
+
+    def _flow_data(self, indices):
+        """
+        flowSegmentData dicts for the given record indices, gathered from
+        the memory-mapped records in one read.
+        """
+        records = self.records[np.asarray(indices, dtype=np.intp)]
+        columns = [
+            (key, cast, records[field].tolist()) for key, field, cast in FLOW_FIELDS
+        ]
+        closures = records["road_closure"].tolist()
+        results = []
+        for i, closure in enumerate(closures):
+            flow_data = {}
+            for key, cast, values in columns:
+                value = values[i]
+                if not math.isnan(value):
+                    flow_data[key] = cast(value)
+            if closure != NO_CLOSURE_FLAG:
+                flow_data["roadClosure"] = bool(closure)
+            results.append(flow_data)
+        return results
+
+    def get_flow_data(self, lat, lon):
+        index = self._record_index(self._point_row(lat, lon), self._trace_time())
+        with self._lock:
+            if index < 0:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if index < 0:
+            return synthetic_flow_data(self.rng)
+        return self._flow_data([index])[0]
+
+    def fetch_many(self, points, deadline=None, fallback=True):
+        """
+        Flow data for every point at the current replay time. `deadline` is
+        accepted for compatibility with FlowDataProvider and ignored.
+        Points missing from the trace, or not recorded yet, get synthetic
+        data, or None without `fallback`.
+        """
+        ts = self._trace_time()
+        self._resolve(set(points))
+        results = {}
+        found = []
+        indices = []
+        for point in points:
+            if point in results:
+                continue
+            index = self._record_index(self._point_row(*point), ts)
+            if index < 0:
+                results[point] = synthetic_flow_data(self.rng) if fallback else None
+            else:
+                results[point] = None
+                found.append(point)
+                indices.append(index)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(results) - len(found)
+        for point, flow_data in zip(found, self._flow_data(indices)):
+            results[point] = flow_data
+        return results
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.points),
+            }
+
+    def clear(self):
+        self._resolved.clear()
@@ -0,0 +1,318 @@
+# agents/history_writer.py
+
+import atexit
+import csv
+import os
+import re
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+
+import numpy as np
+
+from config import (
+    DATA_FILE,
+    HISTORY_FLUSH_INTERVAL_SECONDS,
+    HISTORY_FLUSH_ROWS,
+    HISTORY_FORMAT,
+    HISTORY_ROTATE_BYTES,
+    HISTORY_ROTATE_DAILY,
+)
+
+FIELDNAMES = [
+    "timestamp",
+    "lat",
+    "lon",
+    "current_speed",
+    "free_flow_speed",
+    "congestion",
+]
+
+# Fixed-width little-endian records used by the "binary" format; segments can
+# be read back with np.fromfile / np.memmap.
+RECORD_DTYPE = np.dtype(
+    [
+        ("timestamp", "<f8"),
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+        ("current_speed", "<f4"),
+        ("free_flow_speed", "<f4"),
+        ("congestion", "<f4"),
+    ]
+)
+
+
+def format_timestamp(ts):
+    return (
+        datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+    )
+
+
+def active_path(path=DATA_FILE, fmt=HISTORY_FORMAT):
+    """
+    File currently being written for a history `path` in format `fmt`.
+    """
+    if fmt == "binary":
+        return os.path.splitext(path)[0] + ".bin"
+    return path
+
+
+def history_segments(path=DATA_FILE, fmt=HISTORY_FORMAT):
+    """
+    All files making up a history, oldest first: rotated segments followed
+    by the active file.
+    """
+    path = active_path(path, fmt)
+    directory, name = os.path.split(path)
+    base, ext = os.path.splitext(name)
+    pattern = re.compile(
+        re.escape(base) + r"\.(\d{8}T\d{6})(?:-(\d+))?" + re.escape(ext) + "$"
+    )
+    rotated = []
+    for entry in os.listdir(directory or "."):
+        match = pattern.match(entry)
+        if match:
+            order = (match.group(1), int(match.group(2) or 0))
+            rotated.append((order, os.path.join(directory, entry)))
+    rotated = [segment for _, segment in sorted(rotated)]
+    if os.path.exists(path):
+        rotated.append(path)
+    return rotated
+
+
+def read_history(path=DATA_FILE, fmt=HISTORY_FORMAT):
+    """
+    Load every segment of a history into one DataFrame (None if there is none).
+    """
+    import pandas as pd  # deferred: only retraining reads history back
+
+    frames = []
+    for segment in history_segments(path, fmt):
+        if fmt == "binary":
+            frames.append(pd.DataFrame(np.fromfile(segment, dtype=RECORD_DTYPE)))
+        else:
+            frames.append(pd.read_csv(segment))
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def iter_history_chunks(
+    path=DATA_FILE, fmt=HISTORY_FORMAT, chunk_rows=50000, points=False
+):
+    """
+    Stream a history in bounded chunks, oldest first.
+
+    Yields (X, y) pairs where X holds the current_speed / free_flow_speed
+    features and y the congestion targets; at most `chunk_rows` rows are in
+    memory at once. With `points`, yields (X, y, P) where P holds each
+    row's (lat, lon), read back exactly as written.
+    """
+    import pandas as pd  # deferred: only retraining reads history back
+
+    for segment in history_segments(path, fmt):
+        if fmt == "binary":
+            records = np.memmap(segment, dtype=RECORD_DTYPE, mode="r")
+            for start in range(0, len(records), chunk_rows):
+                chunk = records[start : start + chunk_rows]
+                X = np.column_stack(
+                    (chunk["current_speed"], chunk["free_flow_speed"])
+                ).astype(float)
+                y = chunk["congestion"].astype(float)
+                if points:
+                    yield X, y, np.column_stack((chunk["lat"], chunk["lon"]))
+                else:
+                    yield X, y
+            del records
+        else:
+            columns = ["current_speed", "free_flow_speed", "congestion"]
+            if points:
+                columns += ["lat", "lon"]
+            reader = pd.read_csv(
+                segment,
+                usecols=columns,
+                chunksize=chunk_rows,
+                float_precision="round_trip",
+            )
+            with reader:
+                for chunk in reader:
+                    X = chunk[["current_speed", "free_flow_speed"]].to_numpy(float)
+                    y = chunk["congestion"].to_numpy(float)
+                    if points:
+                        yield X, y, chunk[["lat", "lon"]].to_numpy(float)
+                    else:
+                        yield X, y
+
+
+# Writers still open at exit are closed then; they are held weakly so a
+# dropped writer is not kept alive by its exit hook.
+_open_writers = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_writers():
+    for writer in list(_open_writers):
+        writer.close()
+
+
+class NullHistoryWriter:
+    """
+    Discards history rows, for runs (such as forked what-if scenarios) that
+    must not feed retraining.
+    """
+
+    def __init__(self, fmt=HISTORY_FORMAT):
+        self.fmt = fmt
+
+    def append(self, *args, **kwargs):
+        pass
+
+    def append_many(self, *args, **kwargs):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class HistoryWriter:
+    def __init__(
+        self,
+        path=DATA_FILE,
+        fmt=HISTORY_FORMAT,
+        flush_rows=HISTORY_FLUSH_ROWS,
+        flush_interval=HISTORY_FLUSH_INTERVAL_SECONDS,
+        rotate_bytes=HISTORY_ROTATE_BYTES,
+        rotate_daily=HISTORY_ROTATE_DAILY,
+    ):
+        """
+        Buffered writer for the traffic history.
+
+        Parameters:
+            path (str): History file; the "binary" format writes next to it with a .bin suffix.
+            fmt (str): "csv" or "binary" (fixed-width RECORD_DTYPE records).
+            flush_rows (int): Flush once this many rows are buffered.
+            flush_interval (float): Flush when this many seconds passed since the last flush.
+            rotate_bytes (int): Start a new segment once the active file reaches this size (0 disables).
+            rotate_daily (bool): Start a new segment when the UTC day changes.
+        """
+        if fmt not in ("csv", "binary"):
+            raise ValueError(f"Unknown history format: {fmt}")
+        self.fmt = fmt
+        self.path = active_path(path, fmt)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_daily = rotate_daily
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        if os.path.exists(self.path):
+            self._size = os.path.getsize(self.path)
+            self._day = datetime.fromtimestamp(
+                os.path.getmtime(self.path), timezone.utc
+            ).date()
+        else:
+            self._size = 0
+            self._day = None
+        _open_writers.add(self)
+
+    def append(
+        self, lat, lon, current_speed, free_flow_speed, congestion, timestamp=None
+    ):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self._buffer.append(
+                (timestamp, lat, lon, current_speed, free_flow_speed, congestion)
+            )
+            due = self._flush_due()
+        if due:
+            self.flush()
+
+    def append_many(
+        self, lats, lons, current_speeds, free_flow_speeds, congestion, timestamp=None
+    ):
+        """
+        Buffer one row per intersection; all rows share `timestamp`.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        rows = zip(
+            np.asarray(lats).tolist(),
+            np.asarray(lons).tolist(),
+            np.asarray(current_speeds).tolist(),
+            np.asarray(free_flow_speeds).tolist(),
+            np.asarray(congestion).tolist(),
+        )
+        with self._lock:
+            self._buffer.extend((timestamp,) + row for row in rows)
+            due = self._flush_due()
+        if due:
+            self.flush()
+
+    def _flush_due(self):
+        return (
+            len(self._buffer) >= self.flush_rows
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if not rows:
+                return
+            self._maybe_rotate()
+            if self.fmt == "binary":
+                self._write_binary(rows)
+            else:
+                self._write_csv(rows)
+
+    def _write_csv(self, rows):
+        with open(self.path, mode="a", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            if self._size == 0:
+                writer.writerow(FIELDNAMES)
+            writer.writerows((format_timestamp(row[0]),) + row[1:] for row in rows)
+            self._size = csvfile.tell()
+
+    def _write_binary(self, rows):
+        records = np.array(rows, dtype=RECORD_DTYPE)
+        with open(self.path, mode="ab") as f:
+            records.tofile(f)
+            self._size = f.tell()
+
+    def _maybe_rotate(self):
+        today = datetime.now(timezone.utc).date()
+        if self._size and (
+            (self.rotate_daily and self._day is not None and self._day != today)
+            or (self.rotate_bytes and self._size >= self.rotate_bytes)
+        ):
+            base, ext = os.path.splitext(self.path)
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+            target = f"{base}.{stamp}{ext}"
+            suffix = 1
+            while os.path.exists(target):
+                target = f"{base}.{stamp}-{suffix}{ext}"
+                suffix += 1
+            os.replace(self.path, target)
+            self._size = 0
+        self._day = today
+
+    def close(self):
+        """
+        Flush any buffered rows. Safe to call more than once.
+        """
+        _open_writers.discard(self)
+        self.flush()
+
+    def __del__(self):
+        # A writer dropped without close() still writes what it buffered.
+        try:
+            self.flush()
+        except Exception:
+            pass
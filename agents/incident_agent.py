@@ -1,9 +1,30 @@
 # agents/incident_agent.py
 
+import numpy as np
+
+from agents.metrics import timed
+
+INCIDENT_SPEED = 10  # km/h; slower traffic at a vehicle's position is an incident
+INCIDENT_CONDITION = 0.9  # congestion an intersection is raised to by an incident
+
 
 class IncidentAgent:
     def __init__(self):
         pass
 
+    @timed("incident.detect_incident")
     def detect_incident(self, traffic_data):
-        return traffic_data.get("currentSpeed", 100) < 10
+        return traffic_data.get("currentSpeed", 100) < INCIDENT_SPEED
+
+    def detect_incidents(self, speeds):
+        """
+        detect_incident() for an array of current speeds.
+        """
+        return np.asarray(speeds) < INCIDENT_SPEED
+
+    def incident_conditions(self, conditions):
+        """
+        Congestion of intersections with an incident, given their current
+        congestion (scalar or array).
+        """
+        return np.maximum(conditions, INCIDENT_CONDITION)
@@ -0,0 +1,426 @@
+# agents/metrics.py
+
+import bisect
+import cProfile
+import functools
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (
+    METRICS_ENABLED,
+    METRICS_PROFILE_DIR,
+    METRICS_SNAPSHOT_FILE,
+    METRICS_SNAPSHOT_INTERVAL_SECONDS,
+)
+
+# Histogram bucket upper bounds in seconds (the last bucket is +Inf).
+LATENCY_BUCKETS = (
+    1e-6,
+    5e-6,
+    1e-5,
+    5e-5,
+    1e-4,
+    5e-4,
+    1e-3,
+    5e-3,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+PROMETHEUS_PREFIX = "trafficagent_"
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-th quantile.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([*map(str, LATENCY_BUCKETS), "+Inf"], self.counts)),
+        }
+
+
+class _NullContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "started")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class StageTimer:
+    """
+    Times consecutive stages of one call: each mark(stage) records the time
+    since the previous mark as "<prefix>.<stage>".
+    """
+
+    __slots__ = ("registry", "prefix", "last")
+
+    def __init__(self, registry, prefix):
+        self.registry = registry
+        self.prefix = prefix
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.registry.observe(f"{self.prefix}.{stage}", now - self.last)
+        self.last = now
+
+
+class _Profile:
+    def __init__(self, registry, label):
+        self.registry = registry
+        self.label = label
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        path = os.path.join(self.registry.profile_dir, f"profile_{self.label}.prof")
+        self.profiler.dump_stats(path)
+        self.registry.last_profile = path
+        print(f"[Metrics] Profile of {self.label} written to {path}")
+        pstats.Stats(self.profiler).sort_stats("cumulative").print_stats(15)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=METRICS_ENABLED, profile_dir=METRICS_PROFILE_DIR):
+        """
+        Process-wide timers (latency histograms) and counters.
+
+        When disabled, timed() methods are the plain undecorated functions,
+        stage timers cost one truthiness check and timer() returns a shared
+        no-op context, so instrumentation can stay in place on hot paths.
+        """
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.histograms = {}
+        self.counters = {}
+        self.last_profile = None
+        self._profile_requested = False
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        if self is _registry:
+            _install_timed_methods(True)
+
+    def disable(self):
+        self.enabled = False
+        if self is _registry:
+            _install_timed_methods(False)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timer(self, name):
+        """
+        Context manager timing its block into histogram `name`.
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Timer(self, name)
+
+    def stages(self, prefix):
+        """
+        StageTimer for the sub-stages of one call, or None when disabled.
+        """
+        if not self.enabled:
+            return None
+        return StageTimer(self, prefix)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def request_profile(self):
+        """
+        Profile the next step run under profile_step(); safe to call from a
+        signal handler or another thread.
+        """
+        self._profile_requested = True
+
+    def profile_step(self, label):
+        """
+        cProfile context for one step if a profile was requested, else a
+        no-op context.
+        """
+        if not self._profile_requested:
+            return _NULL_CONTEXT
+        self._profile_requested = False
+        return _Profile(self, label)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "timers": {
+                    name: histogram.to_dict()
+                    for name, histogram in sorted(self.histograms.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def to_prometheus(self):
+        """
+        Prometheus text exposition format: timers as *_seconds histograms,
+        counters as *_total.
+        """
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                metric = _metric_name(name) + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.total}")
+                lines.append(f"{metric}_count {histogram.count}")
+            for name, value in sorted(self.counters.items()):
+                metric = _metric_name(name) + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path=METRICS_SNAPSHOT_FILE):
+        """
+        Write a snapshot as JSON, or Prometheus text when `path` ends in
+        .prom. The file is replaced atomically.
+        """
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        return path
+
+
+def _metric_name(name):
+    return PROMETHEUS_PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+class SnapshotExporter:
+    def __init__(
+        self,
+        registry=None,
+        path=METRICS_SNAPSHOT_FILE,
+        interval=METRICS_SNAPSHOT_INTERVAL_SECONDS,
+    ):
+        """
+        Background thread writing registry snapshots to `path` every
+        `interval` seconds, and once more on stop().
+        """
+        self.registry = registry or get_metrics()
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="metrics-export", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.registry.write_snapshot(self.path)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.registry.write_snapshot(self.path)
+
+
+class MetricsServer:
+    def __init__(self, registry=None, host="127.0.0.1", port=0):
+        """
+        Serves the registry in Prometheus text format at /metrics.
+        """
+        self.registry = registry or get_metrics()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+_registry = MetricsRegistry(enabled=False)
+_timed_methods = []  # (owner class, attribute, function, metric name)
+
+
+def get_metrics():
+    return _registry
+
+
+def _timing_wrapper(fn, name):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _registry.observe(name, time.perf_counter() - started)
+
+    return wrapper
+
+
+def _install_timed_methods(enabled):
+    for owner, attribute, fn, name in _timed_methods:
+        setattr(owner, attribute, _timing_wrapper(fn, name) if enabled else fn)
+
+
+class _TimedMethod:
+    """
+    Placeholder left by @timed in a class body. On class creation it puts
+    the plain function back and registers it, so the timing wrapper is
+    only installed while the process-wide registry is enabled.
+    """
+
+    def __init__(self, fn, name):
+        self.fn = fn
+        self.name = name
+
+    def __set_name__(self, owner, attribute):
+        _timed_methods.append((owner, attribute, self.fn, self.name))
+        if _registry.enabled:
+            setattr(owner, attribute, _timing_wrapper(self.fn, self.name))
+        else:
+            setattr(owner, attribute, self.fn)
+
+
+def timed(name):
+    """
+    Method decorator recording each call's duration in the process-wide
+    registry under `name`. Costs nothing while metrics are disabled.
+    """
+
+    def decorate(fn):
+        return _TimedMethod(fn, name)
+
+    return decorate
+
+
+if METRICS_ENABLED:
+    _registry.enable()
@@ -0,0 +1,213 @@
+# agents/model_registry.py
+
+import os
+
+import numpy as np
+
+from agents.predictor import MAX_DLOSS
+from config import MODEL_REGISTRY_FILE
+
+
+def record_dtype(n_features=2):
+    return np.dtype(
+        [
+            ("key", "U64"),
+            ("coef", "<f8", (n_features,)),
+            ("intercept", "<f8"),
+            ("t", "<f8"),
+        ]
+    )
+
+
+class IntersectionModelRegistry:
+    def __init__(
+        self,
+        path=MODEL_REGISTRY_FILE,
+        n_features=2,
+        capacity=64,
+        eta0=0.01,
+        power_t=0.25,
+        alpha=0.0001,
+        load=True,
+    ):
+        """
+        One online linear congestion model per intersection, stored as rows
+        of a contiguous weight/bias matrix so predictions and updates for
+        all intersections run as single vectorized operations.
+
+        If `path` exists (and `load` is set) it is opened as a memory-mapped
+        .npy file and updates are written through to it; otherwise models
+        live in memory until save() (re)writes `path`. Each row follows the
+        same SGD rule as NumpyOnlinePredictor without feature scaling.
+        """
+        self.path = path
+        self.eta0 = eta0
+        self.power_t = power_t
+        self.alpha = alpha
+        self.index = {}
+        if load and path and os.path.exists(path):
+            self._records = np.lib.format.open_memmap(path, mode="r+")
+            for row, key in enumerate(self._records["key"]):
+                if not key:
+                    break
+                self.index[str(key)] = row
+        else:
+            self._records = np.zeros(capacity, dtype=record_dtype(n_features))
+        self._bind()
+
+    def records(self):
+        """
+        Records of the registered models, in row order.
+        """
+        return self._records[: len(self.index)]
+
+    def load_records(self, records):
+        """
+        Replace all models with `records` (record_dtype rows, e.g. a
+        memory-mapped snapshot section), adopted without copying.
+        """
+        self._records = records
+        self.index = {}
+        for row, key in enumerate(records["key"]):
+            if not key:
+                break
+            self.index[str(key)] = row
+        self._bind()
+
+    def _bind(self):
+        self.coef = self._records["coef"]
+        self.intercept = self._records["intercept"]
+        self.t = self._records["t"]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return list(self.index)
+
+    def row(self, key, init=None):
+        """
+        Row of `key`, allocating it on first use. New rows start from
+        `init` = (coef, intercept, t), e.g. the global model's weights.
+        """
+        row = self.index.get(key)
+        if row is not None:
+            return row
+        row = len(self.index)
+        if row >= len(self._records):
+            grown = np.zeros(max(2 * len(self._records), 1), dtype=self._records.dtype)
+            grown[:row] = self._records[:row]
+            self._records = grown
+            self._bind()
+        record = self._records[row]
+        record["key"] = key
+        if init is not None:
+            coef, intercept, t = init
+            record["coef"] = coef
+            record["intercept"] = intercept
+            record["t"] = t
+        else:
+            record["t"] = 1.0
+        self.index[key] = row
+        return row
+
+    def reseed(self, init):
+        """
+        Restart every registered model from `init` = (coef, intercept, t),
+        e.g. when a new global model is installed.
+        """
+        coef, intercept, t = init
+        n = len(self.index)
+        self.coef[:n] = coef
+        self.intercept[:n] = intercept
+        self.t[:n] = t
+
+    def rows(self, keys, init=None):
+        return np.fromiter((self.row(key, init) for key in keys), dtype=np.intp)
+
+    def predict(self, rows, X):
+        X = np.asarray(X, dtype=float)
+        return np.einsum("ij,ij->i", self.coef[rows], X) + self.intercept[rows]
+
+    def partial_fit(self, rows, X, y):
+        """
+        One SGD step for each listed row on its own sample. Rows may repeat;
+        repeated rows are applied in order.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        _, first = np.unique(rows, return_index=True)
+        if len(first) < len(rows):
+            done = np.zeros(len(rows), dtype=bool)
+            while not done.all():
+                pending = np.flatnonzero(~done)
+                _, first = np.unique(rows[pending], return_index=True)
+                batch = pending[first]
+                self._step(rows[batch], X[batch], y[batch])
+                done[batch] = True
+            return self
+        self._step(rows, X, y)
+        return self
+
+    def _step(self, rows, X, y):
+        coef = self.coef[rows]
+        intercept = self.intercept[rows]
+        t = self.t[rows]
+        eta = self.eta0 / t**self.power_t
+        dloss = np.clip(
+            np.einsum("ij,ij->i", coef, X) + intercept - y, -MAX_DLOSS, MAX_DLOSS
+        )
+        decay = np.maximum(0.0, 1.0 - eta * self.alpha)
+        self.coef[rows] = coef * decay[:, None] - (eta * dloss)[:, None] * X
+        self.intercept[rows] = intercept - eta * dloss
+        self.t[rows] = t + 1
+
+    def predict_update(self, rows, X, y):
+        """
+        Predict each row's sample, then learn from it. Returns the
+        predictions made before the update.
+        """
+        predicted = self.predict(rows, X)
+        self.partial_fit(rows, X, y)
+        return predicted
+
+    def predict_update_one(self, row, current_speed, free_flow_speed, actual):
+        coef = self.coef[row]
+        w0, w1 = coef
+        intercept = self.intercept[row]
+        predicted = w0 * current_speed + w1 * free_flow_speed + intercept
+        eta = self.eta0 / self.t[row] ** self.power_t
+        dloss = min(max(predicted - actual, -MAX_DLOSS), MAX_DLOSS)
+        decay = max(0.0, 1.0 - eta * self.alpha)
+        coef[0] = w0 * decay - eta * dloss * current_speed
+        coef[1] = w1 * decay - eta * dloss * free_flow_speed
+        self.intercept[row] = intercept - eta * dloss
+        self.t[row] += 1
+        return float(predicted)
+
+    def save(self, path=None):
+        """
+        Write the registry to a .npy file and keep working on it memory-mapped.
+        """
+        path = path or self.path
+        records = self._records
+        if isinstance(records, np.memmap) and records.filename == os.path.abspath(path):
+            records.flush()
+            return path
+        mapped = np.lib.format.open_memmap(
+            path, mode="w+", dtype=records.dtype, shape=records.shape
+        )
+        mapped[:] = records
+        mapped.flush()
+        self.path = path
+        self._records = mapped
+        self._bind()
+        return path
+
+    def flush(self):
+        if self.path:
+            self.save()
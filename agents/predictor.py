@@ -0,0 +1,337 @@
+# agents/predictor.py
+
+import os
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from config import PREDICTOR_BACKEND, PREDICTOR_FEATURE_SCALING
+
+# sklearn clips the loss derivative to this magnitude in its SGD loop.
+MAX_DLOSS = 1e12
+
+
+class CongestionPredictor(ABC):
+    """
+    Interface for the online congestion model used by TrafficSignalAgent.
+
+    Method names follow the sklearn regressor API the agent already relied
+    on (predict / partial_fit over 2-D feature arrays of current_speed,
+    free_flow_speed), so retrained sklearn models and NumPy predictors are
+    interchangeable.
+    """
+
+    @abstractmethod
+    def predict(self, X):
+        pass
+
+    @abstractmethod
+    def partial_fit(self, X, y):
+        pass
+
+    def predict_update_one(self, current_speed, free_flow_speed, actual):
+        """
+        Predict one sample, then learn from its observed value. Returns the
+        prediction made before the update.
+        """
+        X = np.array([[current_speed, free_flow_speed]], dtype=float)
+        predicted = float(self.predict(X)[0])
+        self.partial_fit(X, np.array([actual], dtype=float))
+        return predicted
+
+    @abstractmethod
+    def get_weights(self):
+        """
+        Returns (coef, intercept, t): raw-feature weights, bias and the
+        learning-rate step counter.
+        """
+
+    def to_sklearn(self):
+        """
+        Export as a fitted SGDRegressor with the same weights.
+        """
+        from sklearn.linear_model import SGDRegressor
+
+        coef, intercept, t = self.get_weights()
+        model = SGDRegressor(max_iter=1000, tol=1e-3)
+        model.partial_fit(np.zeros((1, len(coef))), np.array([0.0]))
+        model.coef_ = np.array(coef, dtype=float)
+        model.intercept_ = np.array([intercept], dtype=float)
+        model.t_ = float(t)
+        return model
+
+
+class SklearnPredictor(CongestionPredictor):
+    def __init__(self, model=None):
+        """
+        Wraps an SGDRegressor; a new one is created when `model` is None.
+        """
+        if model is None:
+            from sklearn.linear_model import SGDRegressor
+
+            model = SGDRegressor(max_iter=1000, tol=1e-3)
+        self.model = model
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+    def partial_fit(self, X, y):
+        self.model.partial_fit(X, y)
+        return self
+
+    def get_weights(self):
+        return (
+            self.model.coef_.copy(),
+            float(self.model.intercept_[0]),
+            float(self.model.t_),
+        )
+
+    def to_sklearn(self):
+        return self.model
+
+
+class NumpyOnlinePredictor(CongestionPredictor):
+    def __init__(
+        self,
+        n_features=2,
+        eta0=0.01,
+        power_t=0.25,
+        alpha=0.0001,
+        scale=PREDICTOR_FEATURE_SCALING,
+    ):
+        """
+        Pure-NumPy online linear model.
+
+        Without scaling, updates reproduce SGDRegressor's defaults (squared
+        loss, L2 penalty, inverse-scaling learning rate): partial_fit takes
+        one SGD step per row, in row order, like
+        SGDRegressor(shuffle=False).partial_fit.
+
+        Parameters:
+            n_features (int): Number of input features.
+            eta0 (float): Initial learning rate.
+            power_t (float): Exponent of the inverse-scaling learning rate.
+            alpha (float): L2 regularization strength.
+            scale (bool): Standardize features with running mean/variance.
+        """
+        self.eta0 = eta0
+        self.power_t = power_t
+        self.alpha = alpha
+        self.scale = scale
+        self.coef = np.zeros(n_features)
+        self.intercept = 0.0
+        self.t = 1.0
+        self.count = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """
+        Import the weights of a fitted SGDRegressor.
+        """
+        params = model.get_params()
+        if params["learning_rate"] != "invscaling" or params["penalty"] != "l2":
+            raise ValueError(
+                "Only SGDRegressor with the invscaling learning rate and L2 penalty can be imported."
+            )
+        predictor = cls(
+            n_features=len(model.coef_),
+            eta0=params["eta0"],
+            power_t=params["power_t"],
+            alpha=params["alpha"],
+            scale=False,
+        )
+        predictor.coef = np.array(model.coef_, dtype=float)
+        predictor.intercept = float(model.intercept_[0])
+        predictor.t = float(model.t_)
+        return predictor
+
+    def _std(self):
+        if self.count < 2:
+            return np.ones_like(self.mean)
+        std = np.sqrt(self.m2 / self.count)
+        return np.where(std > 1e-12, std, 1.0)
+
+    def _update_scaler(self, X):
+        n = len(X)
+        batch_mean = X.mean(axis=0)
+        delta = batch_mean - self.mean
+        total = self.count + n
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = (
+            self.m2
+            + ((X - batch_mean) ** 2).sum(axis=0)
+            + delta**2 * (self.count * n / total)
+        )
+        self.count = total
+
+    def _transform(self, X):
+        if not self.scale:
+            return X
+        return (X - self.mean) / self._std()
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=float)
+        return self._transform(X) @ self.coef + self.intercept
+
+    def partial_fit(self, X, y):
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.scale:
+            self._update_scaler(X)
+        Xs = self._transform(X)
+        coef = self.coef
+        intercept = self.intercept
+        t = self.t
+        for x, target in zip(Xs, y.tolist()):
+            eta = self.eta0 / t**self.power_t
+            dloss = float(x @ coef) + intercept - target
+            dloss = min(max(dloss, -MAX_DLOSS), MAX_DLOSS)
+            coef *= max(0.0, 1.0 - eta * self.alpha)
+            coef -= eta * dloss * x
+            intercept -= eta * dloss
+            t += 1
+        self.intercept = intercept
+        self.t = t
+        return self
+
+    def predict_update_one(self, current_speed, free_flow_speed, actual):
+        if self.scale:
+            return super().predict_update_one(current_speed, free_flow_speed, actual)
+        # Plain-float path: no array allocation for the per-intersection update.
+        w0, w1 = self.coef
+        predicted = w0 * current_speed + w1 * free_flow_speed + self.intercept
+        eta = self.eta0 / self.t**self.power_t
+        dloss = min(max(predicted - actual, -MAX_DLOSS), MAX_DLOSS)
+        decay = max(0.0, 1.0 - eta * self.alpha)
+        self.coef[0] = w0 * decay - eta * dloss * current_speed
+        self.coef[1] = w1 * decay - eta * dloss * free_flow_speed
+        self.intercept -= eta * dloss
+        self.t += 1
+        return predicted
+
+    def get_weights(self):
+        if not self.scale:
+            return self.coef.copy(), self.intercept, self.t
+        # Fold the standardization into raw-feature weights.
+        std = self._std()
+        coef = self.coef / std
+        return coef, self.intercept - float(coef @ self.mean), self.t
+
+
+def make_predictor(backend=PREDICTOR_BACKEND):
+    if backend == "numpy":
+        return NumpyOnlinePredictor()
+    if backend == "sklearn":
+        return SklearnPredictor()
+    raise ValueError(f"Unknown predictor backend: {backend}")
+
+
+def as_predictor(model, backend=PREDICTOR_BACKEND):
+    """
+    Wrap a fitted SGDRegressor (e.g. from retraining) as a predictor of the
+    configured backend; predictors are returned unchanged.
+    """
+    if isinstance(model, CongestionPredictor):
+        return model
+    if backend == "numpy":
+        return NumpyOnlinePredictor.from_sklearn(model)
+    return SklearnPredictor(model)
+
+
+def predictor_state(predictor):
+    """
+    A predictor's weights (and scaler state) as a dict of arrays.
+    """
+    if isinstance(predictor, NumpyOnlinePredictor):
+        state = {
+            "coef": predictor.coef,
+            "intercept": predictor.intercept,
+            "t": predictor.t,
+            "scale": predictor.scale,
+            "count": predictor.count,
+            "mean": predictor.mean,
+            "m2": predictor.m2,
+            "hyper": (predictor.eta0, predictor.power_t, predictor.alpha),
+        }
+    else:
+        coef, intercept, t = predictor.get_weights()
+        state = {"coef": coef, "intercept": intercept, "t": t, "scale": False}
+    return {name: np.asarray(value) for name, value in state.items()}
+
+
+def predictor_from_state(state, backend=PREDICTOR_BACKEND):
+    """
+    Rebuild a predictor of the given backend from predictor_state().
+    """
+    hyper = state["hyper"].tolist() if "hyper" in state else ()
+    predictor = NumpyOnlinePredictor(
+        len(state["coef"]), *hyper, scale=bool(state["scale"])
+    )
+    predictor.coef = np.array(state["coef"], dtype=float)
+    predictor.intercept = float(state["intercept"])
+    predictor.t = float(state["t"])
+    if predictor.scale:
+        predictor.count = int(state["count"])
+        predictor.mean = np.array(state["mean"], dtype=float)
+        predictor.m2 = np.array(state["m2"], dtype=float)
+    if backend == "sklearn":
+        return SklearnPredictor(predictor.to_sklearn())
+    return predictor
+
+
+def save_predictor(predictor, path):
+    """
+    Checkpoint a predictor's weights (and scaler state) to an .npz file.
+    The file is replaced atomically, so an interrupted write leaves the
+    previous checkpoint intact.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **predictor_state(predictor))
+    os.replace(tmp, path)
+    return path
+
+
+def load_predictor(path, backend=PREDICTOR_BACKEND):
+    """
+    Predictor of the configured backend restored from a save_predictor()
+    checkpoint, or None when there is no readable checkpoint.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as state:
+            state = {name: state[name] for name in state.files}
+        return predictor_from_state(state, backend)
+    except (OSError, KeyError, ValueError) as e:
+        print("Ignoring unreadable model checkpoint:", e)
+        return None
+
+
+def benchmark_updates(predictor, n_updates=10000, seed=0):
+    """
+    Microbenchmark: mean seconds per predict_update_one call on a
+    cold-started predictor. Run with `python -m agents.predictor`.
+    """
+    predictor.partial_fit(np.array([[0.0, 1.0]]), np.array([0.0]))
+    rng = np.random.default_rng(seed)
+    current = rng.uniform(10, 60, n_updates).tolist()
+    actual = rng.uniform(0, 1, n_updates).tolist()
+    started = time.perf_counter()
+    for i in range(n_updates):
+        predictor.predict_update_one(current[i], 60.0, actual[i])
+    return (time.perf_counter() - started) / n_updates
+
+
+if __name__ == "__main__":
+    for name, predictor in (
+        ("sklearn", SklearnPredictor()),
+        ("numpy", NumpyOnlinePredictor(scale=False)),
+        ("numpy (scaled)", NumpyOnlinePredictor(scale=True)),
+    ):
+        n_updates = 2000 if name == "sklearn" else 20000
+        per_update = benchmark_updates(predictor, n_updates)
+        print(f"{name:>15}: {per_update * 1e6:8.2f} us per update")
@@ -0,0 +1,216 @@
+# agents/retrain_scheduler.py
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from agents.metrics import get_metrics
+from agents.predictor import as_predictor
+from config import (
+    LAST_RETRAIN_FILE,
+    RETRAIN_INTERVAL_SECONDS,
+    RETRAIN_MAX_VERSIONS,
+    RETRAIN_RETRY_SECONDS,
+    RETRAIN_STREAMING,
+    RETRAIN_VALIDATION_ROWS,
+)
+
+
+class ModelVersion:
+    __slots__ = ("version", "model", "validation_error", "created_at")
+
+    def __init__(self, version, model, validation_error=None, created_at=None):
+        self.version = version
+        self.model = model
+        self.validation_error = validation_error
+        self.created_at = created_at if created_at is not None else time.time()
+
+
+def validation_error(model, X, y):
+    """
+    Mean squared error of a model's clipped congestion predictions.
+    """
+    return prediction_error(model.predict(X), y)
+
+
+def prediction_error(predicted, y):
+    """
+    Mean squared error of clipped congestion predictions.
+    """
+    predicted = np.clip(predicted, 0, 1)
+    return float(np.mean((predicted - y) ** 2))
+
+
+class RetrainScheduler:
+    def __init__(
+        self,
+        agent,
+        interval_seconds=RETRAIN_INTERVAL_SECONDS,
+        last_retrain_file=LAST_RETRAIN_FILE,
+        validation_rows=RETRAIN_VALIDATION_ROWS,
+        max_versions=RETRAIN_MAX_VERSIONS,
+        retry_seconds=RETRAIN_RETRY_SECONDS,
+    ):
+        """
+        Runs TrafficSignalAgent retraining on a background worker thread.
+
+        The schedule is read from `last_retrain_file` once and then kept in
+        memory, so maybe_retrain() is a timestamp comparison. A retrained
+        model is validated on held-out history and only swapped into
+        agent.online_model if its error is no worse than the live model's;
+        otherwise the live model is kept (rolled back). Accepted models are
+        kept as numbered versions so rollback() can restore an earlier one.
+        A retrain that raises is logged and retried after `retry_seconds`,
+        doubling per consecutive failure up to the regular interval.
+        """
+        self.agent = agent
+        self.interval_seconds = interval_seconds
+        self.last_retrain_file = last_retrain_file
+        self.validation_rows = validation_rows
+        self.max_versions = max_versions
+        self.retry_seconds = retry_seconds
+        self.failures = 0  # consecutive failed retrains
+        self.last_retrain_ts = self._read_last_retrain()
+        self.next_retrain_ts = self.last_retrain_ts + interval_seconds
+        self.versions = [ModelVersion(0, agent.online_model)]
+        self._next_version = 1
+        self._lock = threading.Lock()
+        self._future = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrain")
+
+    @property
+    def version(self):
+        return self.versions[-1].version
+
+    @property
+    def running(self):
+        return self._future is not None and not self._future.done()
+
+    def _read_last_retrain(self):
+        if os.path.exists(self.last_retrain_file):
+            with open(self.last_retrain_file, "r") as f:
+                try:
+                    return float(f.read().strip())
+                except ValueError:
+                    return 0
+        return 0
+
+    def maybe_retrain(self, now=None):
+        """
+        Start a background retrain if one is due. Never blocks; returns True
+        when a retrain was started.
+        """
+        if (now if now is not None else time.time()) < self.next_retrain_ts:
+            return False
+        return self.trigger()
+
+    def trigger(self):
+        """
+        Start a background retrain now unless one is already running.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            # Push the schedule forward so callers stop triggering while it runs.
+            self.next_retrain_ts = time.time() + self.interval_seconds
+            future = self._future = self._executor.submit(self._retrain)
+        future.add_done_callback(self._retrain_done)
+        return True
+
+    def _retrain_done(self, future):
+        """
+        Log a failed retrain and schedule a retry with exponential backoff.
+        """
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.failures = 0
+            return
+        self.failures += 1
+        delay = min(
+            self.retry_seconds * 2 ** (self.failures - 1), self.interval_seconds
+        )
+        self.next_retrain_ts = time.time() + delay
+        get_metrics().count("retrain.failures")
+        print(f"Retrain failed ({error!r}); retrying in {delay:.0f}s.")
+
+    def wait(self, timeout=None):
+        """
+        Block until the current retrain (if any) finishes; returns its outcome.
+        """
+        future = self._future
+        if future is None:
+            return None
+        return future.result(timeout)
+
+    def _retrain(self):
+        agent = self.agent
+        if RETRAIN_STREAMING:
+            new_model = agent.retrain_model_streaming(holdout_rows=self.validation_rows)
+            holdout = agent.last_holdout
+        else:
+            new_model = agent.retrain_model_from_data()
+            holdout = None
+
+        completed_ts = time.time()
+        with open(self.last_retrain_file, "w") as f:
+            f.write(str(completed_ts))
+        self.last_retrain_ts = completed_ts
+        self.next_retrain_ts = completed_ts + self.interval_seconds
+        stamp = datetime.fromtimestamp(completed_ts, timezone.utc)
+        print("Model retrained at:", stamp.replace(tzinfo=None).isoformat() + "Z")
+
+        if new_model is None:
+            return "skipped"
+        new_error = current_error = None
+        if holdout is not None and len(holdout[1]):
+            X, y, points = holdout
+            # Installing restarts the per-intersection models from the new
+            # model, so it is compared with what serves predictions now.
+            new_error = validation_error(new_model, X, y)
+            current_error = prediction_error(agent.serving_predictions(X, points), y)
+            if new_error > current_error:
+                print(
+                    f"Retrained model rejected (validation MSE {new_error:.4f} > "
+                    f"{current_error:.4f}); keeping version {self.version}."
+                )
+                return "rejected"
+        self.install(new_model, new_error)
+        return "accepted"
+
+    def install(self, model, error=None):
+        """
+        Atomically make `model` the live model as a new version and restart
+        the per-intersection models from it. Fitted sklearn models are
+        converted to the configured predictor backend.
+        """
+        model = as_predictor(model)
+        with self._lock:
+            entry = ModelVersion(self._next_version, model, error)
+            self._next_version += 1
+            self.versions.append(entry)
+            del self.versions[: -self.max_versions]
+            self.agent.online_model = model
+            self.agent.reseed_intersection_models(model)
+        print(f"Installed model version {entry.version}.")
+        return entry.version
+
+    def rollback(self):
+        """
+        Restore the previous model version (restarting the per-intersection
+        models from it). Returns the live version number.
+        """
+        with self._lock:
+            if len(self.versions) > 1:
+                self.versions.pop()
+                model = self.agent.online_model = self.versions[-1].model
+                self.agent.reseed_intersection_models(model)
+            return self.versions[-1].version
+
+    def close(self):
+        self._executor.shutdown(wait=True)
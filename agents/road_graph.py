@@ -0,0 +1,383 @@
+# agents/road_graph.py
+
+import heapq
+import math
+
+import numpy as np
+
+from agents.metrics import timed
+from agents.spatial_index import SpatialIndex
+from config import (
+    ROAD_LINK_METERS,
+    ROAD_MAX_NEIGHBORS,
+    ROUTE_CONGESTION_PENALTY,
+    ROUTE_CONGESTION_TOLERANCE,
+    ROUTE_FREE_FLOW_MPS,
+)
+
+NO_NODE = -1
+
+_csgraph = None
+
+
+def _scipy_dijkstra():
+    """
+    (csr_matrix, dijkstra) from SciPy, or () without it. Imported on first
+    use: SciPy takes longer to import than the rest of the simulation.
+    """
+    global _csgraph
+    if _csgraph is None:
+        try:
+            from scipy.sparse import csr_matrix
+            from scipy.sparse.csgraph import dijkstra
+        except ImportError:  # optional; trees are then searched in pure Python
+            _csgraph = ()
+        else:
+            _csgraph = (csr_matrix, dijkstra)
+    return _csgraph
+
+
+class ShortestPathTree:
+    """
+    Shortest paths from every node to one destination: cost[node] is the
+    travel time in seconds and next_hop[node] the neighbour to drive to
+    (NO_NODE at the destination and for unreachable nodes).
+    """
+
+    __slots__ = ("destination", "cost", "next_hop")
+
+    def __init__(self, destination, cost, next_hop):
+        self.destination = destination
+        self.cost = cost
+        self.next_hop = next_hop
+
+
+class RoadGraph:
+    def __init__(self, names, coords, edges):
+        """
+        Directed road network over intersections with congestion-weighted
+        travel-time edge costs.
+
+        Routing answers come from per-destination shortest-path trees
+        (Dijkstra towards the destination over reversed edges). Trees are
+        cached, and a congestion update only touches the trees its
+        re-costed edges matter to: those routing over an edge that got
+        dearer, or that an edge which got cheaper now shortcuts.
+
+        With SciPy installed, such trees are dropped and rebuilt together
+        in one compiled Dijkstra call on the next query. Without it they
+        are repaired in place: nodes routed over a dearer edge are
+        re-settled and cheaper edges propagate their savings upstream, so
+        untouched parts of a tree are never searched again.
+
+        Parameters:
+            names (list): Intersection names.
+            coords (array-like): (n, 2) array of (lat, lon).
+            edges (iterable): Directed (from name, to name) pairs.
+        """
+        self.names = list(names)
+        self.index = {name: row for row, name in enumerate(self.names)}
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        pairs = np.array(
+            [(self.index[a], self.index[b]) for a, b in edges], dtype=np.intp
+        ).reshape(-1, 2)
+        self.src = pairs[:, 0]
+        self.dst = pairs[:, 1]
+        lat0 = math.radians(coords[:, 0].mean()) if len(coords) else 0.0
+        dy = (coords[self.dst, 0] - coords[self.src, 0]) * 110540.0
+        dx = (coords[self.dst, 1] - coords[self.src, 1]) * 111320.0 * math.cos(lat0)
+        self.coords = coords
+        self.length = np.hypot(dx, dy)
+        self.base_cost = self.length / ROUTE_FREE_FLOW_MPS
+        self.congestion = np.zeros(len(self.names))
+        self.cost = self.base_cost.copy()
+
+        # Incoming edges grouped by destination node, for reverse Dijkstra.
+        order = np.argsort(self.dst, kind="stable")
+        self._in_edges = order
+        self._in_bounds = np.searchsorted(
+            self.dst[order], np.arange(len(self.names) + 1)
+        ).tolist()
+        self._in_src = self.src[order].tolist()
+        self._in_cost = self.cost[order].tolist()
+
+        # Edges sorted by (src, dst) key, for edge lookups by endpoints.
+        keys = self.src * len(self.names) + self.dst
+        self._edge_order = np.argsort(keys, kind="stable")
+        self._edge_keys = keys[self._edge_order]
+
+        self._trees = {}  # destination row -> ShortestPathTree
+        self.stats = {"searches": 0, "hits": 0, "repairs": 0, "invalidations": 0}
+
+    @classmethod
+    def from_intersections(
+        cls,
+        intersections,
+        link_meters=ROAD_LINK_METERS,
+        max_neighbors=ROAD_MAX_NEIGHBORS,
+    ):
+        """
+        Two-way links from each intersection to its `max_neighbors` nearest
+        intersections within `link_meters`, for networks without road data.
+        """
+        names = list(intersections)
+        coords = np.array(list(intersections.values()), dtype=float).reshape(-1, 2)
+        index = SpatialIndex(names, coords, cell_meters=link_meters)
+        edges = set()
+        nearby = index.within_many(coords[:, 0], coords[:, 1], link_meters)
+        for row, rows in enumerate(nearby):
+            for other in rows[rows != row][:max_neighbors].tolist():
+                edges.add((names[row], names[other]))
+                edges.add((names[other], names[row]))
+        return cls(names, coords, sorted(edges))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def edges_between(self, sources, targets):
+        """
+        Edge rows for arrays of (source row, target row) pairs; NO_NODE
+        where the two are not linked.
+        """
+        keys = np.asarray(sources) * len(self.names) + np.asarray(targets)
+        if not len(self._edge_keys):
+            return np.full(keys.shape, NO_NODE, dtype=np.intp)
+        pos = np.minimum(
+            np.searchsorted(self._edge_keys, keys), len(self._edge_keys) - 1
+        )
+        return np.where(self._edge_keys[pos] == keys, self._edge_order[pos], NO_NODE)
+
+    def update_congestion(self, congestion, tolerance=ROUTE_CONGESTION_TOLERANCE):
+        """
+        Re-cost edges into nodes whose congestion moved by more than
+        `tolerance` and update the cached trees they affect.
+
+        Parameters:
+            congestion (dict or array): name -> congestion in [0, 1], or an
+                array aligned with names.
+        Returns the number of edges re-costed.
+        """
+        if isinstance(congestion, dict):
+            values = self.congestion.copy()
+            for name, value in congestion.items():
+                row = self.index.get(name)
+                if row is not None:
+                    values[row] = value
+        else:
+            values = np.asarray(congestion, dtype=float)
+        moved = np.abs(values - self.congestion) > tolerance
+        if not moved.any():
+            return 0
+        self.congestion[moved] = values[moved]
+        edges = np.flatnonzero(moved[self.dst])
+        new_cost = self.base_cost[edges] * (
+            1 + ROUTE_CONGESTION_PENALTY * self.congestion[self.dst[edges]]
+        )
+        old_cost = self.cost[edges]
+        self.cost[edges] = new_cost
+        self._in_cost = self.cost[self._in_edges].tolist()
+        if _scipy_dijkstra():
+            self._invalidate(edges, old_cost)
+        else:
+            for tree in self._trees.values():
+                self._repair(tree, edges, old_cost)
+        return len(edges)
+
+    def _invalidate(self, edges, old_cost):
+        """
+        Drop the cached trees that re-costing `edges` makes wrong.
+        """
+        src = self.src[edges]
+        dst = self.dst[edges]
+        new_cost = self.cost[edges]
+        dearer = new_cost > old_cost
+        stale = [
+            destination
+            for destination, tree in self._trees.items()
+            if (dearer & (tree.next_hop[src] == dst)).any()
+            or (new_cost + tree.cost[dst] < tree.cost[src] - 1e-9).any()
+        ]
+        for destination in stale:
+            del self._trees[destination]
+        self.stats["invalidations"] += len(stale)
+
+    def _repair(self, tree, edges, old_cost):
+        """
+        Bring a tree up to date after `edges` were re-costed from
+        `old_cost`, searching only the part of the graph they affect.
+        """
+        src = self.src[edges]
+        dst = self.dst[edges]
+        new_cost = self.cost[edges]
+        cost = tree.cost
+        next_hop = tree.next_hop
+
+        # Nodes whose route uses an edge that got dearer lose their label.
+        dearer = (next_hop[src] == dst) & (new_cost > old_cost)
+        affected = np.zeros(len(self.names), dtype=bool)
+        affected[src[dearer]] = True
+        if affected.any():
+            # Spread to every node routed through them by pointer jumping:
+            # after k rounds each node has checked its next 2^k hops.
+            ahead = np.where(next_hop == NO_NODE, np.arange(len(self.names)), next_hop)
+            while True:
+                affected |= affected[ahead]
+                further = ahead[ahead]
+                if np.array_equal(further, ahead):
+                    break
+                ahead = further
+            cost[affected] = np.inf
+            next_hop[affected] = NO_NODE
+
+        # Seeds: affected nodes re-attached through unaffected neighbours,
+        # plus every re-costed edge that now offers a shorter route.
+        out = np.flatnonzero(affected[self.src] & ~affected[self.dst])
+        out = np.concatenate((out, edges))
+        candidate = self.cost[out] + cost[self.dst[out]]
+        better = candidate < cost[self.src[out]] - 1e-9
+        if not better.any():
+            return
+        out, candidate = out[better], candidate[better]
+        order = np.lexsort((candidate, self.src[out]))
+        first = order[np.flatnonzero(np.diff(self.src[out][order], prepend=-1))]
+        seeds = self.src[out][first]
+        cost[seeds] = candidate[first]
+        next_hop[seeds] = self.dst[out][first]
+
+        self.stats["repairs"] += 1
+        self._settle(tree, list(zip(cost[seeds].tolist(), seeds.tolist())))
+
+    def _settle(self, tree, heap):
+        """
+        Dijkstra over reversed edges from the (cost, node) entries in
+        `heap`, improving the labels already in `tree`.
+        """
+        cost = tree.cost.tolist()
+        next_hop = tree.next_hop.tolist()
+        bounds = self._in_bounds
+        in_src = self._in_src
+        in_cost = self._in_cost
+        heapq.heapify(heap)
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > cost[node]:
+                continue
+            for i in range(bounds[node], bounds[node + 1]):
+                other = in_src[i]
+                candidate = d + in_cost[i]
+                if candidate < cost[other]:
+                    cost[other] = candidate
+                    next_hop[other] = node
+                    heapq.heappush(heap, (candidate, other))
+        tree.cost = np.array(cost)
+        tree.next_hop = np.array(next_hop, dtype=np.intp)
+
+    @timed("routing.shortest_path_tree")
+    def _search(self, destinations):
+        """
+        Build the trees for `destinations` (graph rows) and cache them.
+        """
+        n = len(self.names)
+        self.stats["searches"] += len(destinations)
+        scipy = _scipy_dijkstra()
+        if scipy and len(self.cost):
+            csr_matrix, dijkstra = scipy
+            # Shortest paths *to* each destination are paths *from* it on the
+            # reversed graph; its predecessors are the forward next hops.
+            reversed_graph = csr_matrix(
+                (np.maximum(self.cost, 1e-9), (self.dst, self.src)), shape=(n, n)
+            )
+            costs, predecessors = dijkstra(
+                reversed_graph, indices=destinations, return_predecessors=True
+            )
+            for destination, cost, next_hop in zip(destinations, costs, predecessors):
+                next_hop = next_hop.astype(np.intp)
+                next_hop[next_hop < 0] = NO_NODE
+                self._trees[destination] = ShortestPathTree(destination, cost, next_hop)
+            return
+        for destination in destinations:
+            tree = ShortestPathTree(
+                destination, np.full(n, np.inf), np.full(n, NO_NODE, dtype=np.intp)
+            )
+            tree.cost[destination] = 0.0
+            self._settle(tree, [(0.0, destination)])
+            self._trees[destination] = tree
+
+    def trees(self, destinations):
+        """
+        Shortest-path trees towards several destination rows; missing ones
+        are built in one batch.
+        """
+        missing = [row for row in destinations if row not in self._trees]
+        self.stats["hits"] += len(destinations) - len(missing)
+        if missing:
+            self._search(missing)
+        return [self._trees[row] for row in destinations]
+
+    def tree(self, destination):
+        """
+        Shortest-path tree towards a destination name or row, from cache
+        when still valid.
+        """
+        if not isinstance(destination, (int, np.integer)):
+            destination = self.index[destination]
+        return self.trees([int(destination)])[0]
+
+    def route(self, source, destination):
+        """
+        (next hop name, travel time in seconds) from source to destination;
+        next hop is None at the destination, and (None, inf) when the
+        destination cannot be reached.
+        """
+        tree = self.tree(destination)
+        row = self.index[source]
+        next_hop = int(tree.next_hop[row])
+        return (
+            None if next_hop == NO_NODE else self.names[next_hop],
+            float(tree.cost[row]),
+        )
+
+    def route_many(self, sources, destination):
+        """
+        Batched route(): next-hop rows (NO_NODE at the destination or when
+        unreachable) and travel times for an array of source rows, all from
+        one tree.
+        """
+        tree = self.tree(destination)
+        return tree.next_hop[sources], tree.cost[sources]
+
+    def route_groups(self, sources, destinations):
+        """
+        route_many() for vehicles with mixed destinations: one batched tree
+        build for the missing destinations, then one gather per destination.
+        """
+        next_hops = np.full(len(sources), NO_NODE, dtype=np.intp)
+        costs = np.full(len(sources), np.inf)
+        targets, groups = np.unique(destinations, return_inverse=True)
+        groups = groups.reshape(-1)
+        trees = self.trees(targets.tolist())
+        order = np.argsort(groups, kind="stable")
+        bounds = np.searchsorted(groups[order], np.arange(len(targets) + 1))
+        for i, tree in enumerate(trees):
+            members = order[bounds[i] : bounds[i + 1]]
+            next_hops[members] = tree.next_hop[sources[members]]
+            costs[members] = tree.cost[sources[members]]
+        return next_hops, costs
+
+    def path(self, source, destination):
+        """
+        Intersection names from source to destination (inclusive), or []
+        when unreachable.
+        """
+        tree = self.tree(destination)
+        row = self.index[source]
+        if math.isinf(tree.cost[row]):
+            return []
+        path = [self.names[row]]
+        while row != tree.destination:
+            row = int(tree.next_hop[row])
+            path.append(self.names[row])
+        return path
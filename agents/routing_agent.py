@@ -1,25 +1,131 @@
 # agents/routing_agent.py
 
-import requests
-import random
-from config import API_KEY
+import math
+
+import numpy as np
+
+from agents.flow_provider import get_default_provider
+from agents.metrics import timed
+from agents.road_graph import NO_NODE
+
+REROUTE_SPEED = 20  # km/h; off the road graph, slower vehicles are rerouted
 
 
 class RoutingAgent:
-    def __init__(self):
-        pass
+    def __init__(
+        self, flow_provider=None, spatial_index=None, road_graph=None, destinations=None
+    ):
+        """
+        Parameters:
+            flow_provider: Flow-data source (default: the shared provider).
+            spatial_index (SpatialIndex): When given, query points are
+                snapped to their segment key first, so nearby vehicles share
+                one flow lookup.
+            road_graph (RoadGraph): Routes vehicles along congestion-weighted
+                shortest paths; without it (or for vehicles off the graph)
+                routing falls back to the local speed check.
+            destinations (dict): Vehicle destination -> intersection name,
+                for destinations that are not intersections themselves.
+        """
+        self.flow_provider = flow_provider or get_default_provider()
+        self.spatial_index = spatial_index
+        self.road_graph = road_graph
+        self.destinations = destinations or {}
+        self.next_hops = {}  # vehicle id -> next hop of its last route
 
+    @timed("routing.get_traffic_data")
     def get_traffic_data(self, lat, lon):
-        url = "https://api.tomtom.com/traffic/services/4/flowSegmentData/relative0/10/json"
-        params = {"point": f"{lat},{lon}", "unit": "KMPH", "key": API_KEY}
-        try:
-            res = requests.get(url, params=params)
-            return res.json().get("flowSegmentData", {})
-        except Exception as e:
-            print("Exception in get_traffic_data:", e)
-            return {"currentSpeed": random.randint(10, 60), "freeFlowSpeed": 60}
+        if self.spatial_index is not None:
+            lat, lon = self.spatial_index.segment_key(lat, lon)
+        return self.flow_provider.get_flow_data(lat, lon)
+
+    def destination_node(self, destination):
+        """
+        Graph intersection for a vehicle destination, or None.
+        """
+        if self.road_graph is None:
+            return None
+        node = self.destinations.get(destination, destination)
+        return node if node in self.road_graph else None
+
+    def route_message(self, vehicle_id, destination, next_hop, travel_time):
+        """
+        Describe a route and remember its next hop; a changed next hop is
+        reported as a reroute.
+        """
+        if next_hop is None:
+            self.next_hops.pop(vehicle_id, None)
+            return f"{vehicle_id} → arrived at {destination}."
+        previous = self.next_hops.get(vehicle_id)
+        self.next_hops[vehicle_id] = next_hop
+        if previous is not None and previous != next_hop:
+            return f"{vehicle_id} → rerouted via {next_hop} to avoid congestion (ETA {travel_time:.0f}s)."
+        return f"{vehicle_id} → continue via {next_hop} to {destination} (ETA {travel_time:.0f}s)."
 
+    @timed("routing.route_vehicle")
     def route_vehicle(self, vehicle, traffic_data):
-        if traffic_data.get("currentSpeed", 0) < 20:
-            return f"{vehicle['id']} → rerouted to avoid congestion."
-        return f"{vehicle['id']} → continue on current path."
+        node = self.destination_node(vehicle.destination)
+        if node is not None and vehicle.intersection in self.road_graph:
+            next_hop, travel_time = self.road_graph.route(vehicle.intersection, node)
+            if not math.isinf(travel_time):
+                return self.route_message(
+                    vehicle.id, vehicle.destination, next_hop, travel_time
+                )
+        return self.speed_route(vehicle.id, traffic_data.get("currentSpeed", 0))
+
+    def speed_route(self, vehicle_id, current_speed):
+        """
+        Routing decision for a vehicle without a graph route, from the
+        current speed at its position.
+        """
+        if current_speed < REROUTE_SPEED:
+            return f"{vehicle_id} → rerouted to avoid congestion."
+        return f"{vehicle_id} → continue on current path."
+
+    def fleet_destinations(self, fleet, rows):
+        """
+        Graph rows of the destinations of fleet `rows` (NO_NODE for
+        destinations off the graph).
+        """
+        graph = self.road_graph
+        if graph is None:
+            return np.full(len(rows), NO_NODE, dtype=np.intp)
+        return np.array(
+            [
+                graph.index.get(self.destination_node(name), NO_NODE)
+                for name in fleet.destinations
+            ],
+            dtype=np.intp,
+        )[fleet.destination[rows]]
+
+    @timed("routing.route_fleet")
+    def route_fleet(self, fleet, rows=None):
+        """
+        Route many fleet vehicles at once: vehicles bound for the same
+        destination share one shortest-path tree and are answered with a
+        single gather.
+
+        Returns (next_hops, travel_times) aligned with `rows` (default: the
+        whole fleet): graph rows (NO_NODE at the destination or when there
+        is no route) and seconds (inf when there is no route).
+        """
+        if rows is None:
+            rows = np.arange(len(fleet))
+        next_hops = np.full(len(rows), NO_NODE, dtype=np.intp)
+        travel_times = np.full(len(rows), np.inf)
+        graph = self.road_graph
+        if graph is None or not len(rows):
+            return next_hops, travel_times
+        # Fleet intersection / destination codes -> graph rows.
+        sources = np.array(
+            [graph.index.get(name, NO_NODE) for name in fleet.intersections]
+            + [NO_NODE],
+            dtype=np.intp,
+        )[fleet.intersection[rows]]
+        targets = self.fleet_destinations(fleet, rows)
+        routable = np.flatnonzero((sources != NO_NODE) & (targets != NO_NODE))
+        if len(routable):
+            next_hops[routable], travel_times[routable] = graph.route_groups(
+                sources[routable], targets[routable]
+            )
+        return next_hops, travel_times
@@ -0,0 +1,357 @@
+# agents/signal_timing.py
+
+import json
+from collections.abc import Mapping
+from datetime import datetime, timezone
+
+import numpy as np
+
+GREEN, YELLOW, RED = 0, 1, 2
+COLOR_NAMES = ("GREEN", "YELLOW", "RED")
+YELLOW_DURATION = 5
+DIRECTIONS = ("N", "S", "E", "W")
+
+
+def compute_congestion_batch(current_speeds, free_flow_speeds):
+    """
+    Vectorized TrafficSignalAgent.compute_congestion: (free - current) / free
+    clipped to [0, 1], and 1.0 wherever the free-flow speed is not positive.
+    """
+    current_speeds = np.asarray(current_speeds, dtype=float)
+    free_flow_speeds = np.asarray(free_flow_speeds, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        congestion = (free_flow_speeds - current_speeds) / free_flow_speeds
+    return np.where(free_flow_speeds > 0, np.clip(congestion, 0, 1), 1.0)
+
+
+def green_splits(weighted_congestion):
+    """
+    N_S and E_W green durations (whole seconds) for each weighted congestion.
+    """
+    weighted_congestion = np.asarray(weighted_congestion, dtype=float)
+    ns_green = (30 + 30 * weighted_congestion).astype(np.int64)
+    ew_green = (30 + 30 * (1 - weighted_congestion)).astype(np.int64)
+    return ns_green, ew_green
+
+
+def signal_phases(ns_green, ew_green, current_time=0):
+    """
+    Evaluate the two-phase cycle for every intersection at `current_time`.
+
+    Returns (ns_color, ns_time_remaining, ns_next_color, ew_color,
+    ew_time_remaining, ew_next_color); colours are GREEN/YELLOW/RED codes.
+    """
+    ns_phase_duration = ns_green + YELLOW_DURATION
+    ew_end = ns_phase_duration + ew_green
+    total_cycle = ew_end + YELLOW_DURATION
+    t = np.mod(current_time, total_cycle)
+
+    ns_conditions = [t < ns_green, t < ns_phase_duration]
+    ns_color = np.select(ns_conditions, [GREEN, YELLOW], RED)
+    ns_time_remaining = np.select(
+        ns_conditions, [ns_green - t, ns_phase_duration - t], total_cycle - t
+    )
+    ns_next_color = np.select(ns_conditions, [YELLOW, RED], GREEN)
+
+    ew_conditions = [t < ns_phase_duration, t < ew_end]
+    ew_color = np.select(ew_conditions, [RED, GREEN], YELLOW)
+    ew_time_remaining = np.select(
+        ew_conditions, [ns_phase_duration - t, ew_end - t], total_cycle - t
+    )
+    ew_next_color = np.select(ew_conditions, [GREEN, YELLOW], RED)
+
+    return (
+        ns_color,
+        ns_time_remaining,
+        ns_next_color,
+        ew_color,
+        ew_time_remaining,
+        ew_next_color,
+    )
+
+
+def green_windows(ns_green, ew_green, start, end):
+    """
+    Green time each approach gets during [start, end) under the same cycle
+    as signal_phases, for every intersection.
+
+    Returns (ns_seconds, ew_seconds, ns_delay, ew_delay): seconds of green
+    within the window, and seconds from `start` until the approach is next
+    green (0 when it is green at `start`).
+    """
+    ns_green = np.asarray(ns_green, dtype=float)
+    ew_green = np.asarray(ew_green, dtype=float)
+    ew_start = ns_green + YELLOW_DURATION
+    total_cycle = ew_start + ew_green + YELLOW_DURATION
+
+    def green_until(offset, length, t):
+        # Green seconds in [0, t) of a window repeating every cycle.
+        return (t // total_cycle) * length + np.clip(
+            np.mod(t, total_cycle) - offset, 0, length
+        )
+
+    def delay(offset, length):
+        t = np.mod(start, total_cycle)
+        green = (t >= offset) & (t < offset + length)
+        return np.where(green, 0.0, np.mod(offset - t, total_cycle))
+
+    return (
+        green_until(0, ns_green, end) - green_until(0, ns_green, start),
+        green_until(ew_start, ew_green, end) - green_until(ew_start, ew_green, start),
+        delay(0, ns_green),
+        delay(ew_start, ew_green),
+    )
+
+
+def phase_at(ns_green, ew_green, current_time=0):
+    """
+    Scalar form of signal_phases for a single intersection.
+    """
+    ns_phase_duration = ns_green + YELLOW_DURATION
+    ew_end = ns_phase_duration + ew_green
+    total_cycle = ew_end + YELLOW_DURATION
+    t = current_time % total_cycle
+    if t < ns_green:
+        ns = (GREEN, ns_green - t, YELLOW)
+        ew = (RED, ns_phase_duration - t, GREEN)
+    elif t < ns_phase_duration:
+        ns = (YELLOW, ns_phase_duration - t, RED)
+        ew = (RED, ns_phase_duration - t, GREEN)
+    elif t < ew_end:
+        ns = (RED, total_cycle - t, GREEN)
+        ew = (GREEN, ew_end - t, YELLOW)
+    else:
+        ns = (RED, total_cycle - t, GREEN)
+        ew = (YELLOW, total_cycle - t, RED)
+    return ns + ew
+
+
+def _approach_state(color, time_remaining, next_color):
+    color = COLOR_NAMES[color]
+    return {
+        "current_color": color,
+        "time_remaining": time_remaining,
+        "next_color": COLOR_NAMES[next_color],
+        "movements": {"left": color, "straight": color, "right": color},
+    }
+
+
+class SignalPlan:
+    """
+    In-memory two-phase signal plan. The JSON plan document is only
+    rendered when to_json() is called.
+    """
+
+    __slots__ = (
+        "intersection_id",
+        "ns_green",
+        "ew_green",
+        "congestion_estimates",
+        "agent_confidence",
+        "fairness_score",
+        "created_at",
+        "_json",
+    )
+
+    recommendation_source = "AI_AGENT_1"
+
+    def __init__(
+        self,
+        intersection_id,
+        ns_green,
+        ew_green,
+        congestion_estimates,
+        agent_confidence=0.9,
+        fairness_score=1.0,
+        created_at=None,
+    ):
+        self.intersection_id = intersection_id
+        self.ns_green = ns_green
+        self.ew_green = ew_green
+        self.congestion_estimates = congestion_estimates
+        self.agent_confidence = agent_confidence
+        self.fairness_score = fairness_score
+        self.created_at = (
+            created_at
+            if created_at is not None
+            else datetime.now(timezone.utc).timestamp()
+        )
+        self._json = None
+
+    def phase_plan(self):
+        phase_plan = []
+        for phase_id, green_duration in (
+            ("N_S_GREEN", self.ns_green),
+            ("E_W_GREEN", self.ew_green),
+        ):
+            phase_plan.append(
+                {
+                    "phase_id": phase_id,
+                    "green_duration": green_duration,
+                    "yellow_duration": YELLOW_DURATION,
+                    "red_duration": max(90 - green_duration, 10),
+                    "priority": (
+                        1
+                        if self.congestion_estimates.get(phase_id.split("_")[0], 0)
+                        > 0.7
+                        else 2
+                    ),
+                }
+            )
+        return phase_plan
+
+    def to_dict(self):
+        timestamp = datetime.fromtimestamp(self.created_at, timezone.utc)
+        return {
+            "intersection_id": self.intersection_id,
+            "timestamp": timestamp.replace(tzinfo=None).isoformat() + "Z",
+            "recommendation_source": self.recommendation_source,
+            "phase_plan": self.phase_plan(),
+            "congestion_estimates": self.congestion_estimates,
+            "fairness_score": self.fairness_score,
+            "agent_confidence": self.agent_confidence,
+        }
+
+    def to_json(self):
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), indent=2)
+        return self._json
+
+
+class SignalState(Mapping):
+    """
+    Current colour, time remaining and next colour for the N_S and E_W
+    approaches. Reads like the {direction: {...}} dict produced by
+    build_signal_states; each direction's dict is built on access.
+    """
+
+    __slots__ = (
+        "ns_color",
+        "ns_time_remaining",
+        "ns_next_color",
+        "ew_color",
+        "ew_time_remaining",
+        "ew_next_color",
+    )
+
+    def __init__(
+        self,
+        ns_color,
+        ns_time_remaining,
+        ns_next_color,
+        ew_color,
+        ew_time_remaining,
+        ew_next_color,
+    ):
+        self.ns_color = ns_color
+        self.ns_time_remaining = ns_time_remaining
+        self.ns_next_color = ns_next_color
+        self.ew_color = ew_color
+        self.ew_time_remaining = ew_time_remaining
+        self.ew_next_color = ew_next_color
+
+    def __getitem__(self, direction):
+        if direction == "N" or direction == "S":
+            return _approach_state(
+                self.ns_color, self.ns_time_remaining, self.ns_next_color
+            )
+        if direction == "E" or direction == "W":
+            return _approach_state(
+                self.ew_color, self.ew_time_remaining, self.ew_next_color
+            )
+        raise KeyError(direction)
+
+    def __iter__(self):
+        return iter(DIRECTIONS)
+
+    def __len__(self):
+        return len(DIRECTIONS)
+
+    def color(self, direction):
+        """
+        Colour code (GREEN/YELLOW/RED) for a direction without building a dict.
+        """
+        if direction == "N" or direction == "S":
+            return self.ns_color
+        if direction == "E" or direction == "W":
+            return self.ew_color
+        raise KeyError(direction)
+
+    def to_dict(self):
+        return {direction: self[direction] for direction in DIRECTIONS}
+
+    def __repr__(self):
+        return f"SignalState({self.to_dict()!r})"
+
+
+class SignalBatch:
+    """
+    Signal decisions for N intersections held as parallel arrays.
+    Per-intersection dicts are only built by state() / to_dicts().
+    """
+
+    __slots__ = (
+        "intersection_ids",
+        "current_congestion",
+        "predicted_congestion",
+        "weighted_congestion",
+        "ns_green",
+        "ew_green",
+        "ns_color",
+        "ns_time_remaining",
+        "ns_next_color",
+        "ew_color",
+        "ew_time_remaining",
+        "ew_next_color",
+    )
+
+    def __init__(
+        self,
+        current_congestion,
+        predicted_congestion,
+        weighted_congestion,
+        ns_green,
+        ew_green,
+        current_time=0,
+        intersection_ids=None,
+    ):
+        self.intersection_ids = intersection_ids
+        self.current_congestion = current_congestion
+        self.predicted_congestion = predicted_congestion
+        self.weighted_congestion = weighted_congestion
+        self.ns_green = ns_green
+        self.ew_green = ew_green
+        (
+            self.ns_color,
+            self.ns_time_remaining,
+            self.ns_next_color,
+            self.ew_color,
+            self.ew_time_remaining,
+            self.ew_next_color,
+        ) = signal_phases(ns_green, ew_green, current_time)
+
+    def __len__(self):
+        return len(self.ns_green)
+
+    def state(self, i):
+        """
+        SignalState for intersection i.
+        """
+        return SignalState(
+            int(self.ns_color[i]),
+            self.ns_time_remaining[i].item(),
+            int(self.ns_next_color[i]),
+            int(self.ew_color[i]),
+            self.ew_time_remaining[i].item(),
+            int(self.ew_next_color[i]),
+        )
+
+    def to_dicts(self):
+        """
+        SignalStates for all intersections, keyed by intersection id when
+        ids were given and by position otherwise.
+        """
+        ids = self.intersection_ids
+        if ids is None:
+            ids = range(len(self))
+        return {key: self.state(i) for i, key in enumerate(ids)}
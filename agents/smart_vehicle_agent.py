@@ -1,19 +1,26 @@
 # agents/smart_vehicle_agent.py
 
+from agents.event_sink import VehicleUpdate, get_default_sink
+
 
 class SmartVehicleAgent:
-    def __init__(self):
-        pass
+    def __init__(self, sink=None):
+        """
+        sink: EventSink that receives vehicle updates (default: the
+        process-wide event sink).
+        """
+        self.sink = sink
 
     def communicate(self, vehicle):
         """
         Simulate smart vehicle communication based on its mode.
         """
-        if vehicle.mode.lower() == "emergency":
+        mode = vehicle.mode.lower()
+        if mode == "emergency":
             return f"{vehicle.id} is an EMERGENCY vehicle. Requesting immediate green light!"
-        elif vehicle.mode.lower() == "autonomous":
+        elif mode == "autonomous":
             return f"{vehicle.id} (autonomous) reporting: All systems normal and environment monitored."
-        elif vehicle.mode.lower() == "eco":
+        elif mode == "eco":
             return f"{vehicle.id} is in eco-mode. Optimizing fuel efficiency and reducing emissions."
         else:
             return f"{vehicle.id} reports normal status."
@@ -22,4 +29,6 @@ class SmartVehicleAgent:
         """
         Simulate sending an update message to the vehicle.
         """
-        print(f"[SmartVehicleAgent] Sending update to {vehicle.id}: {update_message}")
+        sink = self.sink if self.sink is not None else get_default_sink()
+        if sink.enabled:
+            sink.emit(VehicleUpdate(vehicle.id, update_message))
@@ -0,0 +1,225 @@
+# agents/spatial_index.py
+
+import math
+
+import numpy as np
+
+from config import SPATIAL_CELL_METERS, SPATIAL_SNAP_METERS
+
+# Metres per degree of latitude and of longitude at the equator.
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LON = 111320.0
+NO_MATCH = -1
+CELL_KEY_OFFSET = 1 << 30  # keeps (cx, cy) non-negative when packed into one int64
+MAX_SEARCH_RING = 16  # cells; nearest queries beyond this fall back to brute force
+
+
+class SpatialIndex:
+    def __init__(self, names, coords, cell_meters=SPATIAL_CELL_METERS):
+        """
+        Uniform-grid index over named (lat, lon) points, e.g. intersections
+        and flow segment points.
+
+        Points are projected to metres around their mean latitude and
+        bucketed into square cells; a query only looks at the cells around
+        it, and bulk queries are grouped by cell so each group is one
+        vectorized distance computation.
+
+        Parameters:
+            names (list): Name of each point (e.g. intersection name).
+            coords (array-like): (n, 2) array of (lat, lon).
+            cell_meters (float): Grid cell size; about the typical query
+                radius works best.
+        """
+        self.names = list(names)
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.lats = coords[:, 0]
+        self.lons = coords[:, 1]
+        self.cell = float(cell_meters)
+        self.ref_lat = float(self.lats.mean()) if len(coords) else 0.0
+        self._lon_scale = METERS_PER_DEGREE_LON * math.cos(math.radians(self.ref_lat))
+        self.x, self.y = self._project(self.lats, self.lons)
+
+        # Points sorted by cell key; each occupied cell is a contiguous run.
+        keys = self._keys(*self._cells(self.x, self.y))
+        self._order = np.argsort(keys, kind="stable")
+        self._cell_keys, self._cell_starts, self._cell_counts = np.unique(
+            keys[self._order], return_index=True, return_counts=True
+        )
+
+    @classmethod
+    def from_points(cls, intersections, segments=(), cell_meters=SPATIAL_CELL_METERS):
+        """
+        Index a {name: (lat, lon)} mapping plus extra (lat, lon) segment
+        points, which are named by their own coordinates.
+        """
+        segments = list(segments)
+        names = list(intersections) + segments
+        coords = list(intersections.values()) + segments
+        return cls(names, coords, cell_meters)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _project(self, lats, lons):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        return lons * self._lon_scale, lats * METERS_PER_DEGREE_LAT
+
+    def _unproject(self, x, y):
+        return y / METERS_PER_DEGREE_LAT, x / self._lon_scale
+
+    def _cells(self, x, y):
+        return (
+            np.floor(x / self.cell).astype(np.int64),
+            np.floor(y / self.cell).astype(np.int64),
+        )
+
+    @staticmethod
+    def _keys(cx, cy):
+        return ((cx + CELL_KEY_OFFSET) << 32) | (cy + CELL_KEY_OFFSET)
+
+    def _pairs(self, x, y, ring):
+        """
+        Every (query, point row, squared distance) pair between the query points and
+        the indexed points in the (2 * ring + 1)^2 cells around each query,
+        gathered without a Python loop over queries or cells.
+        """
+        cx, cy = self._cells(x, y)
+        offsets = np.arange(-ring, ring + 1)
+        dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+        keys = self._keys(cx[:, None] + dx.ravel(), cy[:, None] + dy.ravel()).ravel()
+        pos = np.minimum(
+            np.searchsorted(self._cell_keys, keys), len(self._cell_keys) - 1
+        )
+        hit = self._cell_keys[pos] == keys
+        counts = np.where(hit, self._cell_counts[pos], 0)
+        starts = self._cell_starts[pos]
+        total = int(counts.sum())
+        queries = np.repeat(np.arange(len(x)), counts.reshape(len(x), -1).sum(axis=1))
+        within_cell = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = self._order[np.repeat(starts, counts) + within_cell]
+        ddx = self.x[rows] - x[queries]
+        ddy = self.y[rows] - y[queries]
+        return queries, rows, ddx * ddx + ddy * ddy
+
+    def _brute_force(self, x, y, chunk=1024):
+        rows = np.empty(len(x), dtype=np.intp)
+        distances = np.empty(len(x))
+        for start in range(0, len(x), chunk):
+            qx = x[start : start + chunk, None]
+            qy = y[start : start + chunk, None]
+            d = np.hypot(self.x - qx, self.y - qy)
+            nearest = d.argmin(axis=1)
+            rows[start : start + chunk] = nearest
+            distances[start : start + chunk] = d[np.arange(len(nearest)), nearest]
+        return rows, distances
+
+    def nearest_many(self, lats, lons, max_distance=None):
+        """
+        Nearest indexed point for every query point.
+
+        Returns (rows, distances): rows are indices into names (NO_MATCH
+        when nothing lies within `max_distance` metres) and distances are
+        in metres (inf for NO_MATCH).
+
+        Queries search the cells around them, doubling the search ring for
+        those whose nearest point may lie further out; the few left after
+        that are answered by brute force.
+        """
+        x, y = self._project(lats, lons)
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        rows = np.full(len(x), NO_MATCH, dtype=np.intp)
+        distances = np.full(len(x), np.inf)
+        if not len(self.names) or not len(x):
+            return rows, distances
+        limit = np.inf if max_distance is None else float(max_distance)
+        pending = np.arange(len(x))
+        ring = 1
+        # Past the point where a ring spans more cells than are occupied,
+        # scanning every point is cheaper.
+        max_ring = min(MAX_SEARCH_RING, int(math.sqrt(len(self._cell_keys))) // 2 + 1)
+        while len(pending) and ring <= max_ring:
+            queries, candidates, d2 = self._pairs(x[pending], y[pending], ring)
+            # Pairs come grouped by query, so each query's minimum is a segment
+            # reduction.
+            best = np.full(len(pending), np.inf)
+            best_rows = np.full(len(pending), NO_MATCH, dtype=np.intp)
+            if len(d2):
+                starts = np.flatnonzero(np.diff(queries, prepend=-1))
+                best[queries[starts]] = np.minimum.reduceat(d2, starts)
+                closest = np.flatnonzero(d2 == best[queries])
+                first = np.flatnonzero(np.diff(queries[closest], prepend=-1))
+                best_rows[queries[closest[first]]] = candidates[closest[first]]
+                best = np.sqrt(best)
+            # Every point within `ring` cells of the query has been seen.
+            covered = ring * self.cell
+            done = (best <= covered) | (covered >= limit)
+            found = done & (best <= limit)
+            rows[pending[found]] = best_rows[found]
+            distances[pending[found]] = best[found]
+            pending = pending[~done]
+            ring *= 2
+        if len(pending):
+            nearest, d = self._brute_force(x[pending], y[pending])
+            found = d <= limit
+            rows[pending[found]] = nearest[found]
+            distances[pending[found]] = d[found]
+        return rows, distances
+
+    def nearest(self, lat, lon, max_distance=None):
+        """
+        (name, distance in metres) of the nearest point, or (None, inf).
+        """
+        rows, distances = self.nearest_many([lat], [lon], max_distance)
+        if rows[0] == NO_MATCH:
+            return None, math.inf
+        return self.names[rows[0]], float(distances[0])
+
+    def within_many(self, lats, lons, radius):
+        """
+        For every query point, the rows of all indexed points within
+        `radius` metres, nearest first.
+        """
+        x, y = self._project(lats, lons)
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        ring = max(int(math.ceil(radius / self.cell)), 1)
+        queries, rows, d = self._pairs(x, y, ring)
+        keep = d <= radius * radius
+        queries, rows, d = queries[keep], rows[keep], d[keep]
+        order = np.lexsort((d, queries))
+        bounds = np.searchsorted(queries[order], np.arange(len(x) + 1))
+        return np.split(rows[order], bounds[1:-1])
+
+    def within(self, lat, lon, radius):
+        """
+        Names of the points within `radius` metres, nearest first.
+        """
+        return [self.names[row] for row in self.within_many([lat], [lon], radius)[0]]
+
+    def segment_keys(self, lats, lons, snap_distance=SPATIAL_SNAP_METERS):
+        """
+        Canonical (lat, lon) flow-lookup key for every query point: the
+        nearest indexed point within `snap_distance` metres, otherwise the
+        centre of the query's `snap_distance`-sized quantization cell.
+        Nearby points share a key, so they share one flow lookup.
+        """
+        rows, _ = self.nearest_many(lats, lons, snap_distance)
+        x, y = self._project(lats, lons)
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        key_lats, key_lons = self._unproject(
+            (np.floor(x / snap_distance) + 0.5) * snap_distance,
+            (np.floor(y / snap_distance) + 0.5) * snap_distance,
+        )
+        matched = rows != NO_MATCH
+        key_lats = np.round(key_lats, 6)
+        key_lons = np.round(key_lons, 6)
+        key_lats[matched] = self.lats[rows[matched]]
+        key_lons[matched] = self.lons[rows[matched]]
+        return list(zip(key_lats.tolist(), key_lons.tolist()))
+
+    def segment_key(self, lat, lon, snap_distance=SPATIAL_SNAP_METERS):
+        return self.segment_keys([lat], [lon], snap_distance)[0]
@@ -1,42 +1,104 @@
 # agents/traffic_signal_agent.py
 
-import requests
-import json
-import os
-import csv
-import pandas as pd
+import sys
+import time
 import numpy as np
 from datetime import datetime
-import random
-from sklearn.linear_model import SGDRegressor
 
-from config import API_KEY, DATA_FILE, LAST_RETRAIN_FILE, RETRAIN_INTERVAL_SECONDS
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from agents.flow_provider import get_default_provider
+from agents.history_writer import HistoryWriter, iter_history_chunks, read_history
+from agents.metrics import get_metrics, timed
+from agents.model_registry import IntersectionModelRegistry
+from agents.predictor import load_predictor, make_predictor, save_predictor
+from agents.retrain_scheduler import RetrainScheduler
+from agents.signal_timing import (
+    SignalBatch,
+    SignalPlan,
+    SignalState,
+    compute_congestion_batch,
+    green_splits,
+    phase_at,
+)
+from config import (
+    DATA_FILE,
+    MODEL_CHECKPOINT_FILE,
+    MODEL_CHECKPOINT_INTERVAL_SECONDS,
+    PER_INTERSECTION_MODELS,
+    RETRAIN_CHUNK_ROWS,
+    RETRAIN_EPOCHS,
+    RETRAIN_HOLDOUT_FRACTION,
+    RETRAIN_SHUFFLE_WINDOW,
+)
+
+
+def intersection_key(lat, lon):
+    """
+    Per-intersection model and signal plan key of a location.
+    """
+    return f"intersection_{lat}_{lon}"
 
 
 class TrafficSignalAgent:
-    def __init__(self):
-        self.online_model = SGDRegressor(max_iter=1000, tol=1e-3)
-        self.online_model.partial_fit(np.array([[0.0, 1.0]]), np.array([0.0]))
+    def __init__(
+        self,
+        flow_provider=None,
+        history_writer=None,
+        predictor=None,
+        model_registry=None,
+        checkpoint_path=MODEL_CHECKPOINT_FILE,
+        checkpoint_interval=MODEL_CHECKPOINT_INTERVAL_SECONDS,
+        warm_start=True,
+    ):
+        """
+        Parameters:
+            flow_provider: Flow-data source (default: the shared provider).
+            history_writer (HistoryWriter): Receives every observed sample.
+            predictor (CongestionPredictor): Online model; by default it is
+                warm-started from `checkpoint_path` when that exists.
+            model_registry (IntersectionModelRegistry): Per-intersection
+                models. By default they are resumed from MODEL_REGISTRY_FILE
+                only together with a warm-started online model, and are
+                restarted from the online model whenever the retrain
+                scheduler installs or rolls back a version.
+            checkpoint_path (str): Online model checkpoint, rewritten every
+                `checkpoint_interval` seconds and on close(); None disables it.
+            warm_start (bool): Restore the default online model from
+                `checkpoint_path`. Seeded runs pass False, together with no
+                checkpoint_path and an in-memory registry, so their results
+                neither depend on nor overwrite an earlier run's models.
+        """
+        self.flow_provider = flow_provider or get_default_provider()
+        self.history_writer = history_writer or HistoryWriter(DATA_FILE)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.next_checkpoint = time.monotonic() + checkpoint_interval
+        warm = None
+        if predictor is None and warm_start:
+            warm = load_predictor(checkpoint_path)
+            if warm is not None:
+                print(f"Warm-started the online model from {checkpoint_path}.")
+        self.online_model = warm or predictor or make_predictor()
+        if warm is None:
+            # Cold start: one dummy sample so the model can predict.
+            self.online_model.partial_fit(np.array([[0.0, 1.0]]), np.array([0.0]))
+        # Per-intersection models; new intersections start from online_model.
+        if model_registry is None and PER_INTERSECTION_MODELS:
+            model_registry = IntersectionModelRegistry(load=warm is not None)
+        self.model_registry = model_registry
+        self.signal_plans = {}  # intersection_id -> latest SignalPlan
+        self.prediction_errors = {}  # (lat, lon) -> |predicted - current| congestion
+        self.last_retrain_report = None
+        self.last_holdout = None
+        self.retrain_scheduler = RetrainScheduler(self)
 
+    @timed("traffic_signal.fetch_traffic_data")
     def fetch_traffic_data(self, lat, lon):
-        url = "https://api.tomtom.com/traffic/services/4/flowSegmentData/relative0/10/json"
-        params = {"point": f"{lat},{lon}", "unit": "KMPH", "key": API_KEY}
-        try:
-            response = requests.get(url, params=params)
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(
-                    "Error fetching traffic data:", response.status_code, response.text
-                )
-        except Exception as e:
-            print("Exception during API call:", e)
-        return {
-            "flowSegmentData": {
-                "currentSpeed": random.randint(10, 60),
-                "freeFlowSpeed": 60,
-            }
-        }
+        return {"flowSegmentData": self.flow_provider.get_flow_data(lat, lon)}
 
     def compute_congestion(self, current_speed, free_flow_speed):
         if free_flow_speed > 0:
@@ -45,14 +107,28 @@ class TrafficSignalAgent:
         else:
             return 1.0
 
-    def predict_future_congestion(self, features, actual_congestion):
-        feature_vector = np.array(
-            [features["current_speed"], features["free_flow_speed"]]
-        )
-        predicted = self.online_model.predict(feature_vector.reshape(1, -1))[0]
-        self.online_model.partial_fit(
-            feature_vector.reshape(1, -1), np.array([actual_congestion])
-        )
+    def predict_future_congestion(
+        self, features, actual_congestion, intersection_id=None
+    ):
+        # Read the model once; the retrain scheduler may swap it at any time.
+        model = self.online_model
+        if intersection_id is not None and self.model_registry is not None:
+            registry = self.model_registry
+            row = registry.index.get(intersection_id)
+            if row is None:
+                row = registry.row(intersection_id, init=model.get_weights())
+            predicted = registry.predict_update_one(
+                row,
+                features["current_speed"],
+                features["free_flow_speed"],
+                actual_congestion,
+            )
+        else:
+            predicted = model.predict_update_one(
+                features["current_speed"],
+                features["free_flow_speed"],
+                actual_congestion,
+            )
         return min(1, max(0, predicted))
 
     def generate_signal_plan_output(
@@ -63,182 +139,299 @@ class TrafficSignalAgent:
         agent_confidence=0.9,
         fairness_score=1.0,
     ):
-        phase_plan = []
-        for phase_id, green_duration in signal_timings.items():
-            phase = {
-                "phase_id": phase_id,
-                "green_duration": green_duration,
-                "yellow_duration": 5,
-                "red_duration": max(90 - green_duration, 10),
-                "priority": (
-                    1
-                    if congestion_estimates.get(phase_id.split("_")[0], 0) > 0.7
-                    else 2
-                ),
-            }
-            phase_plan.append(phase)
-
-        signal_output = {
-            "intersection_id": intersection_id,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "recommendation_source": "AI_AGENT_1",
-            "phase_plan": phase_plan,
-            "congestion_estimates": congestion_estimates,
-            "fairness_score": fairness_score,
-            "agent_confidence": agent_confidence,
-        }
-        return json.dumps(signal_output, indent=2)
-
-    def build_signal_states(self, signal_plan_json, current_time=0):
         ns_green = None
         ew_green = None
-        for phase in signal_plan_json["phase_plan"]:
-            if "N_S" in phase["phase_id"]:
-                ns_green = phase["green_duration"]
-            elif "E_W" in phase["phase_id"]:
-                ew_green = phase["green_duration"]
+        for phase_id, green_duration in signal_timings.items():
+            if "N_S" in phase_id:
+                ns_green = green_duration
+            elif "E_W" in phase_id:
+                ew_green = green_duration
         if ns_green is None or ew_green is None:
             raise ValueError("Signal plan must contain both N_S and E_W phases.")
+        return SignalPlan(
+            intersection_id,
+            ns_green,
+            ew_green,
+            congestion_estimates,
+            agent_confidence=agent_confidence,
+            fairness_score=fairness_score,
+        )
 
-        ns_phase_duration = ns_green + 5
-        ew_phase_duration = ew_green + 5
-        total_cycle = ns_phase_duration + ew_phase_duration
-        t = current_time % total_cycle
-
-        def get_ns_state(t):
-            if t < ns_green:
-                return "GREEN", ns_green - t, "YELLOW"
-            elif t < ns_phase_duration:
-                return "YELLOW", ns_phase_duration - t, "RED"
-            else:
-                return "RED", total_cycle - t, "GREEN"
-
-        def get_ew_state(t):
-            if t < ns_phase_duration:
-                return "RED", ns_phase_duration - t, "GREEN"
-            elif t < ns_phase_duration + ew_green:
-                return "GREEN", (ns_phase_duration + ew_green) - t, "YELLOW"
-            else:
-                return "YELLOW", total_cycle - t, "RED"
-
-        ns_color, ns_time_remaining, ns_next_color = get_ns_state(t)
-        ew_color, ew_time_remaining, ew_next_color = get_ew_state(t)
-
-        signal_state = {
-            "N": {
-                "current_color": ns_color,
-                "time_remaining": ns_time_remaining,
-                "next_color": ns_next_color,
-                "movements": {
-                    "left": ns_color,
-                    "straight": ns_color,
-                    "right": ns_color,
-                },
-            },
-            "S": {
-                "current_color": ns_color,
-                "time_remaining": ns_time_remaining,
-                "next_color": ns_next_color,
-                "movements": {
-                    "left": ns_color,
-                    "straight": ns_color,
-                    "right": ns_color,
-                },
-            },
-            "E": {
-                "current_color": ew_color,
-                "time_remaining": ew_time_remaining,
-                "next_color": ew_next_color,
-                "movements": {
-                    "left": ew_color,
-                    "straight": ew_color,
-                    "right": ew_color,
-                },
-            },
-            "W": {
-                "current_color": ew_color,
-                "time_remaining": ew_time_remaining,
-                "next_color": ew_next_color,
-                "movements": {
-                    "left": ew_color,
-                    "straight": ew_color,
-                    "right": ew_color,
-                },
-            },
-        }
-        return signal_state
+    def build_signal_states(self, signal_plan, current_time=0):
+        """
+        Evaluate a SignalPlan (or a parsed plan document with a "phase_plan"
+        list) at `current_time` and return its SignalState.
+        """
+        if isinstance(signal_plan, SignalPlan):
+            ns_green = signal_plan.ns_green
+            ew_green = signal_plan.ew_green
+        else:
+            ns_green = None
+            ew_green = None
+            for phase in signal_plan["phase_plan"]:
+                if "N_S" in phase["phase_id"]:
+                    ns_green = phase["green_duration"]
+                elif "E_W" in phase["phase_id"]:
+                    ew_green = phase["green_duration"]
+            if ns_green is None or ew_green is None:
+                raise ValueError("Signal plan must contain both N_S and E_W phases.")
+        return SignalState(*phase_at(ns_green, ew_green, current_time))
+
+    def adjust_signals_batch(
+        self,
+        current_speeds,
+        free_flow_speeds,
+        current_time=0,
+        intersection_ids=None,
+        points=None,
+    ):
+        """
+        Batch form of adjust_signals for N intersections.
+
+        Takes arrays of current and free-flow speeds and computes congestion,
+        predictions, green splits and the current phase for all of them in a
+        few NumPy passes. The online model is updated with the whole batch at
+        once. Returns a SignalBatch; per-intersection dicts are only built
+        when asked for via SignalBatch.state() / to_dicts(). When `points`
+        (an N x 2 array of lat/lon) is given, the samples are also recorded
+        in the traffic history.
+        """
+        current_speeds = np.asarray(current_speeds, dtype=float)
+        free_flow_speeds = np.asarray(free_flow_speeds, dtype=float)
+        current_congestion = compute_congestion_batch(current_speeds, free_flow_speeds)
+
+        features = np.column_stack((current_speeds, free_flow_speeds))
+        model = self.online_model
+        if intersection_ids is not None and self.model_registry is not None:
+            rows = self.model_registry.rows(intersection_ids, init=model.get_weights())
+            predicted_congestion = self.model_registry.predict_update(
+                rows, features, current_congestion
+            )
+        else:
+            predicted_congestion = model.predict(features)
+            model.partial_fit(features, current_congestion)
+        predicted_congestion = np.clip(predicted_congestion, 0, 1)
+
+        if points is not None:
+            points = np.asarray(points, dtype=float)
+            self.history_writer.append_many(
+                points[:, 0],
+                points[:, 1],
+                current_speeds,
+                free_flow_speeds,
+                current_congestion,
+            )
+
+        weighted_congestion = (current_congestion + predicted_congestion) / 2
+        ns_green, ew_green = green_splits(weighted_congestion)
+        self.retrain_scheduler.maybe_retrain()
+        self.maybe_checkpoint()
+        return SignalBatch(
+            current_congestion,
+            predicted_congestion,
+            weighted_congestion,
+            ns_green,
+            ew_green,
+            current_time=current_time,
+            intersection_ids=intersection_ids,
+        )
 
     def store_api_data(self, lat, lon, current_speed, free_flow_speed, congestion):
-        file_exists = os.path.isfile(DATA_FILE)
-        with open(DATA_FILE, mode="a", newline="") as csvfile:
-            fieldnames = [
-                "timestamp",
-                "lat",
-                "lon",
-                "current_speed",
-                "free_flow_speed",
-                "congestion",
-            ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(
-                {
-                    "timestamp": datetime.utcnow().isoformat() + "Z",
-                    "lat": lat,
-                    "lon": lon,
-                    "current_speed": current_speed,
-                    "free_flow_speed": free_flow_speed,
-                    "congestion": congestion,
-                }
+        self.history_writer.append(lat, lon, current_speed, free_flow_speed, congestion)
+
+    def reseed_intersection_models(self, model):
+        """
+        Restart every per-intersection model from `model`, so a newly
+        installed or restored global model serves every intersection.
+        """
+        if self.model_registry is not None:
+            self.model_registry.reseed(model.get_weights())
+
+    def serving_predictions(self, X, points=None):
+        """
+        Congestion the live models predict for features `X` observed at
+        `points` ((lat, lon) rows): the intersection's own model where one is
+        registered, the online model otherwise.
+        """
+        X = np.asarray(X, dtype=float)
+        predicted = np.array(self.online_model.predict(X), dtype=float)
+        registry = self.model_registry
+        if registry is not None and points is not None and len(registry):
+            rows = np.array(
+                [
+                    registry.index.get(intersection_key(lat, lon), -1)
+                    for lat, lon in np.asarray(points).tolist()
+                ],
+                dtype=np.intp,
             )
+            known = rows >= 0
+            predicted[known] = registry.predict(rows[known], X[known])
+        return predicted
 
     def retrain_model_from_data(self, csv_file=DATA_FILE):
-        if not os.path.exists(csv_file):
+        self.history_writer.flush()
+        data = read_history(csv_file, self.history_writer.fmt)
+        if data is None or data.empty:
             print("No historical data available for retraining.")
             return None
-        data = pd.read_csv(csv_file)
         X = data[["current_speed", "free_flow_speed"]].values
         y = data["congestion"].values
+        from sklearn.linear_model import SGDRegressor  # deferred: retraining only
+
         new_model = SGDRegressor(max_iter=1000, tol=1e-3)
         new_model.fit(X, y)
         print("Retrained model on historical data.")
         return new_model
 
+    def retrain_model_streaming(
+        self,
+        csv_file=DATA_FILE,
+        chunk_rows=RETRAIN_CHUNK_ROWS,
+        epochs=RETRAIN_EPOCHS,
+        shuffle_window=RETRAIN_SHUFFLE_WINDOW,
+        seed=None,
+        holdout_rows=0,
+        holdout_fraction=RETRAIN_HOLDOUT_FRACTION,
+    ):
+        """
+        Out-of-core retrain: stream the history in chunks of `chunk_rows`,
+        shuffle within windows of up to `shuffle_window` rows and call
+        partial_fit once per window, for `epochs` passes. Memory is bounded
+        by the window size rather than the history size.
+
+        With `holdout_rows` > 0, about `holdout_fraction` of the rows (up to
+        `holdout_rows`) are kept out of training in every epoch and left in
+        self.last_holdout as (X, y, points) for validation; points (the
+        rows' locations) is None without per-intersection models.
+
+        Rows per second and peak memory are printed and kept in
+        self.last_retrain_report.
+        """
+        from sklearn.linear_model import SGDRegressor  # deferred: retraining only
+
+        self.history_writer.flush()
+        rng = np.random.default_rng(seed)
+        new_model = SGDRegressor(max_iter=1000, tol=1e-3)
+        rows = 0
+        holdout_X, holdout_y, holdout_points = [], [], []
+        with_points = self.model_registry is not None
+        started = time.perf_counter()
+
+        def fit_window(window_X, window_y):
+            X = np.concatenate(window_X)
+            y = np.concatenate(window_y)
+            order = rng.permutation(len(y))
+            new_model.partial_fit(X[order], y[order])
+
+        for epoch in range(epochs):
+            window_X, window_y, window_rows = [], [], 0
+            offset = 0
+            held = 0
+            for chunk in iter_history_chunks(
+                csv_file, self.history_writer.fmt, chunk_rows, points=with_points
+            ):
+                X, y = chunk[:2]
+                chunk_len = len(y)
+                if not chunk_len:
+                    continue
+                if held < holdout_rows:
+                    # Pick rows by their position so every epoch holds out the same ones.
+                    index = np.arange(offset, offset + chunk_len, dtype=np.uint64)
+                    mask = (index * np.uint64(2654435761)) % np.uint64(
+                        2**32
+                    ) < np.uint64(holdout_fraction * 2**32)
+                    mask &= np.cumsum(mask) <= holdout_rows - held
+                    held += int(mask.sum())
+                    if epoch == 0:
+                        holdout_X.append(X[mask])
+                        holdout_y.append(y[mask])
+                        if with_points:
+                            holdout_points.append(chunk[2][mask])
+                    X, y = X[~mask], y[~mask]
+                offset += chunk_len
+                window_X.append(X)
+                window_y.append(y)
+                window_rows += len(y)
+                rows += len(y)
+                if window_rows >= shuffle_window:
+                    fit_window(window_X, window_y)
+                    window_X, window_y, window_rows = [], [], 0
+            if window_rows:
+                fit_window(window_X, window_y)
+            if rows == 0:
+                print("No historical data available for retraining.")
+                return None
+
+        if holdout_X:
+            self.last_holdout = (
+                np.concatenate(holdout_X),
+                np.concatenate(holdout_y),
+                np.concatenate(holdout_points) if with_points else None,
+            )
+        else:
+            self.last_holdout = None
+        elapsed = time.perf_counter() - started
+        peak_memory_mb = None
+        if resource is not None:
+            # ru_maxrss is reported in kilobytes on Linux and bytes on macOS.
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak_memory_mb = peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        self.last_retrain_report = {
+            "rows": rows,
+            "epochs": epochs,
+            "seconds": elapsed,
+            "rows_per_second": rows / elapsed if elapsed > 0 else float("inf"),
+            "peak_memory_mb": peak_memory_mb,
+        }
+        print(
+            f"Retrained model on historical data (streaming): {rows} rows in "
+            f"{elapsed:.2f}s ({self.last_retrain_report['rows_per_second']:.0f} rows/s"
+            + (
+                f", peak RSS {peak_memory_mb:.1f} MB)."
+                if peak_memory_mb is not None
+                else ")."
+            )
+        )
+        return new_model
+
     def check_and_retrain_model(self):
-        current_time_ts = datetime.utcnow().timestamp()
-        last_retrain_ts = 0
-        if os.path.exists(LAST_RETRAIN_FILE):
-            with open(LAST_RETRAIN_FILE, "r") as f:
-                try:
-                    last_retrain_ts = float(f.read().strip())
-                except ValueError:
-                    last_retrain_ts = 0
-        if current_time_ts - last_retrain_ts > RETRAIN_INTERVAL_SECONDS:
-            new_model = self.retrain_model_from_data()
-            if new_model is not None:
-                self.online_model = new_model
-            with open(LAST_RETRAIN_FILE, "w") as f:
-                f.write(str(current_time_ts))
-            print("Model retrained at:", datetime.utcnow().isoformat() + "Z")
+        """
+        Synchronous retrain check. The signal path uses
+        self.retrain_scheduler.maybe_retrain() instead, which never blocks.
+        """
+        if self.retrain_scheduler.maybe_retrain():
+            self.retrain_scheduler.wait()
         else:
-            next_retrain = last_retrain_ts + RETRAIN_INTERVAL_SECONDS
+            next_retrain = self.retrain_scheduler.next_retrain_ts
             print(
                 "Next retraining scheduled at:",
                 datetime.utcfromtimestamp(next_retrain).isoformat() + "Z",
             )
 
-    def adjust_signals(self, lat, lon, current_time=0):
-        traffic_data = self.fetch_traffic_data(lat, lon)
-        flow_data = traffic_data.get("flowSegmentData", {})
+    @timed("traffic_signal.adjust_signals")
+    def adjust_signals(self, lat, lon, current_time=0, flow_data=None):
+        stages = get_metrics().stages("traffic_signal.adjust_signals")
+        if flow_data is None:
+            traffic_data = self.fetch_traffic_data(lat, lon)
+            flow_data = traffic_data.get("flowSegmentData", {})
+            if stages:
+                stages.mark("fetch")
         current_speed = flow_data.get("currentSpeed", 0)
         free_flow_speed = flow_data.get("freeFlowSpeed", 0)
 
+        intersection_id = intersection_key(lat, lon)
         current_congestion = self.compute_congestion(current_speed, free_flow_speed)
         features = {"current_speed": current_speed, "free_flow_speed": free_flow_speed}
+        if stages:
+            stages.mark("congestion")
         predicted_congestion = self.predict_future_congestion(
-            features, current_congestion
+            features, current_congestion, intersection_id
+        )
+        self.prediction_errors[(lat, lon)] = abs(
+            predicted_congestion - current_congestion
         )
+        if stages:
+            stages.mark("predict")
         weighted_congestion = (current_congestion + predicted_congestion) / 2
 
         ns_green = int(30 + 30 * weighted_congestion)
@@ -253,18 +446,54 @@ class TrafficSignalAgent:
             "predicted": {"N_S": predicted_congestion, "E_W": 0.2},
         }
 
-        intersection_id = f"intersection_{lat}_{lon}"
-        signal_plan_str = self.generate_signal_plan_output(
+        signal_plan = self.generate_signal_plan_output(
             intersection_id, congestion_estimates, signal_timings
         )
-        signal_plan_json = json.loads(signal_plan_str)
-        signal_state = self.build_signal_states(
-            signal_plan_json, current_time=current_time
-        )
+        self.signal_plans[intersection_id] = signal_plan
+        signal_state = self.build_signal_states(signal_plan, current_time=current_time)
+        if stages:
+            stages.mark("plan")
 
         self.store_api_data(
             lat, lon, current_speed, free_flow_speed, current_congestion
         )
-        self.check_and_retrain_model()
+        if stages:
+            stages.mark("store")
+        self.retrain_scheduler.maybe_retrain()
+        self.maybe_checkpoint()
+        if stages:
+            stages.mark("retrain_check")
 
         return signal_state
+
+    def checkpoint(self):
+        """
+        Save the online model and flush the per-intersection models so the
+        next start resumes from them.
+        """
+        self.next_checkpoint = time.monotonic() + self.checkpoint_interval
+        try:
+            if self.checkpoint_path:
+                save_predictor(self.online_model, self.checkpoint_path)
+            if self.model_registry is not None:
+                self.model_registry.flush()
+        except OSError as e:
+            print("Error writing model checkpoint:", e)
+
+    def maybe_checkpoint(self, now=None):
+        """
+        checkpoint() if checkpoint_interval has passed since the last one.
+        """
+        if (now if now is not None else time.monotonic()) < self.next_checkpoint:
+            return False
+        self.checkpoint()
+        return True
+
+    def close(self):
+        """
+        Flush buffered history, checkpoint model state and stop background
+        retraining.
+        """
+        self.history_writer.close()
+        self.retrain_scheduler.close()
+        self.checkpoint()
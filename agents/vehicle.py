@@ -1,5 +1,7 @@
 # agents/vehicle.py
 
+from agents.event_sink import ModeChange, get_default_sink
+
 
 class Vehicle:
     def __init__(
@@ -29,18 +31,21 @@ class Vehicle:
         self.mode = mode
         self.intersection = intersection
 
-    def update_mode(self, new_mode):
+    def update_mode(self, new_mode, sink=None):
         """
         Update the vehicle's operating mode.
         If the vehicle is smart, it can switch modes (eco, autonomous, emergency, etc.).
-        Otherwise, it stays in normal mode.
+        Otherwise, it stays in normal mode. The change is reported to `sink`
+        (default: the process-wide event sink).
         """
         if self.smart_vehicle:
             self.mode = new_mode
-            print(f"[Vehicle] {self.id} updated mode to {self.mode}.")
         else:
             self.mode = "normal"
-            print(f"[Vehicle] {self.id} is not smart, remains in normal mode.")
+        if sink is None:
+            sink = get_default_sink()
+        if sink.enabled:
+            sink.emit(ModeChange(self.id, self.mode, self.smart_vehicle))
 
     def set_intersection(self, intersection):
         """
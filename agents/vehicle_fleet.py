@@ -0,0 +1,383 @@
+# agents/vehicle_fleet.py
+
+from enum import IntEnum
+
+import numpy as np
+
+from agents.vehicle import Vehicle
+from config import SPATIAL_ASSIGN_MAX_METERS
+
+NO_INTERSECTION = -1
+
+
+class VehicleMode(IntEnum):
+    NORMAL = 0
+    ECO = 1
+    AUTONOMOUS = 2
+    EMERGENCY = 3
+
+    @classmethod
+    def parse(cls, mode):
+        if isinstance(mode, cls):
+            return mode
+        try:
+            return cls[str(mode).upper()]
+        except KeyError:
+            raise ValueError(f"Unknown vehicle mode: {mode}") from None
+
+    @property
+    def label(self):
+        return self.name.lower()
+
+
+class VehicleFleet:
+    _ARRAYS = ("ids", "lat", "lon", "destination", "mode", "smart", "intersection")
+
+    def __init__(self, intersections=None, capacity=16):
+        """
+        Struct-of-arrays store for a large vehicle population.
+
+        Ids, locations, destinations, modes (VehicleMode codes), smart flags
+        and intersection indices are kept in parallel NumPy arrays so fleet
+        queries are vectorized. Iterating or indexing yields FleetVehicle
+        views that behave like Vehicle objects for existing agent code.
+
+        Parameters:
+            intersections (iterable): Known intersection names, in index order.
+            capacity (int): Initial number of vehicle slots.
+        """
+        self.size = 0
+        self.ids = np.empty(capacity, dtype=object)
+        self.lat = np.zeros(capacity)
+        self.lon = np.zeros(capacity)
+        self.destination = np.zeros(capacity, dtype=np.int32)
+        self.mode = np.zeros(capacity, dtype=np.int8)
+        self.smart = np.zeros(capacity, dtype=bool)
+        self.intersection = np.full(capacity, NO_INTERSECTION, dtype=np.int32)
+        self.row_of = {}  # vehicle id -> row
+        self.destinations = []
+        self._destination_codes = {}
+        self.intersections = []
+        self._intersection_codes = {}
+        for name in intersections or ():
+            self.intersection_code(name)
+
+    @classmethod
+    def from_vehicles(cls, vehicles, intersections=None):
+        fleet = cls(intersections, capacity=max(len(vehicles), 1))
+        for vehicle in vehicles:
+            fleet.add(
+                vehicle.id,
+                vehicle.location,
+                vehicle.destination,
+                smart_vehicle=vehicle.smart_vehicle,
+                mode=vehicle.mode,
+                intersection=vehicle.intersection,
+            )
+        return fleet
+
+    @classmethod
+    def from_arrays(
+        cls,
+        ids,
+        lat,
+        lon,
+        destination,
+        mode,
+        smart,
+        intersection,
+        destinations,
+        intersections,
+    ):
+        """
+        Fleet over existing column arrays (e.g. memory-mapped snapshot
+        sections), adopted without copying. `destination` and
+        `intersection` hold codes into the `destinations` and
+        `intersections` name lists.
+        """
+        fleet = cls(intersections, capacity=0)
+        for name in destinations:
+            fleet.destination_code(name)
+        fleet.ids = np.array(list(ids), dtype=object)
+        fleet.lat = lat
+        fleet.lon = lon
+        fleet.destination = destination
+        fleet.mode = mode
+        fleet.smart = smart
+        fleet.intersection = intersection
+        fleet.size = len(fleet.ids)
+        fleet.row_of = {vehicle_id: row for row, vehicle_id in enumerate(fleet.ids)}
+        return fleet
+
+    def copy(self):
+        """
+        Independent fleet holding the same vehicles.
+        """
+        n = self.size
+        return VehicleFleet.from_arrays(
+            self.ids[:n],
+            *(getattr(self, name)[:n].copy() for name in self._ARRAYS[1:]),
+            self.destinations,
+            self.intersections,
+        )
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for row in range(self.size):
+            yield FleetVehicle(self, row)
+
+    def __getitem__(self, row):
+        if not -self.size <= row < self.size:
+            raise IndexError(row)
+        return FleetVehicle(self, row % self.size)
+
+    def get(self, vehicle_id):
+        return FleetVehicle(self, self.row_of[vehicle_id])
+
+    def intersection_code(self, name):
+        if name is None:
+            return NO_INTERSECTION
+        code = self._intersection_codes.get(name)
+        if code is None:
+            code = self._intersection_codes[name] = len(self.intersections)
+            self.intersections.append(name)
+        return code
+
+    def destination_code(self, name):
+        code = self._destination_codes.get(name)
+        if code is None:
+            code = self._destination_codes[name] = len(self.destinations)
+            self.destinations.append(name)
+        return code
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity)
+        for name in self._ARRAYS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            if name == "intersection":
+                new[self.size :] = NO_INTERSECTION
+            setattr(self, name, new)
+
+    def add(
+        self,
+        vehicle_id,
+        location,
+        destination,
+        smart_vehicle=False,
+        mode="normal",
+        intersection=None,
+    ):
+        """
+        Append a vehicle and return its row.
+        """
+        if vehicle_id in self.row_of:
+            raise ValueError(f"Duplicate vehicle id: {vehicle_id}")
+        row = self.size
+        self._grow(row + 1)
+        self.ids[row] = vehicle_id
+        self.lat[row], self.lon[row] = location
+        self.destination[row] = self.destination_code(destination)
+        self.mode[row] = VehicleMode.parse(mode)
+        self.smart[row] = smart_vehicle
+        self.intersection[row] = self.intersection_code(intersection)
+        self.row_of[vehicle_id] = row
+        self.size = row + 1
+        return row
+
+    def add_many(
+        self,
+        vehicle_ids,
+        lats,
+        lons,
+        destinations,
+        modes="normal",
+        smart_vehicle=False,
+        intersections=None,
+    ):
+        """
+        Append many vehicles at once; scalar arguments apply to all of them.
+        Returns the new rows.
+        """
+        vehicle_ids = list(vehicle_ids)
+        n = len(vehicle_ids)
+        start = self.size
+        rows = np.arange(start, start + n)
+        self._grow(start + n)
+
+        def codes(values, lookup):
+            if isinstance(values, str) or values is None:
+                return np.full(n, lookup(values))
+            return np.fromiter((lookup(v) for v in values), dtype=np.int64, count=n)
+
+        row_of = self.row_of
+        for offset, vehicle_id in enumerate(vehicle_ids):
+            if vehicle_id in row_of:
+                raise ValueError(f"Duplicate vehicle id: {vehicle_id}")
+            row_of[vehicle_id] = start + offset
+        self.ids[rows] = vehicle_ids
+        self.lat[rows] = lats
+        self.lon[rows] = lons
+        self.destination[rows] = codes(destinations, self.destination_code)
+        self.mode[rows] = codes(modes, VehicleMode.parse)
+        self.smart[rows] = smart_vehicle
+        self.intersection[rows] = codes(intersections, self.intersection_code)
+        self.size = start + n
+        return rows
+
+    def locations(self, rows=None):
+        """
+        (lat, lon) tuples for the given rows (all vehicles by default).
+        """
+        if rows is None:
+            rows = slice(0, self.size)
+        return list(zip(self.lat[rows].tolist(), self.lon[rows].tolist()))
+
+    def intersection_waits(self, wait_times):
+        """
+        Per-vehicle wait time of each vehicle's intersection, from a mapping
+        of intersection name -> wait (e.g. FairnessAgent.wait_times).
+        """
+        table = np.array(
+            [wait_times.get(name, 0) for name in self.intersections] + [0],
+            dtype=float,
+        )
+        # NO_INTERSECTION (-1) picks the trailing 0.
+        return table[self.intersection[: self.size]]
+
+    def select(
+        self,
+        mode=None,
+        exclude_mode=None,
+        intersection=None,
+        min_wait=None,
+        wait_times=None,
+    ):
+        """
+        Rows matching every given filter.
+
+        Parameters:
+            mode: Only vehicles in this mode.
+            exclude_mode: Skip vehicles in this mode.
+            intersection: Intersection name or index.
+            min_wait (float): Only vehicles whose intersection wait exceeds this.
+            wait_times (mapping): Intersection wait times used with min_wait.
+        """
+        mask = np.ones(self.size, dtype=bool)
+        if mode is not None:
+            mask &= self.mode[: self.size] == VehicleMode.parse(mode)
+        if exclude_mode is not None:
+            mask &= self.mode[: self.size] != VehicleMode.parse(exclude_mode)
+        if intersection is not None:
+            if not isinstance(intersection, (int, np.integer)):
+                intersection = self._intersection_codes.get(intersection)
+                if intersection is None:
+                    return np.empty(0, dtype=np.intp)
+            mask &= self.intersection[: self.size] == intersection
+        if min_wait is not None:
+            mask &= self.intersection_waits(wait_times or {}) > min_wait
+        return np.flatnonzero(mask)
+
+    def assign_intersections(self, index, max_distance=SPATIAL_ASSIGN_MAX_METERS):
+        """
+        Set each unassigned vehicle's intersection to the nearest point of
+        `index` (a SpatialIndex over intersections) within `max_distance`
+        metres. Vehicles with an intersection keep it. Returns the number
+        of vehicles assigned.
+        """
+        rows = np.flatnonzero(self.intersection[: self.size] == NO_INTERSECTION)
+        if not len(rows):
+            return 0
+        nearest, _ = index.nearest_many(self.lat[rows], self.lon[rows], max_distance)
+        found = nearest >= 0
+        codes = np.array([self.intersection_code(name) for name in index.names])
+        self.intersection[rows[found]] = codes[nearest[found]]
+        return int(found.sum())
+
+    def at_intersection(self, intersection, mode=None):
+        return self.select(mode=mode, intersection=intersection)
+
+    def set_modes(self, rows, mode):
+        """
+        Bulk Vehicle.update_mode without printing: smart vehicles switch to
+        `mode`, others stay normal.
+        """
+        code = VehicleMode.parse(mode)
+        self.mode[rows] = np.where(self.smart[rows], code, VehicleMode.NORMAL)
+
+
+class FleetVehicle(Vehicle):
+    """
+    Vehicle view onto one row of a VehicleFleet. Reads and writes go
+    straight to the fleet arrays.
+    """
+
+    def __init__(self, fleet, row):
+        self._fleet = fleet
+        self._row = row
+
+    @property
+    def row(self):
+        return self._row
+
+    @property
+    def id(self):
+        return self._fleet.ids[self._row]
+
+    @property
+    def location(self):
+        return (float(self._fleet.lat[self._row]), float(self._fleet.lon[self._row]))
+
+    @location.setter
+    def location(self, location):
+        self._fleet.lat[self._row], self._fleet.lon[self._row] = location
+
+    @property
+    def destination(self):
+        return self._fleet.destinations[self._fleet.destination[self._row]]
+
+    @destination.setter
+    def destination(self, destination):
+        self._fleet.destination[self._row] = self._fleet.destination_code(destination)
+
+    @property
+    def smart_vehicle(self):
+        return bool(self._fleet.smart[self._row])
+
+    @smart_vehicle.setter
+    def smart_vehicle(self, smart_vehicle):
+        self._fleet.smart[self._row] = smart_vehicle
+
+    @property
+    def mode_code(self):
+        return VehicleMode(self._fleet.mode[self._row])
+
+    @property
+    def mode(self):
+        return self.mode_code.label
+
+    @mode.setter
+    def mode(self, mode):
+        self._fleet.mode[self._row] = VehicleMode.parse(mode)
+
+    @property
+    def intersection(self):
+        code = self._fleet.intersection[self._row]
+        if code == NO_INTERSECTION:
+            return None
+        return self._fleet.intersections[code]
+
+    @intersection.setter
+    def intersection(self, intersection):
+        self._fleet.intersection[self._row] = self._fleet.intersection_code(
+            intersection
+        )
+
+    def __repr__(self):
+        return f"FleetVehicle({self.id!r}, mode={self.mode!r}, intersection={self.intersection!r})"
@@ -0,0 +1,329 @@
+# agents/vehicle_motion.py
+
+import math
+
+import numpy as np
+
+from agents.metrics import get_metrics, timed
+from agents.road_graph import NO_NODE
+from agents.signal_timing import green_windows
+from agents.vehicle_fleet import VehicleMode
+from config import MOTION_DEFAULT_GREEN, MOTION_SATURATION_FLOW
+
+# Vehicle states.
+PARKED = 0  # off the graph or no route to its destination
+QUEUED = 1  # waiting at `node` on the `axis` approach
+MOVING = 2  # travelling along `edge`
+ARRIVED = 3  # reached its destination
+
+# Approach axes.
+NS = 0
+EW = 1
+
+
+class VehicleMotion:
+    _ARRAYS = ("state", "node", "edge", "axis", "remaining", "duration", "since")
+
+    def __init__(
+        self,
+        fleet,
+        routing_agent,
+        start_time=0,
+        saturation_flow=MOTION_SATURATION_FLOW,
+    ):
+        """
+        Moves a VehicleFleet over the routing agent's road graph.
+
+        Each advance() is one tick for the whole fleet in array operations:
+        queued vehicles are routed, every intersection approach discharges
+        its queue in arrival order at `saturation_flow` vehicles per second
+        of green (from the planned signal splits, see set_plan), and moving
+        vehicles travel their link at its congestion-weighted travel time.
+        Vehicles reaching an intersection join the queue of the approach
+        they arrive on and are served from the next tick. Emergency
+        vehicles are let through at once.
+
+        Time vehicles spend queued accumulates per intersection (vehicle
+        seconds), for FairnessAgent via take_waits().
+
+        Parameters:
+            fleet (VehicleFleet): Vehicles to move; their intersection and
+                location are updated in place.
+            routing_agent (RoutingAgent): Routes queued vehicles; must have
+                a road graph.
+            start_time (float): Simulated time of the fleet's positions.
+            saturation_flow (float): Discharge rate of a green approach.
+        """
+        self.fleet = fleet
+        self.routing_agent = routing_agent
+        self.graph = graph = routing_agent.road_graph
+        self.saturation_flow = saturation_flow
+        self.time = start_time
+        n_nodes = len(graph)
+        self.ns_green = np.full(n_nodes, float(MOTION_DEFAULT_GREEN))
+        self.ew_green = np.full(n_nodes, float(MOTION_DEFAULT_GREEN))
+        self.carry = np.zeros(2 * n_nodes)  # unused discharge per approach
+        self.pending_waits = np.zeros(n_nodes)  # vehicle seconds since take_waits()
+        self.discharged = np.zeros(n_nodes, dtype=np.int64)
+
+        # Approach axis of each link, from its direction of travel.
+        coords = graph.coords
+        lat0 = math.radians(coords[:, 0].mean()) if len(coords) else 0.0
+        dlat = coords[graph.dst, 0] - coords[graph.src, 0]
+        dlon = (coords[graph.dst, 1] - coords[graph.src, 1]) * math.cos(lat0)
+        self._edge_axis = np.where(np.abs(dlat) >= np.abs(dlon), NS, EW).astype(np.int8)
+        # Graph row -> fleet intersection code.
+        self._codes = np.array(
+            [fleet.intersection_code(name) for name in graph.names], dtype=np.int32
+        )
+
+        self.size = 0
+        self.state = np.empty(0, dtype=np.int8)
+        self.node = np.empty(0, dtype=np.intp)
+        self.edge = np.empty(0, dtype=np.intp)
+        self.axis = np.empty(0, dtype=np.int8)  # -1 until known
+        self.remaining = np.empty(0)  # seconds left on the link
+        self.duration = np.empty(0)  # travel time of the link
+        self.since = np.empty(0)  # time the vehicle joined its queue
+        self._sync()
+
+    def _sync(self):
+        """
+        Start tracking vehicles added to the fleet since the last tick:
+        queued at their intersection, or parked when it is off the graph.
+        """
+        n = len(self.fleet)
+        if n <= self.size:
+            return
+        if n > len(self.state):
+            capacity = max(n, 2 * len(self.state))
+            for name in self._ARRAYS:
+                old = getattr(self, name)
+                new = np.empty(capacity, dtype=old.dtype)
+                new[: self.size] = old[: self.size]
+                setattr(self, name, new)
+        new = slice(self.size, n)
+        fleet = self.fleet
+        graph = self.graph
+        rows = np.array(
+            [graph.index.get(name, NO_NODE) for name in fleet.intersections]
+            + [NO_NODE],
+            dtype=np.intp,
+        )[fleet.intersection[new]]
+        self.node[new] = rows
+        self.state[new] = np.where(rows != NO_NODE, QUEUED, PARKED)
+        self.edge[new] = NO_NODE
+        self.axis[new] = -1
+        self.remaining[new] = 0.0
+        self.duration[new] = 0.0
+        self.since[new] = self.time
+        self.size = n
+
+    def set_plan(self, intersection, ns_green, ew_green):
+        """
+        Green durations (seconds) of an intersection's current signal plan.
+        """
+        row = self.graph.index.get(intersection)
+        if row is not None:
+            self.ns_green[row] = ns_green
+            self.ew_green[row] = ew_green
+
+    def set_plans(self, ns_green, ew_green):
+        """
+        set_plan() for every intersection at once, as arrays in graph order.
+        """
+        self.ns_green[:] = ns_green
+        self.ew_green[:] = ew_green
+
+    @timed("motion.advance")
+    def advance(self, until):
+        """
+        Move the fleet from the last tick up to simulated time `until`.
+        """
+        start = self.time
+        dt = until - start
+        if dt <= 0:
+            return
+        self.time = until
+        self._sync()
+        fleet = self.fleet
+        graph = self.graph
+        n_nodes = len(graph)
+        waits = np.zeros(n_nodes)
+        elapsed = np.zeros(self.size)  # seconds each vehicle has driven this tick
+        moving = self.state[: self.size] == MOVING
+        elapsed[moving] = dt
+
+        # Vehicles that have not moved yet are routed first to learn which
+        # approach they queue on (the one they leave by), or that they are
+        # already at their destination.
+        queued = np.flatnonzero(self.state[: self.size] == QUEUED)
+        fresh = queued[self.axis[queued] < 0]
+        if len(fresh):
+            next_hops, costs = self.routing_agent.route_fleet(fleet, fresh)
+            self._unroutable(fresh, next_hops, costs)
+            routed = next_hops != NO_NODE
+            edges = graph.edges_between(self.node[fresh[routed]], next_hops[routed])
+            self.axis[fresh[routed]] = self._edge_axis[edges]
+            queued = np.flatnonzero(self.state[: self.size] == QUEUED)
+
+        # Serve each approach in arrival order for as long as it is green.
+        approach = self.node[queued] * 2 + self.axis[queued]
+        ns_seconds, ew_seconds, ns_delay, ew_delay = green_windows(
+            self.ns_green, self.ew_green, start, until
+        )
+        green = np.column_stack((ns_seconds, ew_seconds)).ravel()
+        delay = np.column_stack((ns_delay, ew_delay)).ravel()
+        capacity = green * self.saturation_flow + self.carry
+        emergency = fleet.mode[queued] == VehicleMode.EMERGENCY
+        order = np.flatnonzero(~emergency)
+        since = self.since[queued[order]]
+        if len(order):
+            # One stable sort by (approach, queued since, row).
+            first = since.min()
+            span = since.max() - first + 1
+            order = order[
+                np.argsort(approach[order] * span + (since - first), kind="stable")
+            ]
+        sorted_approach = approach[order]
+        lengths = np.bincount(sorted_approach, minlength=2 * n_nodes)
+        rank = np.arange(len(order)) - (np.cumsum(lengths) - lengths)[sorted_approach]
+        offset = np.zeros(len(queued))
+        served = emergency.copy()
+        served[order] = rank < np.floor(capacity[sorted_approach])
+        offset[order] = np.minimum(
+            delay[sorted_approach] + rank / self.saturation_flow, dt
+        )
+        # Capacity left over is only carried while the queue outlasts it.
+        full = lengths > np.floor(capacity)
+        self.carry = np.where(full, capacity - np.floor(capacity), 0.0)
+        waits += np.bincount(
+            self.node[queued],
+            weights=np.where(served, offset, dt),
+            minlength=n_nodes,
+        )
+
+        # Served vehicles enter the next link of their current route.
+        leaving = queued[served]
+        offset = offset[served]
+        next_hops, costs = self.routing_agent.route_fleet(fleet, leaving)
+        self._unroutable(leaving, next_hops, costs)
+        routed = next_hops != NO_NODE
+        leaving, next_hops, offset = leaving[routed], next_hops[routed], offset[routed]
+        edges = graph.edges_between(self.node[leaving], next_hops)
+        self.discharged += np.bincount(self.node[leaving], minlength=n_nodes)
+        self.state[leaving] = MOVING
+        self.edge[leaving] = edges
+        self.duration[leaving] = graph.cost[edges]
+        self.remaining[leaving] = graph.cost[edges]
+        elapsed[leaving] = dt - offset
+
+        # Drive every moving vehicle; those reaching the end of their link
+        # queue at (or have arrived at) its far intersection.
+        moving = np.flatnonzero(self.state[: self.size] == MOVING)
+        self.remaining[moving] -= elapsed[moving]
+        reached = self.remaining[moving] <= 0
+        en_route = moving[~reached]
+        reached = moving[reached]
+        edges = self.edge[en_route]
+        progress = 1 - self.remaining[en_route] / np.maximum(
+            self.duration[en_route], 1e-9
+        )
+        src = graph.src[edges]
+        dst = graph.dst[edges]
+        coords = graph.coords
+        fleet.lat[en_route] = (
+            coords[src, 0] + (coords[dst, 0] - coords[src, 0]) * progress
+        )
+        fleet.lon[en_route] = (
+            coords[src, 1] + (coords[dst, 1] - coords[src, 1]) * progress
+        )
+
+        edges = self.edge[reached]
+        nodes = graph.dst[edges]
+        arrival_time = until + self.remaining[reached]
+        self.node[reached] = nodes
+        self.axis[reached] = self._edge_axis[edges]
+        self.edge[reached] = NO_NODE
+        self.since[reached] = arrival_time
+        fleet.intersection[reached] = self._codes[nodes]
+        fleet.lat[reached] = coords[nodes, 0]
+        fleet.lon[reached] = coords[nodes, 1]
+        at_destination = self.routing_agent.fleet_destinations(fleet, reached) == nodes
+        self.state[reached] = np.where(at_destination, ARRIVED, QUEUED)
+        waiting = ~at_destination
+        waits += np.bincount(
+            nodes[waiting],
+            weights=until - arrival_time[waiting],
+            minlength=n_nodes,
+        )
+        self.pending_waits += waits
+
+        metrics = get_metrics()
+        metrics.count("motion.discharged", len(leaving))
+        metrics.count("motion.arrivals", int(at_destination.sum()))
+
+    def _unroutable(self, rows, next_hops, costs):
+        """
+        Mark routed `rows` without a next hop as arrived (at their
+        destination) or parked (no route to it).
+        """
+        done = (next_hops == NO_NODE) & np.isfinite(costs)
+        self.state[rows[done]] = ARRIVED
+        self.state[rows[np.isinf(costs)]] = PARKED
+        if done.any():
+            get_metrics().count("motion.arrivals", int(done.sum()))
+
+    def take_waits(self):
+        """
+        Vehicle seconds queued at each intersection (graph order) since the
+        last call.
+        """
+        waits = self.pending_waits
+        self.pending_waits = np.zeros(len(waits))
+        return waits
+
+    def queue_lengths(self):
+        """
+        Queued vehicles per intersection, (n, 2) for the N_S and E_W
+        approaches.
+        """
+        queued = np.flatnonzero(self.state[: self.size] == QUEUED)
+        approach = self.node[queued] * 2 + np.maximum(self.axis[queued], 0)
+        return np.bincount(approach, minlength=2 * len(self.graph)).reshape(-1, 2)
+
+    def stats(self):
+        counts = np.bincount(self.state[: self.size], minlength=4)
+        return {
+            "parked": int(counts[PARKED]),
+            "queued": int(counts[QUEUED]),
+            "moving": int(counts[MOVING]),
+            "arrived": int(counts[ARRIVED]),
+            "discharged": int(self.discharged.sum()),
+        }
+
+    def arrays(self):
+        """
+        Per-vehicle state arrays and per-intersection counters, for
+        snapshots.
+        """
+        arrays = {name: getattr(self, name)[: self.size] for name in self._ARRAYS}
+        arrays.update(
+            ns_green=self.ns_green,
+            ew_green=self.ew_green,
+            carry=self.carry,
+            pending_waits=self.pending_waits,
+            discharged=self.discharged,
+        )
+        return arrays
+
+    def load_arrays(self, arrays, time):
+        """
+        Restore state saved by arrays() at simulated time `time`; arrays
+        are adopted without copying.
+        """
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.size = len(self.state)
+        self.time = time
+        self._sync()
@@ -0,0 +1,530 @@
+# benchmark.py
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from agents.drone_agent import DroneAgent
+from agents.event_sink import NullSink
+from agents.fairness_agent import FairnessAgent
+from agents.road_graph import RoadGraph
+from agents.routing_agent import RoutingAgent
+from agents.traffic_signal_agent import TrafficSignalAgent
+from agents.vehicle_fleet import VehicleFleet, VehicleMode
+from agents.vehicle_motion import VehicleMotion
+from config import FAIRNESS_TOP_K
+from simulation import SimulationContext
+from stub_flow_server import StubFlowProvider
+
+# Grid origin (downtown San Francisco) and spacing between intersections.
+GRID_ORIGIN = (37.7749, -122.4194)
+GRID_SPACING_DEGREES = 0.001
+
+DEFAULT_INTERSECTIONS = (10, 100, 1000)
+DEFAULT_VEHICLES = (100, 1000, 10000)
+
+# Startup targets for a restarted controller (seconds, measured in-process
+# from the first import).
+STARTUP_IMPORT_TARGET_SECONDS = 0.5
+STARTUP_FIRST_SIGNAL_TARGET_SECONDS = 1.0
+
+# Run in a fresh interpreter: imports the simulation, builds the agents and
+# plans the first signal, printing the timings as JSON.
+STARTUP_SCRIPT = """
+import json, os, time
+started = time.perf_counter()
+import simulation
+imported = time.perf_counter()
+from agents.event_sink import NullSink
+from config import MODEL_CHECKPOINT_FILE
+from stub_flow_server import StubFlowProvider
+warm = os.path.exists(MODEL_CHECKPOINT_FILE)
+ctx = simulation.SimulationContext(sink=NullSink(), flow_provider=StubFlowProvider())
+ctx.prefetch_flow_data()
+ctx.adjust_intersection(next(iter(ctx.intersections)), current_time=0)
+first_signal = time.perf_counter()
+ctx.close()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "first_signal_seconds": first_signal - started,
+    "warm_start": warm,
+}))
+"""
+
+
+def make_grid(n_intersections, origin=GRID_ORIGIN, spacing=GRID_SPACING_DEGREES):
+    """
+    N intersections on a square grid: {"int_<row>_<col>": (lat, lon)}.
+    """
+    side = max(1, math.ceil(math.sqrt(n_intersections)))
+    intersections = {}
+    for i in range(n_intersections):
+        row, col = divmod(i, side)
+        intersections[f"int_{row}_{col}"] = (
+            round(origin[0] + row * spacing, 6),
+            round(origin[1] + col * spacing, 6),
+        )
+    return intersections
+
+
+def make_fleet(n_vehicles, intersections, seed=0):
+    """
+    M vehicles placed at random grid intersections with a realistic mix of
+    modes (mostly normal, a few emergency).
+    """
+    rng = np.random.default_rng(seed)
+    names = list(intersections)
+    coords = np.array([intersections[name] for name in names])
+    at = rng.integers(0, len(names), n_vehicles)
+    modes = rng.choice(
+        [
+            VehicleMode.NORMAL,
+            VehicleMode.ECO,
+            VehicleMode.AUTONOMOUS,
+            VehicleMode.EMERGENCY,
+        ],
+        size=n_vehicles,
+        p=[0.6, 0.2, 0.18, 0.02],
+    )
+    fleet = VehicleFleet(intersections=names, capacity=n_vehicles)
+    fleet.add_many(
+        [f"V{i}" for i in range(n_vehicles)],
+        coords[at, 0],
+        coords[at, 1],
+        [names[i] for i in rng.integers(0, len(names), n_vehicles)],
+        modes=[VehicleMode(m) for m in modes],
+        intersections=[names[i] for i in at],
+    )
+    fleet.smart[: len(fleet)] = modes != VehicleMode.NORMAL
+    return fleet
+
+
+def summarize(latencies_ns, allocations=None):
+    """
+    Latency percentiles (microseconds) and throughput for one benchmark.
+    """
+    latencies = np.asarray(latencies_ns, dtype=float) / 1000.0
+    total_seconds = latencies.sum() / 1e6
+    result = {
+        "calls": int(len(latencies)),
+        "mean_us": float(latencies.mean()),
+        "p50_us": float(np.percentile(latencies, 50)),
+        "p90_us": float(np.percentile(latencies, 90)),
+        "p99_us": float(np.percentile(latencies, 99)),
+        "max_us": float(latencies.max()),
+        "ops_per_second": len(latencies) / total_seconds if total_seconds else None,
+    }
+    if allocations is not None:
+        result.update(allocations)
+    return result
+
+
+def time_calls(fn, args_list, repeat=1):
+    """
+    Call fn(*args) for every args tuple, `repeat` times, returning the
+    per-call latencies in nanoseconds.
+    """
+    latencies = []
+    clock = time.perf_counter_ns
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for args in args_list:
+                started = clock()
+                fn(*args)
+                latencies.append(clock() - started)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return latencies
+
+
+def trace_allocations(fn, args_list):
+    """
+    Allocation count/bytes per call and peak traced memory for one pass
+    over args_list. Run separately from timing because tracemalloc slows
+    every allocation down.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        for args in args_list:
+            fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(max(stat.count_diff, 0) for stat in stats)
+    size = sum(max(stat.size_diff, 0) for stat in stats)
+    calls = max(len(args_list), 1)
+    return {
+        "retained_blocks_per_call": blocks / calls,
+        "retained_bytes_per_call": size / calls,
+        "peak_traced_bytes": peak - base,
+    }
+
+
+def make_signal_agent(flow_provider):
+    agent = TrafficSignalAgent(flow_provider)
+    # Keep background retraining out of the measurements.
+    agent.retrain_scheduler.next_retrain_ts = math.inf
+    return agent
+
+
+def bench_adjust_signals(intersections, flow_provider, repeat):
+    agent = make_signal_agent(flow_provider)
+    flows = flow_provider.fetch_many(list(intersections.values()))
+    args = [
+        (lat, lon, 10 * step, flows[(lat, lon)])
+        for step in range(1, repeat + 1)
+        for lat, lon in intersections.values()
+    ]
+    latencies = time_calls(agent.adjust_signals, args)
+    allocations = trace_allocations(agent.adjust_signals, args[: len(intersections)])
+    agent.close()
+    return summarize(latencies, allocations)
+
+
+def bench_route_vehicle(fleet, flow_provider, repeat):
+    agent = RoutingAgent(flow_provider)
+    flows = flow_provider.fetch_many(fleet.locations())
+    args = [(vehicle, flows[vehicle.location]) for vehicle in fleet]
+    latencies = time_calls(agent.route_vehicle, args, repeat)
+    return summarize(latencies, trace_allocations(agent.route_vehicle, args))
+
+
+def bench_route_fleet(intersections, fleet, repeat, seed):
+    """
+    One call = route_fleet for the whole fleet after a congestion update
+    touching about 1% of intersections, as in a simulation tick. The
+    first call builds the trees; later calls measure the cached path.
+    """
+    graph = RoadGraph.from_intersections(intersections)
+    agent = RoutingAgent(road_graph=graph)
+    rng = np.random.default_rng(seed)
+    agent.route_fleet(fleet)
+
+    def route_step():
+        congestion = graph.congestion.copy()
+        changed = rng.random(len(congestion)) < 0.01
+        congestion[changed] = rng.random(int(changed.sum()))
+        graph.update_congestion(congestion)
+        return agent.route_fleet(fleet)
+
+    latencies = time_calls(route_step, [()] * repeat)
+    return summarize(latencies, trace_allocations(route_step, [()]))
+
+
+def bench_vehicle_motion(intersections, n_vehicles, repeat, seed):
+    """
+    One call = a 10-second movement tick for the whole fleet: routing the
+    vehicles that leave their queue, discharging every approach and
+    driving every link. Runs on its own fleet, which it moves.
+    """
+    graph = RoadGraph.from_intersections(intersections)
+    motion = VehicleMotion(
+        make_fleet(n_vehicles, intersections, seed), RoutingAgent(road_graph=graph)
+    )
+    motion.advance(10)  # routes every vehicle once
+    ticks = iter(range(20, 10 * (repeat + 3), 10))
+
+    def motion_step():
+        motion.advance(next(ticks))
+
+    latencies = time_calls(motion_step, [()] * repeat)
+    return summarize(latencies, trace_allocations(motion_step, [()]))
+
+
+def bench_fairness(intersections, repeat, seed):
+    """
+    One call = a batched update for every intersection followed by the
+    top-k fairness ranking, as in a simulation step.
+    """
+    agent = FairnessAgent()
+    rng = random.Random(seed)
+    rows = agent.rows(intersections)
+    congestion = np.array([rng.random() for _ in intersections])
+
+    def fairness_step():
+        agent.decay()
+        agent.update_many(rows, congestion * 10)
+        return agent.get_fair_signal_plan(FAIRNESS_TOP_K)
+
+    latencies = time_calls(fairness_step, [()] * repeat)
+    return summarize(latencies, trace_allocations(fairness_step, [()]))
+
+
+def bench_scan_traffic(intersections, repeat, seed):
+    """
+    One call = a single-intersection lookup in the step's batched scan.
+    """
+    agent = DroneAgent(random.Random(seed))
+    agent.scan_all(intersections, 0)
+    args = [(name,) for name in intersections]
+    latencies = time_calls(agent.scan_traffic, args, repeat)
+    return summarize(latencies, trace_allocations(agent.scan_traffic, args))
+
+
+def bench_scan_all(intersections, repeat, seed):
+    """
+    One call = a batched scan of every intersection.
+    """
+    agent = DroneAgent(random.Random(seed))
+    latencies = time_calls(agent.scan_all, [(intersections,)] * repeat)
+    return summarize(latencies, trace_allocations(agent.scan_all, [(intersections,)]))
+
+
+def bench_simulation_step(intersections, fleet, flow_provider, steps, seed):
+    ctx = SimulationContext(
+        "rush_hour",
+        intersections=intersections,
+        vehicles=fleet,
+        rng=random.Random(seed),
+        sink=NullSink(),
+        flow_provider=flow_provider,
+    )
+    ctx.signal_agent.retrain_scheduler.next_retrain_ts = math.inf
+    ctx.run_step(1)  # warm-up
+    args = [(step,) for step in range(2, steps + 2)]
+    latencies = time_calls(ctx.run_step, args)
+    allocations = trace_allocations(ctx.run_step, [(steps + 2,)])
+    ctx.signal_agent.close()
+    result = summarize(latencies, allocations)
+    result["steps_per_second"] = result.pop("ops_per_second")
+    return result
+
+
+def bench_startup(runs=3):
+    """
+    Import time and time-to-first-signal of fresh interpreters: one cold
+    start in an empty directory, then `runs` restarts that warm-start from
+    the checkpoint the previous run left behind. Reports the median of the
+    restarts next to the cold start.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (root, env.get("PYTHONPATH"))))
+    timings = []
+    with tempfile.TemporaryDirectory(prefix="trafficagent-startup-") as scratch:
+        for _ in range(runs + 1):
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT],
+                cwd=scratch,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            timings.append(json.loads(output.strip().splitlines()[-1]))
+    cold, warm = timings[0], timings[1:]
+    return {
+        "cold": cold,
+        "warm": {
+            key: float(np.median([run[key] for run in warm]))
+            for key in ("import_seconds", "first_signal_seconds")
+        },
+        "warm_start": all(run["warm_start"] for run in warm),
+        "targets": {
+            "import_seconds": STARTUP_IMPORT_TARGET_SECONDS,
+            "first_signal_seconds": STARTUP_FIRST_SIGNAL_TARGET_SECONDS,
+        },
+    }
+
+
+def startup_misses(startup):
+    """
+    (measurement, seconds, target) for every warm-restart timing over its
+    target.
+    """
+    return [
+        (name, startup["warm"][name], target)
+        for name, target in startup["targets"].items()
+        if startup["warm"][name] > target
+    ]
+
+
+def run_case(n_intersections, n_vehicles, repeat=5, steps=5, seed=0):
+    """
+    All benchmarks for one network/fleet size.
+    """
+    intersections = make_grid(n_intersections)
+    fleet = make_fleet(n_vehicles, intersections, seed)
+    flow_provider = StubFlowProvider()
+    return {
+        "intersections": n_intersections,
+        "vehicles": n_vehicles,
+        "adjust_signals": bench_adjust_signals(intersections, flow_provider, repeat),
+        "route_vehicle": bench_route_vehicle(fleet, flow_provider, repeat),
+        "route_fleet": bench_route_fleet(intersections, fleet, repeat, seed),
+        "vehicle_motion": bench_vehicle_motion(intersections, n_vehicles, repeat, seed),
+        "fairness": bench_fairness(intersections, repeat, seed),
+        "scan_traffic": bench_scan_traffic(intersections, repeat, seed),
+        "scan_all": bench_scan_all(intersections, repeat, seed),
+        "simulation_step": bench_simulation_step(
+            intersections, fleet, flow_provider, steps, seed
+        ),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": time.time(),
+        "commit": commit or None,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmarks(
+    intersection_counts=DEFAULT_INTERSECTIONS,
+    vehicle_counts=DEFAULT_VEHICLES,
+    repeat=5,
+    steps=5,
+    seed=0,
+):
+    """
+    Run every benchmark for each (intersections, vehicles) pair. Agents
+    write history and model files, so the run happens in a scratch
+    directory.
+    """
+    results = {"environment": environment(), "cases": []}
+    print("Benchmarking startup...", file=sys.stderr)
+    results["startup"] = bench_startup()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="trafficagent-bench-") as scratch:
+        os.chdir(scratch)
+        try:
+            for n_intersections in intersection_counts:
+                for n_vehicles in vehicle_counts:
+                    print(
+                        f"Benchmarking {n_intersections} intersections, {n_vehicles} vehicles...",
+                        file=sys.stderr,
+                    )
+                    results["cases"].append(
+                        run_case(n_intersections, n_vehicles, repeat, steps, seed)
+                    )
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+BENCHMARKS = (
+    "adjust_signals",
+    "route_vehicle",
+    "route_fleet",
+    "vehicle_motion",
+    "fairness",
+    "scan_traffic",
+    "scan_all",
+    "simulation_step",
+)
+
+
+def compare(baseline, current, threshold=0.10):
+    """
+    Compare p50 latencies of matching cases. Returns a list of
+    (case, benchmark, baseline_us, current_us, ratio) for every benchmark
+    that got slower by more than `threshold`.
+    """
+    previous = {(c["intersections"], c["vehicles"]): c for c in baseline["cases"]}
+    regressions = []
+    for case in current["cases"]:
+        key = (case["intersections"], case["vehicles"])
+        if key not in previous:
+            continue
+        for name in BENCHMARKS:
+            old = previous[key].get(name, {}).get("p50_us")
+            new = case[name]["p50_us"]
+            if old and new / old > 1 + threshold:
+                regressions.append((key, name, old, new, new / old))
+    return regressions
+
+
+def print_report(results):
+    startup = results.get("startup")
+    if startup:
+        print("\nStartup (cold / warm restart)")
+        for name in ("import_seconds", "first_signal_seconds"):
+            print(
+                f"  {name:>20}: {startup['cold'][name] * 1000:8.1f} ms / "
+                f"{startup['warm'][name] * 1000:8.1f} ms  "
+                f"(target {startup['targets'][name] * 1000:.0f} ms)"
+            )
+    for case in results["cases"]:
+        print(f"\n{case['intersections']} intersections, {case['vehicles']} vehicles")
+        for name in BENCHMARKS:
+            r = case[name]
+            print(
+                f"  {name:>16}: p50 {r['p50_us']:10.1f} us  p99 {r['p99_us']:10.1f} us  "
+                f"peak {r['peak_traced_bytes'] / 1024:8.1f} KiB"
+            )
+        print(f"  {'steps/s':>16}: {case['simulation_step']['steps_per_second']:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the agent pipeline.")
+    parser.add_argument(
+        "--intersections", type=int, nargs="+", default=list(DEFAULT_INTERSECTIONS)
+    )
+    parser.add_argument(
+        "--vehicles", type=int, nargs="+", default=list(DEFAULT_VEHICLES)
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument(
+        "--compare", metavar="BASELINE", help="Fail if p50 latencies regressed."
+    )
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.intersections, args.vehicles, args.repeat, args.steps, args.seed
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_report(results)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        for (n_intersections, n_vehicles), name, old, new, ratio in regressions:
+            print(
+                f"REGRESSION {name} ({n_intersections}x{n_vehicles}): "
+                f"p50 {old:.1f} -> {new:.1f} us ({ratio:.2f}x)"
+            )
+        misses = startup_misses(results["startup"])
+        for name, seconds, target in misses:
+            print(f"TARGET MISSED startup {name}: {seconds:.3f}s > {target:.3f}s")
+        sys.exit(1 if regressions or misses else 0)
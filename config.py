@@ -4,5 +4,123 @@ API_KEY = "YOUR_API_KEY_HERE"
 DATA_FILE = "traffic_data.csv"
 LAST_RETRAIN_FILE = "last_retrain.txt"
 
+# Historical data writer: "csv" or "binary" (fixed-width records, .bin suffix)
+HISTORY_FORMAT = "csv"
+HISTORY_FLUSH_ROWS = 500
+HISTORY_FLUSH_INTERVAL_SECONDS = 30
+HISTORY_ROTATE_BYTES = 256 * 1024 * 1024
+HISTORY_ROTATE_DAILY = True
+
 # Retraining interval
 RETRAIN_INTERVAL_SECONDS = 3600 * 24 * 14 #(2 weeks here)
+
+# Streaming retrain: history is read in chunks and fed to partial_fit
+RETRAIN_STREAMING = True
+RETRAIN_CHUNK_ROWS = 50000
+RETRAIN_EPOCHS = 1
+RETRAIN_SHUFFLE_WINDOW = 200000
+
+# Background retraining: held-out rows used to validate a new model before it
+# replaces the live one, and how many model versions are kept for rollback
+RETRAIN_HOLDOUT_FRACTION = 0.05
+RETRAIN_VALIDATION_ROWS = 20000
+RETRAIN_MAX_VERSIONS = 5
+# Failed retrains are retried after this delay, doubling per consecutive failure
+RETRAIN_RETRY_SECONDS = 300
+
+# Online congestion predictor: "numpy" or "sklearn"
+PREDICTOR_BACKEND = "numpy"
+PREDICTOR_FEATURE_SCALING = False
+
+# Per-intersection congestion models (memory-mapped weight matrix)
+PER_INTERSECTION_MODELS = True
+MODEL_REGISTRY_FILE = "intersection_models.npy"
+
+# Online model checkpoint: reloaded on start (warm start), rewritten periodically and on close
+MODEL_CHECKPOINT_FILE = "online_model.npz"
+MODEL_CHECKPOINT_INTERVAL_SECONDS = 300
+
+# TomTom flow data
+FLOW_API_URL = "https://api.tomtom.com/traffic/services/4/flowSegmentData/relative0/10/json"
+FLOW_CACHE_TTL_SECONDS = 60
+FLOW_CACHE_MAX_ENTRIES = 4096
+FLOW_REQUEST_TIMEOUT_SECONDS = 2.0
+FLOW_STEP_DEADLINE_SECONDS = 5.0
+FLOW_FETCH_WORKERS = 16
+
+# Simulation output: "console", "jsonl", "both" or "quiet"
+EVENT_SINK = "console"
+EVENT_LOG_FILE = "simulation_events.jsonl"
+EVENT_FLUSH_EVENTS = 1000
+
+# Asyncio agent runtime: messages queued per agent before publishers wait, time
+# budget of a tick (s), and per-agent (concurrent handlers, deadline per message in s)
+RUNTIME_QUEUE_SIZE = 1024
+RUNTIME_TICK_DEADLINE_SECONDS = 10.0
+RUNTIME_AGENT_LIMITS = {
+    "flow": (2, FLOW_STEP_DEADLINE_SECONDS),
+    "drone": (1, 2.0),
+    "signal": (8, 1.0),
+    "vehicle": (16, 1.0),
+    "fairness": (1, 1.0),
+}
+
+# Drone scans: simulated seconds a batched scan answers per-intersection lookups
+DRONE_SCAN_MAX_AGE_SECONDS = 10
+
+# Simulation snapshots (resume and scenario forking)
+SNAPSHOT_FILE = "simulation.snap"
+
+# Recorded flow-data traces for offline replay
+FLOW_TRACE_FILE = "flow_trace.bin"
+FLOW_TRACE_MAX_DISTANCE_METERS = 250
+FLOW_TRACE_FLUSH_ROWS = 1000
+FLOW_TRACE_FLUSH_INTERVAL_SECONDS = 30
+
+# Instrumentation (timers, counters, on-demand profiling)
+METRICS_ENABLED = False
+METRICS_SNAPSHOT_FILE = "metrics.json"
+METRICS_SNAPSHOT_INTERVAL_SECONDS = 60
+METRICS_PROFILE_DIR = "."
+
+# Fairness ranking: per-update wait decay (1.0 = none), reset on green, ranking size
+FAIRNESS_DECAY = 1.0
+FAIRNESS_RESET_ON_GREEN = False
+FAIRNESS_TOP_K = 10
+
+# Spatial index: grid cell size, snapping radius for flow keys, vehicle assignment radius
+SPATIAL_CELL_METERS = 250
+SPATIAL_SNAP_METERS = 50
+SPATIAL_ASSIGN_MAX_METERS = 500
+
+# Road-graph routing: links to the nearest intersections, free-flow speed (m/s),
+# edge cost multiplier per unit of congestion, congestion change that re-costs edges
+ROAD_LINK_METERS = 300
+ROAD_MAX_NEIGHBORS = 4
+ROUTE_FREE_FLOW_MPS = 13.9
+ROUTE_CONGESTION_PENALTY = 4.0
+ROUTE_CONGESTION_TOLERANCE = 0.05
+
+# Vehicle movement: fleet travels the road graph and queues at red approaches;
+# discharge rate of a green approach (vehicles/s), signal split until first planned
+VEHICLE_MOTION = True
+MOTION_SATURATION_FLOW = 0.5
+MOTION_DEFAULT_GREEN = 30
+
+# Adaptive flow polling: global API budget (None = unlimited), seconds of unused
+# budget that may be saved up, and the oldest a served value may get
+FLOW_ADAPTIVE_POLLING = True
+FLOW_QUOTA_PER_SECOND = 5
+FLOW_QUOTA_PER_DAY = 2500
+FLOW_QUOTA_BURST_SECONDS = 10
+# Requests spent on the current UTC day, kept across restarts
+FLOW_QUOTA_USAGE_FILE = "flow_quota_usage.txt"
+FLOW_MAX_STALENESS_SECONDS = 900
+
+# Refresh priority weights: base (round-robin by age), congestion change per
+# minute, model prediction error, relative fairness wait, active emergency
+FLOW_PRIORITY_BASE = 0.1
+FLOW_PRIORITY_CHANGE = 2.0
+FLOW_PRIORITY_ERROR = 1.0
+FLOW_PRIORITY_WAIT = 0.5
+FLOW_PRIORITY_EMERGENCY = 5.0
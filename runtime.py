@@ -0,0 +1,448 @@
+# runtime.py
+
+import asyncio
+import functools
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from agents.event_sink import StepStarted, make_sink
+from agents.flow_provider import synthetic_flow_data
+from agents.metrics import get_metrics
+from config import (
+    EVENT_SINK,
+    FLOW_FETCH_WORKERS,
+    RUNTIME_AGENT_LIMITS,
+    RUNTIME_QUEUE_SIZE,
+    RUNTIME_TICK_DEADLINE_SECONDS,
+)
+from simulation import SimulationContext
+
+# Share of a flow fetch's time left that is spent waiting on the API; points
+# still unanswered then get synthetic data, leaving the rest of the tick to
+# the agents that use them.
+FLOW_WAIT_SHARE = 0.5
+
+
+class Message:
+    """
+    Base class for messages on the MessageBus. Subclasses list their fields
+    in __slots__ and name the agent that consumes them in `topic`.
+    `deadline` (event-loop time) and `reply` (a future resolved with the
+    handler's result, or None when it was not handled) are set on publish.
+    """
+
+    __slots__ = ("deadline", "reply")
+    topic = None
+
+
+class FetchFlow(Message):
+    __slots__ = ("points",)
+    topic = "flow"
+
+    def __init__(self, points):
+        self.points = points
+
+
+class ScanIntersections(Message):
+    __slots__ = ("step",)
+    topic = "drone"
+
+    def __init__(self, step):
+        self.step = step
+
+
+class AdjustSignal(Message):
+    __slots__ = ("intersection",)
+    topic = "signal"
+
+    def __init__(self, intersection):
+        self.intersection = intersection
+
+
+class ProcessVehicle(Message):
+    __slots__ = ("row",)
+    topic = "vehicle"
+
+    def __init__(self, row):
+        self.row = row
+
+
+class UpdateFairness(Message):
+    __slots__ = ()
+    topic = "fairness"
+
+
+class MessageBus:
+    def __init__(self, maxsize=RUNTIME_QUEUE_SIZE):
+        """
+        In-process bus with one bounded queue per topic. Publishing to a
+        full queue waits until the consuming agent catches up, so a slow
+        agent pushes back on its producers instead of growing memory.
+        """
+        self.maxsize = maxsize
+        self.queues = {}  # topic -> asyncio.Queue
+
+    def subscribe(self, topic):
+        queue = self.queues.get(topic)
+        if queue is None:
+            queue = self.queues[topic] = asyncio.Queue(self.maxsize)
+        return queue
+
+    async def publish(self, message, deadline):
+        """
+        Queue `message` for its topic's agent, waiting while the queue is
+        full. Returns the future its reply arrives on.
+        """
+        queue = self.queues.get(message.topic)
+        if queue is None:
+            raise ValueError(f"No agent consumes {message.topic!r} messages.")
+        message.deadline = deadline
+        message.reply = asyncio.get_running_loop().create_future()
+        await queue.put(message)
+        return message.reply
+
+
+class AgentWorker:
+    def __init__(self, name, handler, bus, concurrency=1, deadline=None):
+        """
+        Runs `handler` (a coroutine function taking a Message) for every
+        message on the `name` topic, at most `concurrency` at a time.
+
+        A message is given until the earlier of its own deadline and
+        `deadline` seconds; one that times out, or is still queued when its
+        deadline passes, is answered with None. Deadlines take effect at
+        the handler's await points (e.g. I/O run in a thread): CPU work
+        runs to completion, but the messages behind it are shed, so a slow
+        agent loses work for the tick instead of stalling it.
+        """
+        self.name = name
+        self.handler = handler
+        self.queue = bus.subscribe(name)
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.handled = 0
+        self.timed_out = 0
+        self.expired = 0
+        self.failed = 0
+        self.max_depth = 0
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._run(), name=f"{self.name}-{i}")
+            for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        metrics = get_metrics()
+        while True:
+            message = await self.queue.get()
+            self.max_depth = max(self.max_depth, self.queue.qsize() + 1)
+            result = None
+            try:
+                remaining = message.deadline - loop.time()
+                if self.deadline is not None:
+                    remaining = min(remaining, self.deadline)
+                if remaining <= 0:
+                    self.expired += 1
+                    metrics.count(f"runtime.{self.name}.expired")
+                else:
+                    with metrics.timer(f"runtime.{self.name}"):
+                        result = await asyncio.wait_for(
+                            self.handler(message), remaining
+                        )
+                    self.handled += 1
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                metrics.count(f"runtime.{self.name}.timed_out")
+            except Exception as e:
+                self.failed += 1
+                print(f"Error in {self.name} agent:", e)
+            finally:
+                if not message.reply.done():
+                    message.reply.set_result(result)
+                self.queue.task_done()
+
+    def stats(self):
+        return {
+            "handled": self.handled,
+            "timed_out": self.timed_out,
+            "expired": self.expired,
+            "failed": self.failed,
+            "max_depth": self.max_depth,
+        }
+
+
+class AgentRuntime:
+    def __init__(
+        self,
+        ctx,
+        queue_size=RUNTIME_QUEUE_SIZE,
+        tick_deadline=RUNTIME_TICK_DEADLINE_SECONDS,
+        limits=None,
+        io_workers=FLOW_FETCH_WORKERS,
+    ):
+        """
+        Asyncio counterpart of SimulationContext.run_step: the flow, drone,
+        signal, vehicle and fairness agents are coroutines consuming
+        messages from a bounded MessageBus.
+
+        Each tick fetches intersection and vehicle flow data in worker
+        threads while the drone scan runs; signals are planned as soon as
+        the intersection data is in, overlapping the vehicle fetch, and
+        agents that miss data fetch their own point in a thread. Every
+        message of a tick shares the tick's deadline: work still queued
+        when it passes is dropped (signals keep their last state, vehicles
+        wait for the next tick) and counted in stats().
+
+        Parameters:
+            ctx (SimulationContext): Agents and shared state.
+            queue_size (int): Messages queued per agent before publishers wait.
+            tick_deadline (float): Seconds a tick may take.
+            limits (dict): Agent name -> (concurrent handlers, per-message
+                deadline in seconds); defaults to RUNTIME_AGENT_LIMITS.
+            io_workers (int): Threads for blocking flow-data calls.
+        """
+        self.ctx = ctx
+        self.tick_deadline = tick_deadline
+        self.bus = MessageBus(queue_size)
+        limits = {**RUNTIME_AGENT_LIMITS, **(limits or {})}
+        handlers = {
+            "flow": self._fetch_flow,
+            "drone": self._scan,
+            "signal": self._adjust_signal,
+            "vehicle": self._process_vehicle,
+            "fairness": self._update_fairness,
+        }
+        self.agents = {
+            name: AgentWorker(name, handler, self.bus, *limits[name])
+            for name, handler in handlers.items()
+        }
+        self.io_workers = io_workers
+        self._executor = None
+        self.late_ticks = 0
+
+    async def __aenter__(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.io_workers, thread_name_prefix="runtime-io"
+        )
+        for agent in self.agents.values():
+            agent.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for agent in self.agents.values():
+            await agent.stop()
+        # Abandoned fetches may still be running; don't wait for them.
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, fn, *args
+        )
+
+    async def _flow_data_at(self, point):
+        """
+        Flow data for a point from the tick's fetches, or fetched in a
+        worker thread when it is missing. A failed fetch's synthetic data is
+        drawn here on the loop thread, so a seeded provider `rng` is never
+        used off-thread.
+        """
+        ctx = self.ctx
+        flow_data = ctx.step_flow.get(point)
+        if flow_data is None:
+            provider = ctx.flow_provider
+            fetched = await self._blocking(
+                functools.partial(provider.fetch_many, fallback=False), [point]
+            )
+            flow_data = fetched[point]
+            if flow_data is None:
+                flow_data = synthetic_flow_data(
+                    getattr(provider, "rng", None) or random
+                )
+            ctx.step_flow[point] = flow_data
+        return flow_data
+
+    async def _fetch_flow(self, message):
+        remaining = message.deadline - asyncio.get_running_loop().time()
+        limit = self.agents["flow"].deadline
+        if limit is not None:
+            remaining = min(remaining, limit)
+        return await self._blocking(
+            self.ctx.flow_provider.fetch_many,
+            message.points,
+            remaining * FLOW_WAIT_SHARE,
+        )
+
+    async def _scan(self, message):
+        ctx = self.ctx
+        ctx.drone_agent.scan_all(ctx.intersections, ctx.now)
+        for intersection in ctx.intersections:
+            ctx.scan_intersection(intersection)
+
+    async def _adjust_signal(self, message):
+        ctx = self.ctx
+        await self._flow_data_at(ctx.intersections[message.intersection])
+        return ctx.adjust_intersection(message.intersection, current_time=ctx.now)
+
+    async def _process_vehicle(self, message):
+        ctx = self.ctx
+        vehicle = ctx.vehicles[message.row]
+        await self._flow_data_at(ctx.vehicle_segment(vehicle))
+        ctx.process_vehicle(vehicle)
+
+    async def _update_fairness(self, message):
+        plan = self.ctx.update_fairness()
+        self.ctx.update_flow_priorities()
+        return plan
+
+    async def _publish_all(self, messages, deadline):
+        return [await self.bus.publish(message, deadline) for message in messages]
+
+    async def run_step(self, step):
+        """
+        One tick at simulated time step * 10; returns the fairness plan, or
+        None when the tick ran out of time before fairness was updated.
+        """
+        ctx = self.ctx
+        ctx.step = step
+        ctx.now = step * 10
+        sink = ctx.sink
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.tick_deadline
+        publish = self.bus.publish
+        if sink.enabled:
+            sink.emit(StepStarted(step, ctx.now))
+
+        # 1. Flow data for intersections and vehicle segments, and the drone
+        # scan, all at once.
+        n = len(ctx.vehicles)
+        ctx.vehicle_segments = ctx.segment_index.segment_keys(
+            ctx.vehicles.lat[:n], ctx.vehicles.lon[:n]
+        )
+        ctx.step_flow = {}
+        intersection_flow = await publish(
+            FetchFlow(list(ctx.intersections.values())), deadline
+        )
+        vehicle_flow = await publish(FetchFlow(ctx.vehicle_segments), deadline)
+        scan = await publish(ScanIntersections(step), deadline)
+
+        # 2. Signals, once their flow data is in.
+        ctx.step_flow.update(await intersection_flow or {})
+        signals = await self._publish_all(
+            (AdjustSignal(name) for name in ctx.intersections), deadline
+        )
+        await asyncio.gather(scan, *signals)
+        ctx.road_graph.update_congestion(ctx.traffic_conditions)
+
+        # 3. Move and route the fleet, then process every vehicle.
+        ctx.move_fleet()
+        ctx.routing_agent.route_fleet(ctx.vehicles)
+        ctx.step_flow.update(await vehicle_flow or {})
+        vehicles = await self._publish_all(
+            (ProcessVehicle(row) for row in range(n)), deadline
+        )
+        await asyncio.gather(*vehicles)
+
+        # 4. Fairness.
+        plan = await (await publish(UpdateFairness(), deadline))
+        if loop.time() > deadline:
+            self.late_ticks += 1
+        sink.flush()
+        return plan
+
+    def stats(self):
+        stats = {name: agent.stats() for name, agent in self.agents.items()}
+        stats["late_ticks"] = self.late_ticks
+        return stats
+
+
+async def run_agents(
+    steps=5,
+    scenario="rush_hour",
+    step_delay=1.0,
+    seed=None,
+    sink=None,
+    flow_provider=None,
+    **runtime_options,
+):
+    """
+    simulation_loop on the AgentRuntime: `steps` ticks `step_delay`
+    seconds apart. Returns the runtime's stats.
+    """
+    rng = random.Random(seed) if seed is not None else None
+    ctx = SimulationContext(scenario, rng=rng, sink=sink, flow_provider=flow_provider)
+    try:
+        async with AgentRuntime(ctx, **runtime_options) as runtime:
+            for step in range(1, steps + 1):
+                await runtime.run_step(step)
+                if step_delay:
+                    await asyncio.sleep(step_delay)
+    finally:
+        ctx.close()
+    return runtime.stats()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from agents.flow_provider import FlowDataProvider
+    from stub_flow_server import StubFlowServer
+
+    parser = argparse.ArgumentParser(
+        description="Run the simulation on the asyncio agent runtime."
+    )
+    parser.add_argument("--scenario", default="rush_hour")
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--step-delay", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--output",
+        choices=("console", "jsonl", "both", "quiet"),
+        default=EVENT_SINK,
+        help="Where simulation events go.",
+    )
+    parser.add_argument(
+        "--tick-deadline", type=float, default=RUNTIME_TICK_DEADLINE_SECONDS
+    )
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        help="Serve flow data from a local stub of the TomTom endpoint.",
+    )
+    parser.add_argument(
+        "--stub-latency",
+        type=float,
+        default=0.0,
+        help="Seconds the stub waits before answering each request.",
+    )
+    args = parser.parse_args()
+
+    server = provider = None
+    if args.stub:
+        server = StubFlowServer(latency=args.stub_latency).start()
+        provider = FlowDataProvider(url=server.url, api_key="stub")
+    try:
+        stats = asyncio.run(
+            run_agents(
+                args.steps,
+                args.scenario,
+                step_delay=args.step_delay,
+                seed=args.seed,
+                sink=make_sink(args.output, flush_lines=1000),
+                flow_provider=provider,
+                tick_deadline=args.tick_deadline,
+            )
+        )
+    finally:
+        if server is not None:
+            server.stop()
+    print(json.dumps(stats, indent=2))
@@ -0,0 +1,127 @@
+# scheduler.py
+
+import heapq
+import itertools
+import random
+import time
+
+import numpy as np
+
+# Event kinds used by the event-driven simulation.
+SIGNAL_PHASE = "signal_phase"
+DRONE_SCAN = "drone_scan"
+VEHICLE_ARRIVAL = "vehicle_arrival"
+RETRAIN_CHECK = "retrain_check"
+FAIRNESS_UPDATE = "fairness_update"
+
+
+class Event:
+    __slots__ = ("time", "seq", "kind", "callback", "payload", "cancelled")
+
+    def __init__(self, time, seq, kind, callback, payload=None):
+        self.time = time
+        self.seq = seq
+        self.kind = kind
+        self.callback = callback
+        self.payload = payload
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.time, self.seq) < (other.time, other.seq)
+
+    def __repr__(self):
+        return f"Event({self.time!r}, {self.kind!r}, {self.payload!r})"
+
+
+class EventScheduler:
+    def __init__(self, start_time=0.0, realtime=False, speed=1.0, seed=None):
+        """
+        Discrete-event scheduler over simulated seconds.
+
+        Events are kept in a priority queue ordered by (time, insertion
+        order) and each callback receives (scheduler, event). In headless
+        mode (the default) simulated time jumps straight to the next event;
+        with `realtime` the run is paced so one simulated second takes
+        1 / `speed` wall-clock seconds.
+
+        `rng` (random.Random) and `np_rng` (numpy Generator) are seeded from
+        `seed` so runs that draw all randomness from them are reproducible.
+        """
+        self.now = start_time
+        self.realtime = realtime
+        self.speed = speed
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.np_rng = np.random.default_rng(seed)
+        self.processed = 0
+        self._queue = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def schedule(self, at, kind, callback, payload=None):
+        """
+        Schedule `callback` at absolute simulated time `at`.
+        """
+        if at < self.now:
+            raise ValueError(f"Cannot schedule {kind} in the past ({at} < {self.now}).")
+        event = Event(at, next(self._seq), kind, callback, payload)
+        heapq.heappush(self._queue, event)
+        return event
+
+    def schedule_in(self, delay, kind, callback, payload=None):
+        return self.schedule(self.now + delay, kind, callback, payload)
+
+    def every(self, interval, kind, callback, payload=None, start=None):
+        """
+        Run `callback` every `interval` simulated seconds, first at `start`
+        (default: now). Returns the first event; cancelling the event that
+        is currently pending stops the series.
+        """
+
+        def tick(scheduler, event):
+            callback(scheduler, event)
+            if not event.cancelled:
+                scheduler.schedule(event.time + interval, kind, tick, payload)
+
+        return self.schedule(self.now if start is None else start, kind, tick, payload)
+
+    def cancel(self, event):
+        event.cancelled = True
+
+    def peek_time(self):
+        while self._queue and self._queue[0].cancelled:
+            heapq.heappop(self._queue)
+        return self._queue[0].time if self._queue else None
+
+    def run(self, until=None, max_events=None):
+        """
+        Process events in time order until the queue is empty, the next
+        event is later than `until`, or `max_events` have run. Returns the
+        number of events processed in this call.
+        """
+        processed = 0
+        wall_start = time.perf_counter()
+        sim_start = self.now
+        while self._queue:
+            if max_events is not None and processed >= max_events:
+                break
+            event = heapq.heappop(self._queue)
+            if event.cancelled:
+                continue
+            if until is not None and event.time > until:
+                heapq.heappush(self._queue, event)
+                break
+            if self.realtime:
+                delay = wall_start + (event.time - sim_start) / self.speed
+                delay -= time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.now = event.time
+            event.callback(self, event)
+            processed += 1
+        if until is not None and until > self.now:
+            self.now = until
+        self.processed += processed
+        return processed
@@ -0,0 +1,616 @@
+# sharding.py
+
+import math
+import multiprocessing
+import os
+import random
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from agents.drone_agent import DroneAgent
+from agents.event_sink import (
+    DroneEmergency,
+    FairnessRanking,
+    FlowCacheStats,
+    IncidentEvent,
+    ModeChange,
+    RouteDecision,
+    SignalOverride,
+    SignalStateEvent,
+    SimulationStarted,
+    StepStarted,
+    VehicleStatus,
+    VehicleUpdate,
+    make_sink,
+)
+from agents.fairness_agent import FairnessAgent
+from agents.flow_provider import FlowDataProvider
+from agents.flow_scheduler import AdaptiveFlowProvider, RequestBudget
+from agents.history_writer import HistoryWriter
+from agents.incident_agent import IncidentAgent
+from agents.model_registry import IntersectionModelRegistry
+from agents.road_graph import NO_NODE, RoadGraph
+from agents.routing_agent import RoutingAgent
+from agents.signal_timing import DIRECTIONS, GREEN, SignalState
+from agents.smart_vehicle_agent import SmartVehicleAgent
+from agents.spatial_index import SpatialIndex
+from agents.traffic_signal_agent import TrafficSignalAgent
+from agents.vehicle_fleet import VehicleMode
+from agents.vehicle_motion import VehicleMotion
+from config import (
+    DATA_FILE,
+    FAIRNESS_TOP_K,
+    FLOW_ADAPTIVE_POLLING,
+    FLOW_QUOTA_USAGE_FILE,
+    MODEL_CHECKPOINT_FILE,
+    MODEL_REGISTRY_FILE,
+    PER_INTERSECTION_MODELS,
+    VEHICLE_MOTION,
+)
+import simulation
+from simulation import DESTINATIONS, INTERSECTIONS, generate_scenario
+
+NO_DIRECTION = -1
+
+# One row per intersection in the shared step table. Workers fill their own
+# slice each step; the coordinator reads every row and writes overrides.
+SHARD_DTYPE = np.dtype(
+    [
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+        ("current_speed", "<f8"),
+        ("free_flow_speed", "<f8"),
+        ("congestion", "<f8"),
+        ("predicted", "<f8"),
+        ("weighted", "<f8"),
+        ("ns_green", "<i8"),
+        ("ew_green", "<i8"),
+        ("ns_color", "i1"),
+        ("ns_time_remaining", "<i8"),
+        ("ns_next_color", "i1"),
+        ("ew_color", "i1"),
+        ("ew_time_remaining", "<i8"),
+        ("ew_next_color", "i1"),
+        ("condition", "<f8"),  # drone/scenario congestion used for fairness
+        ("emergency", "?"),
+        ("approach", "i1"),  # drone-detected approach, index into DIRECTIONS
+        ("override", "i1"),  # emergency green direction or NO_DIRECTION
+    ]
+)
+SIGNAL_FIELDS = (
+    ("current_congestion", "congestion"),
+    ("predicted_congestion", "predicted"),
+    ("weighted_congestion", "weighted"),
+    ("ns_green", "ns_green"),
+    ("ew_green", "ew_green"),
+    ("ns_color", "ns_color"),
+    ("ns_time_remaining", "ns_time_remaining"),
+    ("ns_next_color", "ns_next_color"),
+    ("ew_color", "ew_color"),
+    ("ew_time_remaining", "ew_time_remaining"),
+    ("ew_next_color", "ew_next_color"),
+)
+
+
+def shard_path(path, shard):
+    """
+    Per-shard variant of a data file, e.g. traffic_data.shard3.csv.
+    """
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard{shard}{ext}"
+
+
+def partition(n_items, n_shards):
+    """
+    (start, stop) bounds of n_shards contiguous, near-equal partitions.
+    """
+    bounds = np.linspace(0, n_items, n_shards + 1).astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _shard_worker(
+    conn,
+    shm_name,
+    size,
+    start,
+    stop,
+    names,
+    shard,
+    shards,
+    scenario,
+    seed,
+    provider_factory,
+):
+    """
+    Worker process: owns the TrafficSignalAgent, flow provider and drone
+    for intersections [start, stop) and fills their rows of the shared
+    table on every ("step", current_time) message. A live flow provider
+    polls adaptively on 1 / `shards` of the API budget.
+    """
+    shm = SharedMemory(name=shm_name)
+    table = np.ndarray(size, dtype=SHARD_DTYPE, buffer=shm.buf)
+    rows = table[start:stop]
+    rng = random.Random(seed)
+    if provider_factory:
+        flow_provider = provider_factory()
+    else:
+        flow_provider = FlowDataProvider(rng=rng)
+        if FLOW_ADAPTIVE_POLLING:
+            budget = RequestBudget().split(
+                shards, shard_path(FLOW_QUOTA_USAGE_FILE, shard)
+            )
+            flow_provider = AdaptiveFlowProvider(flow_provider, budget)
+    # Seeded runs neither resume nor overwrite the shard's persisted models.
+    persist = seed is None
+    registry = None
+    if PER_INTERSECTION_MODELS:
+        registry = IntersectionModelRegistry(
+            shard_path(MODEL_REGISTRY_FILE, shard) if persist else None
+        )
+    agent = TrafficSignalAgent(
+        flow_provider,
+        history_writer=HistoryWriter(shard_path(DATA_FILE, shard)),
+        model_registry=registry,
+        checkpoint_path=shard_path(MODEL_CHECKPOINT_FILE, shard) if persist else None,
+        warm_start=persist,
+    )
+    # Shard histories only cover part of the network; retraining stays with
+    # the unsharded agent.
+    agent.retrain_scheduler.next_retrain_ts = math.inf
+    drone = DroneAgent(rng)
+    base = generate_scenario(scenario)
+    base_conditions = np.array([base.get(name, 0.3) for name in names])
+    points = list(zip(rows["lat"].tolist(), rows["lon"].tolist()))
+    point_array = np.column_stack((rows["lat"], rows["lon"]))
+    conn.send(("ready", shard))
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == "close":
+                break
+            try:
+                current_time = message[1]
+                flows = flow_provider.fetch_many(points)
+                current_speeds = np.array(
+                    [flows[point].get("currentSpeed", 0) for point in points],
+                    dtype=float,
+                )
+                free_flow_speeds = np.array(
+                    [flows[point].get("freeFlowSpeed", 0) for point in points],
+                    dtype=float,
+                )
+                batch = agent.adjust_signals_batch(
+                    current_speeds,
+                    free_flow_speeds,
+                    current_time,
+                    intersection_ids=names,
+                    points=point_array,
+                )
+                rows["current_speed"] = current_speeds
+                rows["free_flow_speed"] = free_flow_speeds
+                for attribute, field in SIGNAL_FIELDS:
+                    rows[field] = getattr(batch, attribute)
+
+                scan = drone.scan_all(names, current_time)
+                rows["emergency"] = scan.emergency
+                rows["approach"] = scan.approach
+                rows["condition"] = np.where(scan.emergency, 1.0, base_conditions)
+                rows["override"] = NO_DIRECTION
+                conn.send(("done", flow_provider.stats()))
+            except Exception:
+                conn.send(("error", traceback.format_exc()))
+    finally:
+        agent.close()
+        flow_provider.close()
+        del rows, table
+        shm.close()
+
+
+class ShardedSimulation:
+    def __init__(
+        self,
+        intersections=None,
+        vehicles=None,
+        scenario="rush_hour",
+        workers=None,
+        seed=None,
+        sink=None,
+        provider_factory=None,
+        vehicle_motion=VEHICLE_MOTION,
+    ):
+        """
+        Fixed-step simulation with intersections partitioned across worker
+        processes.
+
+        Each worker owns a TrafficSignalAgent (with per-shard history,
+        checkpoint and model files), a flow provider and a DroneAgent for its
+        partition, and writes speeds, congestion, signal phases and drone
+        results into a shared-memory table. The coordinator only exchanges
+        one small message per worker per step; it then processes the
+        vehicle fleet with array operations, applies emergency overrides
+        and incident bumps, and merges the wait-time deltas into its
+        FairnessAgent.
+
+        Parameters:
+            intersections (dict): name -> (lat, lon); defaults to INTERSECTIONS.
+            vehicles (VehicleFleet): Moved in place; defaults to a copy of the
+                sample fleet in simulation.py.
+            scenario (str): Scenario passed to generate_scenario.
+            workers (int): Worker processes (default: one per CPU, at most one
+                per intersection). Live workers split the FLOW_QUOTA_* budget
+                evenly.
+            seed (int): Seeds each worker's drone and synthetic flow data.
+            sink (EventSink): Output events; defaults to a buffered console sink.
+            provider_factory (callable): Picklable zero-argument callable building
+                each worker's flow provider, e.g. StubFlowProvider.
+            vehicle_motion (bool): Move the fleet under the shards' signal
+                plans and rank fairness by the time vehicles waited.
+        """
+        if intersections is None:
+            intersections = INTERSECTIONS
+        if vehicles is None:
+            vehicles = simulation.vehicles.copy()
+        self.names = list(intersections)
+        self.vehicles = vehicles
+        vehicles.assign_intersections(SpatialIndex.from_points(intersections))
+        self.scenario = scenario
+        self.sink = make_sink(flush_lines=1000) if sink is None else sink
+        self.fairness_agent = FairnessAgent()
+        self._fairness_rows = self.fairness_agent.rows(self.names)
+        self._ns_green = np.zeros(len(self.names), dtype=bool)
+        self.smart_vehicle_agent = SmartVehicleAgent(self.sink)
+        self.road_graph = RoadGraph.from_intersections(intersections)
+        self.routing_agent = RoutingAgent(
+            road_graph=self.road_graph, destinations=DESTINATIONS
+        )
+        self.incident_agent = IncidentAgent()
+        self.motion = (
+            VehicleMotion(vehicles, self.routing_agent) if vehicle_motion else None
+        )
+        self.flow_stats = {"hits": 0, "misses": 0}
+        self._row_of = {name: row for row, name in enumerate(self.names)}
+
+        size = len(self.names)
+        workers = max(1, min(workers or os.cpu_count() or 1, size))
+        self._shm = SharedMemory(create=True, size=max(size * SHARD_DTYPE.itemsize, 1))
+        self.table = np.ndarray(size, dtype=SHARD_DTYPE, buffer=self._shm.buf)
+        self.table[:] = np.zeros(size, dtype=SHARD_DTYPE)
+        coords = np.array([intersections[name] for name in self.names], dtype=float)
+        self.table["lat"] = coords[:, 0]
+        self.table["lon"] = coords[:, 1]
+        self.table["override"] = NO_DIRECTION
+
+        context = multiprocessing.get_context("spawn")
+        self._connections = []
+        self._processes = []
+        for shard, (start, stop) in enumerate(partition(size, workers)):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_shard_worker,
+                args=(
+                    child,
+                    self._shm.name,
+                    size,
+                    start,
+                    stop,
+                    self.names[start:stop],
+                    shard,
+                    workers,
+                    scenario,
+                    None if seed is None else seed + shard,
+                    provider_factory,
+                ),
+                name=f"shard-{shard}",
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+        self._gather("ready")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def workers(self):
+        return len(self._processes)
+
+    def _gather(self, expected):
+        replies = []
+        for conn in self._connections:
+            kind, payload = conn.recv()
+            if kind == "error":
+                raise RuntimeError(f"Shard worker failed:\n{payload}")
+            if kind != expected:
+                raise RuntimeError(f"Unexpected shard reply: {kind}")
+            replies.append(payload)
+        return replies
+
+    def state(self, row):
+        """
+        Signal state of one intersection: a SignalState, or the per-direction
+        dict of an emergency override.
+        """
+        record = self.table[row]
+        override = int(record["override"])
+        if override != NO_DIRECTION:
+            return _override_state(DIRECTIONS[override])
+        return SignalState(
+            int(record["ns_color"]),
+            int(record["ns_time_remaining"]),
+            int(record["ns_next_color"]),
+            int(record["ew_color"]),
+            int(record["ew_time_remaining"]),
+            int(record["ew_next_color"]),
+        )
+
+    def step(self, step):
+        """
+        Run one simulation step at simulated time step * 10 and return the
+        fairness ranking.
+        """
+        current_time = step * 10
+        sink = self.sink
+        for conn in self._connections:
+            conn.send(("step", current_time))
+        stats = self._gather("done")
+        self.flow_stats["hits"] = sum(s["hits"] for s in stats)
+        self.flow_stats["misses"] = sum(s["misses"] for s in stats)
+
+        table = self.table
+        if sink.enabled:
+            sink.emit(StepStarted(step, current_time))
+            for row, name in enumerate(self.names):
+                sink.emit(SignalStateEvent(name, self.state(row), current_time))
+                if table["emergency"][row]:
+                    sink.emit(DroneEmergency(name, current_time))
+
+        self.road_graph.update_congestion(table["condition"])
+        if self.motion is not None:
+            self.motion.set_plans(table["ns_green"], table["ew_green"])
+            self.motion.advance(current_time)
+        self._process_vehicles(current_time)
+
+        fairness_agent = self.fairness_agent
+        if fairness_agent.reset_on_green:
+            ns_green = (table["ns_color"] == GREEN) & (
+                table["override"] == NO_DIRECTION
+            )
+            fairness_agent.reset_many(self._fairness_rows[ns_green & ~self._ns_green])
+            self._ns_green = ns_green
+        fairness_agent.decay()
+        fairness_agent.update_many(
+            self._fairness_rows,
+            (
+                table["condition"] * 10
+                if self.motion is None
+                else self.motion.take_waits()
+            ),
+        )
+        fairness_plan = fairness_agent.get_fair_signal_plan(FAIRNESS_TOP_K)
+        if sink.enabled:
+            sink.emit(FairnessRanking(fairness_plan, current_time))
+        sink.flush()
+        return fairness_plan
+
+    def _process_vehicles(self, current_time):
+        """
+        Vectorized counterpart of SimulationContext.process_vehicle for the
+        whole fleet. Vehicles are routed in batches per destination; the
+        speed-based routing fallback and incident checks use the flow data
+        of each vehicle's intersection.
+        """
+        fleet = self.vehicles
+        table = self.table
+        n = len(fleet)
+        if not n:
+            return
+        codes = fleet.intersection[:n]
+        code_rows = np.array(
+            [self._row_of.get(name, -1) for name in fleet.intersections] + [-1],
+            dtype=np.intp,
+        )
+        rows = code_rows[codes]  # NO_INTERSECTION (-1) picks the trailing -1
+        known = rows >= 0
+        waits = fleet.intersection_waits(self.fairness_agent.wait_times)
+        modes = fleet.mode[:n]
+
+        emergency = (modes == VehicleMode.EMERGENCY) & known
+        eco = (modes != VehicleMode.EMERGENCY) & (waits > 50)
+        override_rows = rows[emergency]
+        table["override"][override_rows] = table["approach"][override_rows]
+
+        speeds = np.full(n, np.inf)
+        speeds[known] = table["current_speed"][rows[known]]
+        incident = self.incident_agent.detect_incidents(speeds)
+        incident_rows = rows[incident]
+        table["condition"][incident_rows] = self.incident_agent.incident_conditions(
+            table["condition"][incident_rows]
+        )
+
+        next_hops, travel_times = self.routing_agent.route_fleet(fleet)
+
+        sink = self.sink
+        if sink.enabled:
+            self._emit_vehicle_events(
+                current_time,
+                rows,
+                waits,
+                emergency,
+                eco,
+                speeds,
+                incident,
+                next_hops,
+                travel_times,
+            )
+        fleet.set_modes(np.flatnonzero(eco), VehicleMode.ECO)
+        if sink.enabled:
+            for row in np.flatnonzero(eco).tolist():
+                vehicle = fleet[row]
+                sink.emit(
+                    ModeChange(
+                        vehicle.id, vehicle.mode, vehicle.smart_vehicle, current_time
+                    )
+                )
+
+    def _emit_vehicle_events(
+        self,
+        current_time,
+        rows,
+        waits,
+        emergency,
+        eco,
+        speeds,
+        incident,
+        next_hops,
+        travel_times,
+    ):
+        sink = self.sink
+        graph_names = self.road_graph.names
+        for i, vehicle in enumerate(self.vehicles):
+            intersection = vehicle.intersection
+            wait = waits[i].item()
+            sink.emit(
+                VehicleStatus(
+                    vehicle.id,
+                    self.smart_vehicle_agent.communicate(vehicle),
+                    intersection,
+                    wait,
+                    current_time,
+                )
+            )
+            if eco[i]:
+                message = f"High wait time ({wait}s) at {intersection}. Switching to eco-mode for efficiency."
+            elif emergency[i]:
+                direction = DIRECTIONS[self.table["approach"][rows[i]]]
+                message = f"Emergency override active. Your approach from {direction} is prioritized with green light."
+            else:
+                message = "No changes. Continue on current path."
+            sink.emit(VehicleUpdate(vehicle.id, message, current_time))
+            if emergency[i]:
+                sink.emit(
+                    SignalOverride(
+                        intersection,
+                        direction,
+                        _override_state(direction),
+                        current_time,
+                    )
+                )
+            if travel_times[i] != np.inf:
+                next_hop = next_hops[i]
+                route = self.routing_agent.route_message(
+                    vehicle.id,
+                    vehicle.destination,
+                    None if next_hop == NO_NODE else graph_names[next_hop],
+                    travel_times[i].item(),
+                )
+            else:
+                route = self.routing_agent.speed_route(vehicle.id, speeds[i])
+            sink.emit(RouteDecision(vehicle.id, route, current_time))
+            if incident[i]:
+                sink.emit(IncidentEvent(vehicle.id, intersection, current_time))
+
+    def run(self, steps=5):
+        if self.sink.enabled:
+            self.sink.emit(SimulationStarted(self.scenario))
+        for step in range(1, steps + 1):
+            self.step(step)
+
+    def close(self):
+        if self._shm is None:
+            return
+        for conn in self._connections:
+            try:
+                conn.send(("close",))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._connections:
+            conn.close()
+        if self.sink.enabled:
+            self.sink.emit(
+                FlowCacheStats(self.flow_stats["hits"], self.flow_stats["misses"])
+            )
+        self.sink.close()
+        del self.table
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+
+def _override_state(direction):
+    """
+    Per-direction signal dict giving `direction` a 30 s green and holding
+    every other approach at red, as in the unsharded emergency override.
+    """
+    state = {}
+    for d in DIRECTIONS:
+        if d == direction:
+            state[d] = {
+                "current_color": "GREEN",
+                "time_remaining": 30,
+                "next_color": "YELLOW",
+                "movements": {"left": "GREEN", "straight": "GREEN", "right": "GREEN"},
+            }
+        else:
+            state[d] = {
+                "current_color": "RED",
+                "time_remaining": 30,
+                "next_color": "GREEN",
+                "movements": {"left": "RED", "straight": "RED", "right": "RED"},
+            }
+    return state
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from benchmark import make_fleet, make_grid
+    from stub_flow_server import StubFlowProvider
+
+    parser = argparse.ArgumentParser(description="Run the sharded simulation.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--scenario", default="rush_hour")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--grid",
+        type=int,
+        default=None,
+        help="Use a synthetic grid of this many intersections with stub flow data.",
+    )
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--output", default="console", choices=("console", "quiet"))
+    args = parser.parse_args()
+
+    intersections = vehicles = provider_factory = None
+    if args.grid:
+        intersections = make_grid(args.grid)
+        vehicles = make_fleet(args.vehicles, intersections, args.seed or 0)
+        provider_factory = StubFlowProvider
+    with ShardedSimulation(
+        intersections,
+        vehicles,
+        args.scenario,
+        workers=args.workers,
+        seed=args.seed,
+        sink=make_sink(args.output, flush_lines=1000),
+        provider_factory=provider_factory,
+    ) as sim:
+        started = time.perf_counter()
+        sim.run(args.steps)
+        elapsed = time.perf_counter() - started
+    print(
+        f"{args.steps} steps on {sim.workers} workers in {elapsed:.2f}s "
+        f"({args.steps / elapsed:.2f} steps/s)"
+    )
@@ -1,27 +1,67 @@
 # simulation.py
 
+import math
+import random
+import signal
 import time
 import json
-from agents.traffic_signal_agent import TrafficSignalAgent
+
+import numpy as np
+
+from agents.flow_provider import FlowDataProvider
+from agents.flow_scheduler import AdaptiveFlowProvider
+from agents.flow_trace import FlowReplayProvider, FlowTraceWriter
+from agents.traffic_signal_agent import TrafficSignalAgent, intersection_key
+from agents.road_graph import RoadGraph
 from agents.routing_agent import RoutingAgent
 from agents.incident_agent import IncidentAgent
+from agents.metrics import MetricsServer, SnapshotExporter, get_metrics
 from agents.fairness_agent import FairnessAgent
+from agents.history_writer import NullHistoryWriter
+from agents.model_registry import IntersectionModelRegistry
 from agents.smart_vehicle_agent import SmartVehicleAgent
+from agents.spatial_index import SpatialIndex
 from agents.drone_agent import DroneAgent
+from agents.event_sink import (
+    DroneEmergency,
+    FairnessRanking,
+    FlowCacheStats,
+    IncidentEvent,
+    RouteDecision,
+    SignalOverride,
+    SignalStateEvent,
+    SimulationStarted,
+    StepStarted,
+    VehicleStatus,
+    make_sink,
+)
 from agents.vehicle import Vehicle
-
-# ANSI escape sequences for colored terminal output
-ANSI_RESET = "\033[0m"
-ANSI_GREEN = "\033[92m"
-ANSI_YELLOW = "\033[93m"
-ANSI_RED = "\033[91m"
-ANSI_BLUE = "\033[94m"
-ANSI_CYAN = "\033[96m"
-ANSI_MAGENTA = "\033[95m"
-
-
-def color_text(text, color):
-    return f"{color}{text}{ANSI_RESET}"
+from agents.vehicle_fleet import VehicleFleet, VehicleMode
+from agents.vehicle_motion import VehicleMotion
+from config import (
+    EVENT_LOG_FILE,
+    EVENT_SINK,
+    FAIRNESS_TOP_K,
+    FLOW_ADAPTIVE_POLLING,
+    METRICS_SNAPSHOT_FILE,
+    PER_INTERSECTION_MODELS,
+    VEHICLE_MOTION,
+)
+from snapshot import (
+    SnapshotReader,
+    SnapshotWriter,
+    restore_state,
+    snapshot_fleet,
+    snapshot_intersections,
+)
+from scheduler import (
+    DRONE_SCAN,
+    FAIRNESS_UPDATE,
+    RETRAIN_CHECK,
+    SIGNAL_PHASE,
+    VEHICLE_ARRIVAL,
+    EventScheduler,
+)
 
 
 def generate_scenario(scenario_type):
@@ -40,189 +80,741 @@ INTERSECTIONS = {
     "3rd_Street": (37.7755, -122.4170),
 }
 
-# Create sample vehicles as Vehicle objects.
-vehicles = [
-    Vehicle(
-        "V1",
-        (37.7749, -122.4194),
-        "Downtown",
-        smart_vehicle=True,
-        mode="autonomous",
-        intersection="1st_Street",
-    ),
-    Vehicle(
-        "V2",
-        (37.7755, -122.4180),
-        "Airport",
-        smart_vehicle=True,
-        mode="emergency",
-        intersection="2nd_Street",
-    ),
-    Vehicle(
-        "V3",
-        (37.7760, -122.4170),
-        "Park",
-        smart_vehicle=True,
-        mode="eco",
-        intersection="3rd_Street",
-    ),
-]
-
-
-def simulation_loop(steps=5, scenario="rush_hour"):
-    # Instantiate agents
-    signal_agent = TrafficSignalAgent()  # AI_AGENT_1
-    routing_agent = RoutingAgent()  # AI_AGENT_2
-    incident_agent = IncidentAgent()  # AI_AGENT_3
-    fairness_agent = FairnessAgent()  # AI_AGENT_4
-    smart_vehicle_agent = SmartVehicleAgent()  # AI_AGENT_5
-    drone_agent = DroneAgent()  # AI_AGENT_6
-
-    traffic_conditions = generate_scenario(scenario)
-    print(color_text(f"--- Starting Simulation: {scenario.upper()} ---", ANSI_CYAN))
-
-    for step in range(1, steps + 1):
-        print(color_text(f"\n=== Simulation Step {step} ===", ANSI_MAGENTA))
-
-        # 1. Adjust signals at each intersection using TrafficSignalAgent.
-        intersection_signal_states = {}
-        for intersection, coords in INTERSECTIONS.items():
-            lat, lon = coords
-            signal_state = signal_agent.adjust_signals(lat, lon, current_time=step * 10)
-            intersection_signal_states[intersection] = signal_state
-            print(color_text(f"\nIntersection: {intersection}", ANSI_BLUE))
-            # Display signal state for each direction with color-coded lights and emojis.
-            for direction, state in signal_state.items():
-                current = state["current_color"].upper()
-                if current == "GREEN":
-                    color = ANSI_GREEN
-                    circle = "🟢"
-                elif current == "YELLOW":
-                    color = ANSI_YELLOW
-                    circle = "🟡"
-                elif current == "RED":
-                    color = ANSI_RED
-                    circle = "🔴"
-                else:
-                    color = ANSI_RESET
-                    circle = ""
-                print(
-                    f"  {direction}: {color_text(current + ' ' + circle, color)}  (Time Remaining: {state['time_remaining']}s, Next: {state['next_color']})"
-                )
+# Create sample vehicles; the fleet stores them as arrays and yields Vehicle views.
+vehicles = VehicleFleet.from_vehicles(
+    [
+        Vehicle(
+            "V1",
+            (37.7749, -122.4194),
+            "Downtown",
+            smart_vehicle=True,
+            mode="autonomous",
+            intersection="1st_Street",
+        ),
+        Vehicle(
+            "V2",
+            (37.7755, -122.4180),
+            "Airport",
+            smart_vehicle=True,
+            mode="emergency",
+            intersection="2nd_Street",
+        ),
+        Vehicle(
+            "V3",
+            (37.7760, -122.4170),
+            "Park",
+            smart_vehicle=True,
+            mode="eco",
+            intersection="3rd_Street",
+        ),
+    ],
+    intersections=INTERSECTIONS,
+)
 
-            # DroneAgent scans the intersection.
-            drone_data = drone_agent.scan_traffic(intersection)
-            if drone_data["emergency_detected"]:
-                print(
-                    color_text(
-                        f"  [DroneAgent] Emergency detected at {intersection}! Prioritizing emergency response.",
-                        ANSI_RED,
-                    )
-                )
-                traffic_conditions[intersection] = 1.0
-            else:
-                traffic_conditions[intersection] = generate_scenario(scenario)[
-                    intersection
-                ]
-
-        # 2. Process smart vehicles.
-        for vehicle in vehicles:
-            vehicle_intersection = vehicle.intersection
-            current_wait = fairness_agent.wait_times.get(vehicle_intersection, 0)
-
-            smart_msg = smart_vehicle_agent.communicate(vehicle)
-            print(color_text(f"\n[SmartVehicleAgent] {smart_msg}", ANSI_CYAN))
-            print(
-                f"  Vehicle {vehicle.id} at intersection {vehicle_intersection} current wait time: {current_wait}s"
+# Intersections serving the sample fleet's destinations.
+DESTINATIONS = {
+    "Downtown": "3rd_Street",
+    "Airport": "1st_Street",
+    "Park": "2nd_Street",
+}
+
+
+class SimulationContext:
+    def __init__(
+        self,
+        scenario="rush_hour",
+        intersections=None,
+        vehicles=None,
+        rng=None,
+        sink=None,
+        record_trace=None,
+        replay_trace=None,
+        flow_provider=None,
+        adaptive_polling=FLOW_ADAPTIVE_POLLING,
+        vehicle_motion=VEHICLE_MOTION,
+        warm_start=None,
+        detached=False,
+    ):
+        """
+        Agents and mutable state shared by the fixed-step loop and the
+        event-driven runner. Each stage of a simulation step is a method so
+        either driver can invoke it.
+
+        Parameters:
+            scenario (str): Scenario name passed to generate_scenario.
+            intersections (dict): name -> (lat, lon); defaults to INTERSECTIONS.
+            vehicles (VehicleFleet): Moved in place; defaults to a copy of the
+                module-level sample fleet.
+            rng (random.Random): Seeded generator for drone scans and synthetic flow data.
+            sink (EventSink): Receives the simulation's output events; defaults to
+                a console sink flushed once per step.
+            record_trace (str): Record live flow responses to this trace file.
+            replay_trace (str): Serve flow data from this trace file, indexed by
+                simulated time, instead of calling the API.
+            flow_provider: Use this flow-data source instead of building one.
+            adaptive_polling (bool): Spend the FLOW_QUOTA_* API budget on the
+                intersections and segments that need fresh data most and
+                serve the rest their last value (live API only). Contexts in
+                one process share the budget.
+            vehicle_motion (bool): Move the fleet along its routes, queueing
+                at red approaches; fairness then ranks intersections by the
+                time vehicles actually waited instead of a congestion
+                estimate.
+            warm_start (bool): Resume the online and per-intersection models
+                from MODEL_CHECKPOINT_FILE / MODEL_REGISTRY_FILE and keep
+                saving them there; by default only when no seeded `rng` is
+                given. Cold runs leave both files alone.
+            detached (bool): Leave shared files alone: no traffic history,
+                model checkpoint (loaded or saved), model registry file,
+                trace recording or retraining. Used for forked what-if runs.
+        """
+        self.scenario = scenario
+        self.intersections = INTERSECTIONS if intersections is None else intersections
+        self.vehicles = globals()["vehicles"].copy() if vehicles is None else vehicles
+        self.sink = make_sink(flush_lines=1000) if sink is None else sink
+        self.step = 0
+        self.now = 0
+
+        # Instantiate agents; signal and routing share one cached flow-data source.
+        self.recorder = (
+            FlowTraceWriter(record_trace) if record_trace and not detached else None
+        )
+        if flow_provider is not None:
+            self.flow_provider = flow_provider
+        elif replay_trace:
+            self.flow_provider = FlowReplayProvider(
+                replay_trace, clock=lambda: self.now, rng=rng
             )
+        else:
+            self.flow_provider = FlowDataProvider(rng=rng, recorder=self.recorder)
+            if adaptive_polling:
+                self.flow_provider = AdaptiveFlowProvider(self.flow_provider)
+        self.flow_scheduler = (
+            self.flow_provider
+            if isinstance(self.flow_provider, AdaptiveFlowProvider)
+            else None
+        )
 
-            # For non-emergency vehicles, if wait time is high, update status to eco-mode.
-            if not vehicle.mode.lower() == "emergency" and current_wait > 50:
-                smart_vehicle_agent.send_update(
-                    vehicle,
-                    f"High wait time ({current_wait}s) at {vehicle_intersection}. Switching to eco-mode for efficiency.",
-                )
-                vehicle.update_mode("eco")
-            elif vehicle.mode.lower() == "emergency":
-                # Get approach direction from DroneAgent.
-                drone_data_vehicle = drone_agent.scan_traffic(vehicle_intersection)
-                approach_direction = drone_data_vehicle.get("approach_direction", "N")
-                smart_vehicle_agent.send_update(
-                    vehicle,
-                    f"Emergency override active. Your approach from {approach_direction} is prioritized with green light.",
-                )
-                # Build an emergency override signal state based on the approach direction.
-                emergency_signal_state = {}
-                for d in ["N", "S", "E", "W"]:
-                    if d == approach_direction:
-                        emergency_signal_state[d] = {
-                            "current_color": "GREEN",
-                            "time_remaining": 30,
-                            "next_color": "YELLOW",
-                            "movements": {
-                                "left": "GREEN",
-                                "straight": "GREEN",
-                                "right": "GREEN",
-                            },
-                        }
-                    else:
-                        emergency_signal_state[d] = {
-                            "current_color": "RED",
-                            "time_remaining": 30,
-                            "next_color": "GREEN",
-                            "movements": {
-                                "left": "RED",
-                                "straight": "RED",
-                                "right": "RED",
-                            },
-                        }
-                intersection_signal_states[vehicle_intersection] = (
-                    emergency_signal_state
-                )
-                print(
-                    color_text(
-                        f"  [EMERGENCY OVERRIDE] Intersection {vehicle_intersection} signals overridden: GREEN for {approach_direction}; RED for others.",
-                        ANSI_RED,
-                    )
-                )
-            else:
-                smart_vehicle_agent.send_update(
-                    vehicle, "No changes. Continue on current path."
+        # Vehicles without an intersection get the nearest one; flow lookups
+        # for vehicle positions are snapped to intersections, recorded
+        # segments or a coarse grid.
+        self.intersection_index = SpatialIndex.from_points(self.intersections)
+        segments = getattr(self.flow_provider, "segment_points", list)()
+        self.segment_index = (
+            SpatialIndex.from_points(self.intersections, segments)
+            if segments
+            else self.intersection_index
+        )
+        self.vehicles.assign_intersections(self.intersection_index)
+
+        if warm_start is None:
+            warm_start = rng is None
+        signal_options = dict(warm_start=warm_start and not detached)
+        if not signal_options["warm_start"]:
+            # Cold (seeded or forked) runs neither resume nor overwrite the
+            # persisted online and per-intersection models.
+            signal_options.update(
+                model_registry=(
+                    IntersectionModelRegistry(path=None)
+                    if PER_INTERSECTION_MODELS
+                    else None
+                ),
+                checkpoint_path=None,
+            )
+        if detached:
+            signal_options.update(history_writer=NullHistoryWriter())
+        self.signal_agent = TrafficSignalAgent(
+            self.flow_provider, **signal_options
+        )  # AI_AGENT_1
+        if detached:
+            self.signal_agent.retrain_scheduler.next_retrain_ts = math.inf
+        self.road_graph = RoadGraph.from_intersections(self.intersections)
+        self.routing_agent = RoutingAgent(
+            self.flow_provider, self.segment_index, self.road_graph, DESTINATIONS
+        )  # AI_AGENT_2
+        self.motion = (
+            VehicleMotion(self.vehicles, self.routing_agent, start_time=self.now)
+            if vehicle_motion
+            else None
+        )
+        self.incident_agent = IncidentAgent()  # AI_AGENT_3
+        self.fairness_agent = FairnessAgent()  # AI_AGENT_4
+        self.smart_vehicle_agent = SmartVehicleAgent(self.sink)  # AI_AGENT_5
+        self.drone_agent = DroneAgent(rng)  # AI_AGENT_6
+
+        self.traffic_conditions = generate_scenario(scenario)
+        self.intersection_signal_states = {}
+        self.ns_green = {}  # intersection -> N_S approach green at last adjust
+        self.step_flow = {}
+        self.vehicle_segments = []  # fleet row -> flow lookup key
+
+    @classmethod
+    def from_snapshot(cls, path, index=-1, **kwargs):
+        """
+        Resume from snapshot `index` (default: the latest) of a snapshot
+        file; keyword arguments are passed to the constructor. Arrays are
+        mapped copy-on-write from the file rather than read into memory.
+        """
+        reader = SnapshotReader(path)
+        sections = reader.arrays(index, mode="c")
+        state = reader.state(index)
+        ctx = cls(
+            state["scenario"],
+            intersections=snapshot_intersections(sections),
+            vehicles=snapshot_fleet(sections),
+            **kwargs,
+        )
+        restore_state(ctx, sections, state)
+        return ctx
+
+    def prefetch_flow_data(self):
+        """
+        Fetch flow data for every intersection and vehicle segment in one
+        concurrent batch.
+        """
+        n = len(self.vehicles)
+        self.vehicle_segments = self.segment_index.segment_keys(
+            self.vehicles.lat[:n], self.vehicles.lon[:n]
+        )
+        self.step_flow = self.flow_provider.fetch_many(
+            list(self.intersections.values()) + self.vehicle_segments
+        )
+
+    def update_flow_priorities(self):
+        """
+        Report prediction errors, fairness waits and drone-detected
+        emergencies to the adaptive poller, which uses them to pick the
+        points refreshed by the next prefetch.
+        """
+        scheduler = self.flow_scheduler
+        if scheduler is None:
+            return
+        names = list(self.intersections)
+        points = list(self.intersections.values())
+        errors = self.signal_agent.prediction_errors
+        scheduler.report_errors(points, [errors.get(point, 0.0) for point in points])
+        waits = self.fairness_agent.wait_times
+        scheduler.set_waits(points, [waits[name] for name in names])
+        scan = self.drone_agent.fresh_scan(self.now)
+        if scan is not None:
+            scheduler.set_emergencies(
+                points,
+                [
+                    name in scan and bool(scan.emergency[scan.index[name]])
+                    for name in names
+                ],
+            )
+
+    def vehicle_segment(self, vehicle):
+        """
+        Flow lookup key for a vehicle's position.
+        """
+        row = getattr(vehicle, "row", None)
+        if row is not None and row < len(self.vehicle_segments):
+            return self.vehicle_segments[row]
+        return self.segment_index.segment_key(*vehicle.location)
+
+    def flow_data_at(self, point):
+        flow_data = self.step_flow.get(point)
+        if flow_data is None:
+            flow_data = self.flow_provider.get_flow_data(*point)
+        return flow_data
+
+    def adjust_intersection(self, intersection, current_time):
+        """
+        Adjust signals at one intersection using TrafficSignalAgent.
+        """
+        coords = self.intersections[intersection]
+        lat, lon = coords
+        signal_state = self.signal_agent.adjust_signals(
+            lat, lon, current_time=current_time, flow_data=self.flow_data_at(coords)
+        )
+        self.intersection_signal_states[intersection] = signal_state
+        if self.motion is not None:
+            plan = self.signal_agent.signal_plans.get(intersection_key(lat, lon))
+            if plan is not None:
+                self.motion.set_plan(intersection, plan.ns_green, plan.ew_green)
+        if self.fairness_agent.reset_on_green:
+            ns_green = signal_state["N"]["current_color"] == "GREEN"
+            if ns_green and not self.ns_green.get(intersection, False):
+                self.fairness_agent.on_green(intersection)
+            self.ns_green[intersection] = ns_green
+        if self.sink.enabled:
+            self.sink.emit(SignalStateEvent(intersection, signal_state, self.now))
+        return signal_state
+
+    def scan_intersection(self, intersection):
+        """
+        DroneAgent scans the intersection (from the step's batched scan
+        when scan_all() has run).
+        """
+        drone_data = self.drone_agent.scan_traffic(intersection, self.now)
+        if drone_data["emergency_detected"]:
+            if self.sink.enabled:
+                self.sink.emit(DroneEmergency(intersection, self.now))
+            self.traffic_conditions[intersection] = 1.0
+        else:
+            self.traffic_conditions[intersection] = generate_scenario(
+                self.scenario
+            ).get(intersection, 0.3)
+        return drone_data
+
+    def move_fleet(self):
+        """
+        Advance every vehicle to the current simulated time under the
+        signal plans in force.
+        """
+        if self.motion is not None:
+            self.motion.advance(self.now)
+
+    def process_vehicle(self, vehicle):
+        """
+        Smart-vehicle messaging, emergency override, routing and incident
+        detection for one vehicle.
+        """
+        fairness_agent = self.fairness_agent
+        smart_vehicle_agent = self.smart_vehicle_agent
+        vehicle_intersection = vehicle.intersection
+        is_emergency = vehicle.mode_code == VehicleMode.EMERGENCY
+        current_wait = fairness_agent.wait_times.get(vehicle_intersection, 0)
+
+        sink = self.sink
+        if sink.enabled:
+            sink.emit(
+                VehicleStatus(
+                    vehicle.id,
+                    smart_vehicle_agent.communicate(vehicle),
+                    vehicle_intersection,
+                    current_wait,
+                    self.now,
                 )
+            )
 
-            # Vehicle routing decision via RoutingAgent.
-            lat, lon = vehicle.location
-            traffic_data = routing_agent.get_traffic_data(lat, lon)
-            route_msg = routing_agent.route_vehicle(vehicle, traffic_data)
-            print(f"  [RoutingAgent] {route_msg}")
-
-            # Incident detection via IncidentAgent.
-            if incident_agent.detect_incident(traffic_data):
-                print(
-                    color_text(
-                        f"  [IncidentAgent] Incident detected near vehicle {vehicle.id}!",
-                        ANSI_RED,
+        # For non-emergency vehicles, if wait time is high, update status to eco-mode.
+        if not is_emergency and current_wait > 50:
+            smart_vehicle_agent.send_update(
+                vehicle,
+                f"High wait time ({current_wait}s) at {vehicle_intersection}. Switching to eco-mode for efficiency.",
+            )
+            vehicle.update_mode("eco", sink)
+        elif is_emergency:
+            # Get approach direction from DroneAgent.
+            drone_data_vehicle = self.drone_agent.scan_traffic(
+                vehicle_intersection, self.now
+            )
+            approach_direction = drone_data_vehicle.get("approach_direction", "N")
+            smart_vehicle_agent.send_update(
+                vehicle,
+                f"Emergency override active. Your approach from {approach_direction} is prioritized with green light.",
+            )
+            # Build an emergency override signal state based on the approach direction.
+            emergency_signal_state = {}
+            for d in ["N", "S", "E", "W"]:
+                if d == approach_direction:
+                    emergency_signal_state[d] = {
+                        "current_color": "GREEN",
+                        "time_remaining": 30,
+                        "next_color": "YELLOW",
+                        "movements": {
+                            "left": "GREEN",
+                            "straight": "GREEN",
+                            "right": "GREEN",
+                        },
+                    }
+                else:
+                    emergency_signal_state[d] = {
+                        "current_color": "RED",
+                        "time_remaining": 30,
+                        "next_color": "GREEN",
+                        "movements": {
+                            "left": "RED",
+                            "straight": "RED",
+                            "right": "RED",
+                        },
+                    }
+            self.intersection_signal_states[vehicle_intersection] = (
+                emergency_signal_state
+            )
+            if sink.enabled:
+                sink.emit(
+                    SignalOverride(
+                        vehicle_intersection,
+                        approach_direction,
+                        emergency_signal_state,
+                        self.now,
                     )
                 )
-                traffic_conditions[vehicle_intersection] = max(
-                    traffic_conditions.get(vehicle_intersection, 0), 0.9
+        else:
+            smart_vehicle_agent.send_update(
+                vehicle, "No changes. Continue on current path."
+            )
+
+        # Vehicle routing decision via RoutingAgent.
+        traffic_data = self.flow_data_at(self.vehicle_segment(vehicle))
+        route_msg = self.routing_agent.route_vehicle(vehicle, traffic_data)
+        if sink.enabled:
+            sink.emit(RouteDecision(vehicle.id, route_msg, self.now))
+
+        # Incident detection via IncidentAgent.
+        if self.incident_agent.detect_incident(traffic_data):
+            if sink.enabled:
+                sink.emit(IncidentEvent(vehicle.id, vehicle_intersection, self.now))
+            self.traffic_conditions[vehicle_intersection] = float(
+                self.incident_agent.incident_conditions(
+                    self.traffic_conditions.get(vehicle_intersection, 0)
                 )
+            )
 
-        # 3. Fairness updates: update wait times based on current congestion.
-        for intersection, congestion in traffic_conditions.items():
-            fairness_agent.update_fairness(intersection, congestion * 10)
-        fairness_plan = fairness_agent.get_fair_signal_plan()
-        print(
-            color_text(
-                "\n[FairnessAgent] Fairness-based priority (highest wait times):",
-                ANSI_YELLOW,
+    def update_fairness(self):
+        """
+        Fairness updates: decay, then add the time vehicles spent queued at
+        each intersection since the last update (without vehicle motion,
+        an estimate from current congestion) in one batch.
+        """
+        self.fairness_agent.decay()
+        if self.motion is not None:
+            self.fairness_agent.update_many(
+                self.road_graph.names, self.motion.take_waits()
             )
+        else:
+            conditions = self.traffic_conditions
+            self.fairness_agent.update_many(
+                list(conditions), np.fromiter(conditions.values(), dtype=float) * 10
+            )
+        fairness_plan = self.fairness_agent.get_fair_signal_plan(FAIRNESS_TOP_K)
+        if self.sink.enabled:
+            self.sink.emit(FairnessRanking(fairness_plan, self.now))
+        return fairness_plan
+
+    def run_step(self, step):
+        """
+        One fixed simulation step at simulated time step * 10.
+        """
+        self.step = step
+        self.now = step * 10
+        sink = self.sink
+        metrics = get_metrics()
+        with metrics.profile_step(f"step_{step}"), metrics.timer("simulation.step"):
+            stages = metrics.stages("simulation.step")
+            if sink.enabled:
+                sink.emit(StepStarted(step, self.now))
+            self.prefetch_flow_data()
+            if stages:
+                stages.mark("prefetch")
+
+            # 1. Adjust signals and scan each intersection.
+            self.intersection_signal_states = {}
+            self.drone_agent.scan_all(self.intersections, self.now)
+            for intersection in self.intersections:
+                self.adjust_intersection(intersection, current_time=self.now)
+                self.scan_intersection(intersection)
+            self.road_graph.update_congestion(self.traffic_conditions)
+            if stages:
+                stages.mark("signals")
+
+            # 2. Move the fleet, then process smart vehicles; routing the
+            # fleet up front builds the shortest-path trees it needs in one
+            # batch.
+            self.move_fleet()
+            if stages:
+                stages.mark("motion")
+            self.routing_agent.route_fleet(self.vehicles)
+            for vehicle in self.vehicles:
+                self.process_vehicle(vehicle)
+            if stages:
+                stages.mark("vehicles")
+
+            # 3. Fairness updates.
+            self.update_fairness()
+            self.update_flow_priorities()
+            if stages:
+                stages.mark("fairness")
+            sink.flush()
+            if stages:
+                stages.mark("output")
+
+    def close(self):
+        self.flow_provider.close()
+        self.signal_agent.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        stats = self.flow_provider.stats()
+        if self.sink.enabled:
+            self.sink.emit(FlowCacheStats(stats["hits"], stats["misses"], self.now))
+        self.sink.close()
+
+
+def fork_scenarios(path, variants, index=-1, **kwargs):
+    """
+    `variants` independent contexts resumed from the same snapshot, e.g. to
+    try different interventions from one morning-rush starting point.
+
+    Every fork maps the snapshot's arrays copy-on-write, so the variants
+    share the file's pages until they change them; nothing is copied up
+    front. Forks are detached (see SimulationContext): they neither read
+    nor write the traffic history, model checkpoint, model registry file or
+    a recorded trace, and live forks share the process-wide flow request
+    budget. Keyword arguments go to every SimulationContext (e.g. a quiet
+    sink or a replay trace).
+    """
+    return [
+        SimulationContext.from_snapshot(path, index, detached=True, **kwargs)
+        for _ in range(variants)
+    ]
+
+
+def simulation_loop(
+    steps=5,
+    scenario="rush_hour",
+    step_delay=1.0,
+    seed=None,
+    sink=None,
+    record_trace=None,
+    replay_trace=None,
+    snapshot=None,
+    snapshot_every=1,
+    resume=None,
+):
+    """
+    Fixed-step simulation: every step adjusts all signals, scans every
+    intersection, processes every vehicle and updates fairness, then
+    sleeps `step_delay` seconds (0 runs as fast as possible). Output goes
+    to `sink` as structured events (default: the coloured console).
+    Flow data can be recorded to or replayed from a trace file.
+
+    With `snapshot`, the state is appended to that snapshot file every
+    `snapshot_every` steps; `resume` continues from the latest snapshot in
+    a file for another `steps` steps.
+    """
+    rng = random.Random(seed) if seed is not None else None
+    options = dict(
+        rng=rng, sink=sink, record_trace=record_trace, replay_trace=replay_trace
+    )
+    if resume:
+        ctx = SimulationContext.from_snapshot(resume, **options)
+    else:
+        ctx = SimulationContext(scenario, **options)
+    sink = ctx.sink
+    if sink.enabled:
+        sink.emit(SimulationStarted(ctx.scenario))
+    writer = SnapshotWriter(snapshot) if snapshot else None
+
+    first = ctx.step + 1
+    for step in range(first, first + steps):
+        ctx.run_step(step)
+        if writer is not None and step % snapshot_every == 0:
+            writer.write(ctx, label=f"step {step}")
+
+        if step_delay:
+            time.sleep(step_delay)
+
+    if writer is not None:
+        writer.close()
+    ctx.close()
+
+
+def run_event_simulation(
+    duration=3600,
+    scenario="rush_hour",
+    seed=None,
+    realtime=False,
+    speed=1.0,
+    scan_interval=10,
+    arrival_interval=10,
+    retrain_check_interval=60,
+    sink=None,
+    record_trace=None,
+    replay_trace=None,
+):
+    """
+    Event-driven simulation over `duration` simulated seconds.
+
+    Signal phase changes, drone scans, vehicle arrivals, fairness updates
+    and retrain checks are timestamped events on an EventScheduler. Each
+    intersection is re-planned when its current phase ends, and vehicles
+    arrive at their intersection at exponentially distributed intervals.
+    By default (headless) simulated time advances as fast as the CPU
+    allows; `realtime` paces one simulated second to 1 / `speed` wall
+    seconds. All randomness comes from generators seeded with `seed`.
+    """
+    scheduler = EventScheduler(realtime=realtime, speed=speed, seed=seed)
+    ctx = SimulationContext(
+        scenario,
+        rng=scheduler.rng,
+        sink=sink,
+        warm_start=seed is None,
+        record_trace=record_trace,
+        replay_trace=replay_trace,
+    )
+    # Vehicles arriving between scans see the latest one.
+    ctx.drone_agent.max_scan_age = scan_interval
+    sink = ctx.sink
+    if sink.enabled:
+        sink.emit(SimulationStarted(scenario, duration))
+
+    def on_signal_phase(scheduler, event):
+        intersection = event.payload
+        ctx.now = scheduler.now
+        state = ctx.adjust_intersection(intersection, current_time=scheduler.now)
+        next_change = min(state.ns_time_remaining, state.ew_time_remaining)
+        scheduler.schedule_in(
+            max(next_change, 1), SIGNAL_PHASE, on_signal_phase, intersection
+        )
+
+    def on_drone_scan(scheduler, event):
+        ctx.now = scheduler.now
+        sink.flush()
+        if sink.enabled:
+            sink.emit(StepStarted(time=scheduler.now))
+        ctx.prefetch_flow_data()
+        ctx.drone_agent.scan_all(ctx.intersections, scheduler.now)
+        for intersection in ctx.intersections:
+            ctx.scan_intersection(intersection)
+        ctx.road_graph.update_congestion(ctx.traffic_conditions)
+        ctx.move_fleet()
+        ctx.update_flow_priorities()
+
+    def on_vehicle_arrival(scheduler, event):
+        ctx.now = scheduler.now
+        ctx.process_vehicle(ctx.vehicles[event.payload])
+        scheduler.schedule_in(
+            scheduler.rng.expovariate(1 / arrival_interval),
+            VEHICLE_ARRIVAL,
+            on_vehicle_arrival,
+            event.payload,
         )
-        for intersection, wait_time in fairness_plan:
-            print(f"  {intersection}: Wait Time {wait_time}")
 
-        time.sleep(1)
+    def on_fairness_update(scheduler, event):
+        ctx.now = scheduler.now
+        ctx.update_fairness()
+
+    def on_retrain_check(scheduler, event):
+        ctx.signal_agent.retrain_scheduler.maybe_retrain()
+
+    scheduler.every(scan_interval, DRONE_SCAN, on_drone_scan)
+    for intersection in ctx.intersections:
+        scheduler.schedule(0, SIGNAL_PHASE, on_signal_phase, intersection)
+    for row in range(len(ctx.vehicles)):
+        scheduler.schedule(
+            scheduler.rng.expovariate(1 / arrival_interval),
+            VEHICLE_ARRIVAL,
+            on_vehicle_arrival,
+            row,
+        )
+    scheduler.every(
+        scan_interval, FAIRNESS_UPDATE, on_fairness_update, start=scan_interval
+    )
+    scheduler.every(retrain_check_interval, RETRAIN_CHECK, on_retrain_check)
+
+    scheduler.run(until=duration)
+    ctx.close()
+    return scheduler
 
 
 if __name__ == "__main__":
-    simulation_loop(steps=5, scenario="rush_hour")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the traffic simulation.")
+    parser.add_argument("--scenario", default="rush_hour")
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        help="Run the event-driven simulation for this many simulated seconds.",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Pace the event-driven simulation to wall-clock time.",
+    )
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument(
+        "--output",
+        choices=("console", "jsonl", "both", "quiet"),
+        default=EVENT_SINK,
+        help="Where simulation events go.",
+    )
+    parser.add_argument("--events-file", default=EVENT_LOG_FILE)
+    parser.add_argument(
+        "--record", metavar="TRACE", help="Record flow responses to a trace file."
+    )
+    parser.add_argument(
+        "--replay", metavar="TRACE", help="Replay flow data from a trace file."
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="Append a state snapshot to FILE after every step.",
+    )
+    parser.add_argument(
+        "--snapshot-every", type=int, default=1, help="Steps between snapshots."
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="FILE",
+        help="Resume from the latest snapshot in FILE for --steps more steps.",
+    )
+    parser.add_argument(
+        "--metrics", action="store_true", help="Enable timers and counters."
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=METRICS_SNAPSHOT_FILE,
+        help="Periodic metrics snapshot (JSON, or Prometheus text if it ends in .prom).",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics.",
+    )
+    parser.add_argument(
+        "--profile-step",
+        action="store_true",
+        help="cProfile the first step (send SIGUSR1 to profile the next step).",
+    )
+    args = parser.parse_args()
+    sink = make_sink(args.output, args.events_file, flush_lines=1000)
+
+    metrics = get_metrics()
+    exporter = server = None
+    if args.metrics or args.metrics_port is not None:
+        metrics.enable()
+        exporter = SnapshotExporter(metrics, args.metrics_file).start()
+        if args.metrics_port is not None:
+            server = MetricsServer(metrics, port=args.metrics_port).start()
+            print("Serving metrics at", server.url)
+    if args.profile_step:
+        metrics.request_profile()
+    if hasattr(signal, "SIGUSR1"):  # not available on Windows
+        signal.signal(signal.SIGUSR1, lambda signum, frame: metrics.request_profile())
+    if args.duration is not None:
+        run_event_simulation(
+            args.duration,
+            args.scenario,
+            seed=args.seed,
+            realtime=args.realtime,
+            speed=args.speed,
+            sink=sink,
+            record_trace=args.record,
+            replay_trace=args.replay,
+        )
+    else:
+        simulation_loop(
+            steps=args.steps,
+            scenario=args.scenario,
+            seed=args.seed,
+            sink=sink,
+            record_trace=args.record,
+            replay_trace=args.replay,
+            snapshot=args.snapshot,
+            snapshot_every=args.snapshot_every,
+            resume=args.resume,
+        )
+
+    if exporter is not None:
+        exporter.stop()
+    if server is not None:
+        server.stop()
@@ -0,0 +1,387 @@
+# snapshot.py
+
+import hashlib
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from agents.predictor import predictor_from_state, predictor_state
+from agents.vehicle_fleet import VehicleFleet
+from config import SNAPSHOT_FILE
+
+# Snapshot file layout (little-endian), append-only:
+#   header   SNAPSHOT_HEADER padded to ALIGNMENT bytes
+#   records  RECORD_HEADER, a JSON description and a payload, each padded to
+#            ALIGNMENT bytes so payloads can be memory-mapped:
+#              SECT  one state array; described by name, dtype, shape and
+#                    content digest, with the raw array bytes as payload
+#              INDX  one snapshot: schema version, label, scalar state and
+#                    the offset of the SECT record holding each array;
+#                    arrays that did not change point at earlier records
+SNAPSHOT_MAGIC = b"SIMSNAP1"
+SNAPSHOT_HEADER = struct.Struct("<8sI")  # magic, schema version
+RECORD_HEADER = struct.Struct("<4sIQ")  # kind, description bytes, payload bytes
+ALIGNMENT = 64
+SECTION = b"SECT"
+INDEX = b"INDX"
+
+# Bump when a section or state key changes meaning; files written with a
+# newer schema are refused.
+SCHEMA_VERSION = 1
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _strings(values):
+    """
+    UTF-8 byte-string array for a list of names.
+    """
+    encoded = [str(value).encode() for value in values]
+    return np.array(encoded, dtype=f"S{max(map(len, encoded), default=1) or 1}")
+
+
+def _names(array):
+    return [value.decode() for value in array.tolist()]
+
+
+def _digest(array):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{array.dtype.descr}{array.shape}".encode())
+    digest.update(memoryview(array.reshape(-1).view(np.uint8)))
+    return digest.hexdigest()
+
+
+def capture_state(ctx):
+    """
+    Everything needed to resume a SimulationContext, as (sections, state):
+    sections maps names to arrays, state holds JSON-serializable scalars.
+    Derived state (signal plans and states, routing trees, prefetched flow
+    data, the drone scan cache) is rebuilt by the next step and not saved.
+    """
+    names = list(ctx.intersections)
+    fleet = ctx.vehicles
+    n = len(fleet)
+    signal_agent = ctx.signal_agent
+    next_hops = ctx.routing_agent.next_hops
+    errors = signal_agent.prediction_errors
+    sections = {
+        "intersections.names": _strings(names),
+        "intersections.coords": np.array(
+            list(ctx.intersections.values()), dtype=float
+        ).reshape(-1, 2),
+        "conditions.names": _strings(ctx.traffic_conditions),
+        "conditions.values": np.fromiter(ctx.traffic_conditions.values(), dtype=float),
+        "signals.ns_green": np.array(
+            [ctx.ns_green.get(name, False) for name in names], dtype=bool
+        ),
+        "fleet.ids": _strings(fleet.ids[:n]),
+        "fleet.lat": fleet.lat[:n],
+        "fleet.lon": fleet.lon[:n],
+        "fleet.destination": fleet.destination[:n],
+        "fleet.mode": fleet.mode[:n],
+        "fleet.smart": fleet.smart[:n],
+        "fleet.intersection": fleet.intersection[:n],
+        "fleet.destinations": _strings(fleet.destinations),
+        "fleet.intersections": _strings(fleet.intersections),
+        "fairness.names": _strings(ctx.fairness_agent.names),
+        "fairness.waits": ctx.fairness_agent.waits(),
+        "road.congestion": ctx.road_graph.congestion,
+        "routing.vehicles": _strings(next_hops),
+        "routing.next_hops": _strings(next_hops.values()),
+        "prediction_errors.points": np.array(list(errors), dtype=float).reshape(-1, 2),
+        "prediction_errors.values": np.fromiter(errors.values(), dtype=float),
+    }
+    for key, value in predictor_state(signal_agent.online_model).items():
+        sections[f"model.{key}"] = value
+    if signal_agent.model_registry is not None:
+        sections["registry"] = signal_agent.model_registry.records()
+    if ctx.motion is not None:
+        for key, value in ctx.motion.arrays().items():
+            sections[f"motion.{key}"] = value
+
+    drone = ctx.drone_agent
+    version, internal, gauss = drone.rng.getstate()
+    state = {
+        "scenario": ctx.scenario,
+        "step": ctx.step,
+        "now": ctx.now,
+        "drone_rng": [version, list(internal), gauss],
+    }
+    if ctx.motion is not None:
+        state["motion_time"] = ctx.motion.time
+    backend = drone.backend
+    if hasattr(backend, "np_rng"):
+        state["drone_backend_rng"] = backend.np_rng.bit_generator.state
+    if hasattr(backend, "position"):
+        state["drone_backend_position"] = backend.position
+    return sections, state
+
+
+def snapshot_intersections(sections):
+    """
+    The snapshot's {name: (lat, lon)} network.
+    """
+    coords = sections["intersections.coords"].tolist()
+    return dict(zip(_names(sections["intersections.names"]), map(tuple, coords)))
+
+
+def snapshot_fleet(sections):
+    """
+    VehicleFleet over the snapshot's fleet sections (adopted, not copied).
+    """
+    return VehicleFleet.from_arrays(
+        _names(sections["fleet.ids"]),
+        sections["fleet.lat"],
+        sections["fleet.lon"],
+        sections["fleet.destination"],
+        sections["fleet.mode"],
+        sections["fleet.smart"],
+        sections["fleet.intersection"],
+        _names(sections["fleet.destinations"]),
+        _names(sections["fleet.intersections"]),
+    )
+
+
+def restore_state(ctx, sections, state):
+    """
+    Load captured state into a SimulationContext built over the snapshot's
+    intersections and fleet (see snapshot_intersections / snapshot_fleet).
+    Large arrays are adopted as given, so memory-mapped sections stay
+    mapped until modified.
+    """
+    names = _names(sections["intersections.names"])
+    if names != list(ctx.intersections):
+        raise ValueError("Snapshot was taken on a different intersection network.")
+    ctx.scenario = state["scenario"]
+    ctx.step = state["step"]
+    ctx.now = state["now"]
+    ctx.traffic_conditions = dict(
+        zip(
+            _names(sections["conditions.names"]),
+            sections["conditions.values"].tolist(),
+        )
+    )
+    ctx.ns_green = dict(zip(names, sections["signals.ns_green"].tolist()))
+    ctx.fairness_agent.load_waits(
+        _names(sections["fairness.names"]), sections["fairness.waits"]
+    )
+    ctx.road_graph.update_congestion(sections["road.congestion"], tolerance=0)
+    ctx.routing_agent.next_hops = dict(
+        zip(
+            _names(sections["routing.vehicles"]),
+            _names(sections["routing.next_hops"]),
+        )
+    )
+
+    signal_agent = ctx.signal_agent
+    signal_agent.prediction_errors = dict(
+        zip(
+            map(tuple, sections["prediction_errors.points"].tolist()),
+            sections["prediction_errors.values"].tolist(),
+        )
+    )
+    signal_agent.online_model = predictor_from_state(
+        {
+            name[len("model.") :]: array
+            for name, array in sections.items()
+            if name.startswith("model.")
+        }
+    )
+    if signal_agent.model_registry is not None and "registry" in sections:
+        signal_agent.model_registry.load_records(sections["registry"])
+    if ctx.motion is not None and "motion_time" in state:
+        ctx.motion.load_arrays(
+            {
+                name[len("motion.") :]: array
+                for name, array in sections.items()
+                if name.startswith("motion.")
+            },
+            state["motion_time"],
+        )
+
+    drone = ctx.drone_agent
+    version, internal, gauss = state["drone_rng"]
+    drone.rng.setstate((version, tuple(internal), gauss))
+    drone.current_scan = None
+    drone._scan_key = None
+    if "drone_backend_rng" in state:
+        drone.backend.np_rng.bit_generator.state = state["drone_backend_rng"]
+    if "drone_backend_position" in state:
+        drone.backend.position = state["drone_backend_position"]
+
+
+class SnapshotReader:
+    def __init__(self, path=SNAPSHOT_FILE):
+        """
+        Index of the snapshots in a snapshot file. Only record headers are
+        read; arrays() memory-maps section payloads on demand. A partially
+        written tail (e.g. from a crash mid-write) is ignored.
+        """
+        self.path = path
+        self.records = {}  # SECT record offset -> description + payload offset
+        self.snapshots = []  # INDX descriptions, oldest first
+        self.end = 0  # end of the last complete snapshot
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            magic, version = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a snapshot file.")
+            if version > SCHEMA_VERSION:
+                raise ValueError(
+                    f"{path} uses snapshot schema {version}; this version reads up to {SCHEMA_VERSION}."
+                )
+            offset = self.end = _aligned(SNAPSHOT_HEADER.size)
+            while offset + RECORD_HEADER.size <= size:
+                f.seek(offset)
+                kind, described, payload = RECORD_HEADER.unpack(
+                    f.read(RECORD_HEADER.size)
+                )
+                start = _aligned(offset + RECORD_HEADER.size + described)
+                end = _aligned(start + payload)
+                if end > size:
+                    break
+                description = json.loads(f.read(described))
+                if kind == SECTION:
+                    description["payload"] = start
+                    self.records[offset] = description
+                elif kind == INDEX:
+                    self.snapshots.append(description)
+                    self.end = end
+                else:
+                    raise ValueError(f"Unknown snapshot record {kind!r} at {offset}.")
+                offset = end
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def labels(self):
+        return [snapshot.get("label") for snapshot in self.snapshots]
+
+    def state(self, index=-1):
+        return self.snapshots[index]["state"]
+
+    def section_records(self, index=-1):
+        """
+        {section name: SECT record offset} of one snapshot.
+        """
+        return self.snapshots[index]["sections"]
+
+    def arrays(self, index=-1, mode="r"):
+        """
+        {section name: array} of one snapshot, memory-mapped from the file.
+        With mode "c" (copy-on-write) the arrays can be modified in memory:
+        pages are shared with every other mapping of the file until written.
+        """
+        arrays = {}
+        for name, offset in self.section_records(index).items():
+            record = self.records[offset]
+            dtype = np.lib.format.descr_to_dtype(record["dtype"])
+            shape = tuple(record["shape"])
+            count = int(np.prod(shape))
+            if count == 0:
+                # np.memmap cannot map an empty region.
+                arrays[name] = np.zeros(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(
+                self.path,
+                dtype=dtype,
+                mode=mode,
+                offset=record["payload"],
+                shape=shape or (1,),
+            ).reshape(shape)
+        return arrays
+
+
+class SnapshotWriter:
+    def __init__(self, path=SNAPSHOT_FILE):
+        """
+        Appends snapshots to a snapshot file.
+
+        Each write stores only the sections whose contents changed since
+        the previous snapshot in the file and references the rest, so a
+        step that moved a few vehicles rewrites the fleet positions but
+        not the model registry or the network. An existing file is
+        continued after dropping any partially written tail.
+        """
+        self.path = path
+        self._sections = {}  # name -> (digest, SECT offset) in the latest snapshot
+        self.bytes_written = 0
+        self.sections_written = 0
+        self.sections_reused = 0
+        if os.path.exists(path) and os.path.getsize(path):
+            reader = SnapshotReader(path)
+            self.snapshots = len(reader)
+            if reader.snapshots:
+                for name, offset in reader.section_records().items():
+                    self._sections[name] = (reader.records[offset]["digest"], offset)
+            self._file = open(path, "r+b")
+            self._file.truncate(reader.end)
+            self._file.seek(reader.end)
+        else:
+            self.snapshots = 0
+            self._file = open(path, "wb")
+            header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SCHEMA_VERSION)
+            self._file.write(header.ljust(_aligned(len(header)), b"\0"))
+
+    def _append(self, kind, description, payload=b""):
+        offset = self._file.tell()
+        description = json.dumps(description).encode()
+        payload = memoryview(payload).cast("B")
+        head = RECORD_HEADER.pack(kind, len(description), payload.nbytes)
+        head += description
+        self._file.write(head.ljust(_aligned(offset + len(head)) - offset, b"\0"))
+        self._file.write(payload)
+        self._file.write(b"\0" * (_aligned(payload.nbytes) - payload.nbytes))
+        self.bytes_written += self._file.tell() - offset
+        return offset
+
+    def write(self, ctx, label=None):
+        """
+        Snapshot a SimulationContext; returns the snapshot's number.
+        """
+        sections, state = capture_state(ctx)
+        return self.write_state(sections, state, label)
+
+    def write_state(self, sections, state, label=None):
+        references = {}
+        for name, array in sections.items():
+            array = np.asarray(array, order="C")
+            digest = _digest(array)
+            previous = self._sections.get(name)
+            if previous is not None and previous[0] == digest:
+                references[name] = previous[1]
+                self.sections_reused += 1
+                continue
+            description = {
+                "name": name,
+                "dtype": np.lib.format.dtype_to_descr(array.dtype),
+                "shape": list(array.shape),
+                "digest": digest,
+            }
+            payload = array.reshape(-1).view(np.uint8)
+            references[name] = self._append(SECTION, description, payload)
+            self._sections[name] = (digest, references[name])
+            self.sections_written += 1
+        self._append(
+            INDEX,
+            {
+                "schema": SCHEMA_VERSION,
+                "label": label,
+                "created_at": time.time(),
+                "state": state,
+                "sections": references,
+            },
+        )
+        self._file.flush()
+        self.snapshots += 1
+        return self.snapshots - 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,138 @@
+# stub_flow_server.py
+
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FLOW_PATH = "/traffic/services/4/flowSegmentData/relative0/10/json"
+
+
+def stub_flow(point, free_flow_speed=60):
+    """
+    Deterministic flowSegmentData for a "lat,lon" point string.
+    """
+    current_speed = 10 + zlib.crc32(point.encode()) % (free_flow_speed - 9)
+    return {
+        "currentSpeed": current_speed,
+        "freeFlowSpeed": free_flow_speed,
+        "confidence": 1.0,
+    }
+
+
+class StubFlowProvider:
+    def __init__(self, free_flow_speed=60):
+        """
+        In-process stand-in for FlowDataProvider serving the same answers as
+        StubFlowServer without HTTP, for benchmarks and offline runs.
+        """
+        self.free_flow_speed = free_flow_speed
+        self.hits = 0
+        self.misses = 0
+
+    def get_flow_data(self, lat, lon):
+        self.misses += 1
+        return stub_flow(f"{lat},{lon}", self.free_flow_speed)
+
+    def fetch_many(self, points, deadline=None, fallback=True):
+        results = {}
+        for point in points:
+            if point not in results:
+                results[point] = self.get_flow_data(*point)
+        return results
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": 0}
+
+    def clear(self):
+        pass
+
+
+class StubFlowServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, free_flow_speed=60):
+        """
+        Local stand-in for the TomTom flowSegmentData endpoint.
+
+        Parameters:
+            host (str): Interface to bind.
+            port (int): Port to bind; 0 picks a free one.
+            latency (float): Seconds to sleep before answering each request.
+            free_flow_speed (int): freeFlowSpeed reported for every point.
+
+        Current speeds are derived from the requested point, so repeated
+        lookups of the same point return the same answer.
+        """
+        self.latency = latency
+        self.free_flow_speed = free_flow_speed
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{FLOW_PATH}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="stub-flow-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def flow_for(self, point):
+        return {"flowSegmentData": stub_flow(point, self.free_flow_speed)}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with stub._count_lock:
+                    stub.request_count += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                parsed = urlparse(self.path)
+                point = parse_qs(parsed.query).get("point", [""])[0]
+                if parsed.path != FLOW_PATH or not point:
+                    self.send_error(400, "Missing point")
+                    return
+                body = json.dumps(stub.flow_for(point)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    server = StubFlowServer(port=8765)
+    print("Serving stub flow data at", server.url)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,107 @@
+# tests/test_predictor.py
+
+import numpy as np
+import pytest
+
+from agents.predictor import (
+    CongestionPredictor,
+    NumpyOnlinePredictor,
+    load_predictor,
+    save_predictor,
+)
+
+sklearn_linear_model = pytest.importorskip("sklearn.linear_model")
+
+
+def make_sgd():
+    return sklearn_linear_model.SGDRegressor(max_iter=1000, tol=1e-3, shuffle=False)
+
+
+def make_samples(n, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(0, 1, (n, 2))
+    y = X @ np.array([0.6, -0.3]) + 0.2 + rng.normal(0, 0.05, n)
+    return X, y
+
+
+def assert_same_model(predictor, model):
+    coef, intercept, t = predictor.get_weights()
+    np.testing.assert_allclose(coef, model.coef_, rtol=1e-9, atol=1e-12)
+    assert intercept == pytest.approx(model.intercept_[0], rel=1e-9, abs=1e-12)
+    assert t == model.t_
+
+
+def test_single_row_updates_match_sgd_regressor():
+    X, y = make_samples(300)
+    predictor = NumpyOnlinePredictor(scale=False)
+    model = make_sgd()
+    for i in range(len(y)):
+        predictor.partial_fit(X[i : i + 1], y[i : i + 1])
+        model.partial_fit(X[i : i + 1], y[i : i + 1])
+    assert_same_model(predictor, model)
+    np.testing.assert_allclose(predictor.predict(X), model.predict(X), rtol=1e-9)
+
+
+def test_predict_update_one_matches_partial_fit():
+    X, y = make_samples(100)
+    fast = NumpyOnlinePredictor(scale=False)
+    reference = NumpyOnlinePredictor(scale=False)
+    for (current, free_flow), actual in zip(X.tolist(), y.tolist()):
+        predicted = fast.predict_update_one(current, free_flow, actual)
+        assert predicted == pytest.approx(
+            reference.predict(np.array([[current, free_flow]]))[0]
+        )
+        reference.partial_fit(np.array([[current, free_flow]]), np.array([actual]))
+    np.testing.assert_allclose(fast.coef, reference.coef)
+    assert fast.t == reference.t
+
+
+@pytest.mark.parametrize("batch", [2, 17, 100])
+def test_batch_updates_match_sgd_regressor(batch):
+    X, y = make_samples(300, seed=1)
+    predictor = NumpyOnlinePredictor(scale=False)
+    model = make_sgd()
+    for start in range(0, len(y), batch):
+        predictor.partial_fit(X[start : start + batch], y[start : start + batch])
+        model.partial_fit(X[start : start + batch], y[start : start + batch])
+    assert_same_model(predictor, model)
+
+
+def test_from_sklearn_continues_training_like_sgd_regressor():
+    X, y = make_samples(400, seed=2)
+    model = make_sgd()
+    model.partial_fit(X[:200], y[:200])
+    predictor = NumpyOnlinePredictor.from_sklearn(model)
+    assert_same_model(predictor, model)
+    predictor.partial_fit(X[200:], y[200:])
+    model.partial_fit(X[200:], y[200:])
+    assert_same_model(predictor, model)
+
+
+def test_to_sklearn_exports_the_same_model():
+    X, y = make_samples(400, seed=3)
+    predictor = NumpyOnlinePredictor(scale=False)
+    predictor.partial_fit(X[:200], y[:200])
+    model = predictor.to_sklearn()
+    assert_same_model(predictor, model)
+    np.testing.assert_allclose(model.predict(X), predictor.predict(X), rtol=1e-9)
+    # A fresh SGDRegressor defaults to shuffling; turn it off to compare.
+    model.set_params(shuffle=False)
+    predictor.partial_fit(X[200:], y[200:])
+    model.partial_fit(X[200:], y[200:])
+    assert_same_model(predictor, model)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    X, y = make_samples(50, seed=4)
+    predictor = NumpyOnlinePredictor(scale=True)
+    predictor.partial_fit(X, y)
+    path = save_predictor(predictor, str(tmp_path / "model.npz"))
+    restored = load_predictor(path, backend="numpy")
+    np.testing.assert_allclose(restored.predict(X), predictor.predict(X))
+    assert restored.t == predictor.t
+
+
+def test_predictor_interface_is_abstract():
+    with pytest.raises(TypeError):
+        CongestionPredictor()